@@ -3,7 +3,8 @@ AlexRentaCar Admin Application Factory
 Initializes Flask app with all extensions and blueprints
 """
 import os
-from flask import Flask, request, render_template, jsonify
+import click
+from flask import Flask, request, render_template, jsonify, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
@@ -110,6 +111,8 @@ def create_app(config_name=None):
     from app.routes.propietarios_routes import propietario_bp
     from app.routes.vehiculos_routes import vehiculo_bp
     from app.routes.alquileres_routes import alquileres_bp
+    from app.routes.tareas_routes import tareas_bp
+    from app.routes.archivos_routes import archivos_bp
     
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(admin_bp, url_prefix='/admin')
@@ -122,12 +125,34 @@ def create_app(config_name=None):
     app.register_blueprint(inquilino_bp, url_prefix='/')
     app.register_blueprint(propietario_bp, url_prefix='/')
     app.register_blueprint(vehiculo_bp, url_prefix='/') 
+    app.register_blueprint(tareas_bp, url_prefix='/tareas')
+    app.register_blueprint(archivos_bp, url_prefix='/archivos')
+    
+    # Servicios que mantienen columnas y tablas derivadas con eventos del ORM
+    from app.services import contador_service, libro_service, sombra_service  # noqa: F401
+    
+    # Los archivos subidos solo se entregan por /archivos (con permisos)
+    @app.before_request
+    def proteger_uploads():
+        if request.path.startswith(f'{app.static_url_path}/uploads/'):
+            return render_template('errors/404.html'), 404
     
     # Root route
     @app.route('/')
     def index():
         return render_template('auth/login.html')
     
+    # Template filters
+    @app.template_filter('miniatura')
+    def miniatura_filter(valor):
+        """Miniatura guardada de una VehiculoImagen (o su original); una ruta suelta se devuelve tal cual"""
+        return getattr(valor, 'miniatura', valor)
+    
+    @app.template_filter('archivo_url')
+    def archivo_url_filter(ruta):
+        """URL protegida de un archivo subido (ver archivos_routes)"""
+        return url_for('archivos.servir_archivo', ruta=ruta) if ruta else ''
+    
     # Error handlers
     @app.errorhandler(404)
     def not_found_error(error):
@@ -173,6 +198,220 @@ def create_app(config_name=None):
         else:
             print("Error creating admin user")
     
+    @app.cli.command()
+    @click.option('--anio', type=int, default=None, help='Solo las semanas de este año')
+    @click.option('--semana', 'semana_ids', type=int, multiple=True, help='ID de semana (repetible)')
+    def recalcular_nomina(anio, semana_ids):
+        """Recalculate payroll of historical weeks with the fixed-point kernel"""
+        from app.services.nomina_service import recalcular_semanas
+        detalles, semanas = recalcular_semanas(anio=anio, semana_ids=semana_ids)
+        print(f"{detalles} detalles recalculados en {semanas} semanas")
+    
+    @app.cli.command()
+    @click.option('--procesos', type=int, default=None, help='Número de procesos worker')
+    @click.option('--una-vez', is_flag=True, help='Terminar cuando la cola quede vacía')
+    def worker(procesos, una_vez):
+        """Run background job workers (DB-backed queue)"""
+        from app.services.tarea_service import iniciar_workers
+        procesos = procesos or app.config.get('TAREAS_PROCESOS', 1)
+        print(f"Iniciando {procesos} worker(s)...")
+        iniciar_workers(procesos, una_vez=una_vez)
+    
+    @app.cli.command()
+    def generar_variantes():
+        """Queue thumbnail/display variants for vehicle images that lack them"""
+        from app.models import VehiculoImagen
+        from app.services.media_service import encolar_variantes
+        pendientes = VehiculoImagen.query.filter(
+            VehiculoImagen.tipo == 'imagen',
+            VehiculoImagen.ruta_miniatura.is_(None)
+        ).with_entities(VehiculoImagen.id).all()
+        for (imagen_id,) in pendientes:
+            encolar_variantes(imagen_id=imagen_id)
+        db.session.commit()
+        print(f"{len(pendientes)} imágenes encoladas")
+    
+    @app.cli.command()
+    @click.option('--fecha', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Fecha de cálculo (por defecto hoy)')
+    def actualizar_mora(fecha):
+        """Nightly batch: recompute overdue status, days late and penalties"""
+        from app.services.mora_service import actualizar_moras
+        resumen = actualizar_moras(fecha.date() if fecha else None)
+        print(f"Mora actualizada al {resumen['fecha']}: "
+              f"{resumen['detalles_en_mora']} detalles en mora, "
+              f"{resumen['deudas_vencidas']} deudas vencidas, "
+              f"{resumen['snapshots_regenerados']} snapshots regenerados")
+    
+    @app.cli.command()
+    @click.option('--modo', type=click.Choice(['simular', 'cuarentena', 'eliminar']), default='cuarentena',
+                  help='simular solo reporta; cuarentena mueve los archivos; eliminar los borra')
+    @click.option('--gracia', type=int, default=None, help='Horas de antigüedad mínima de un archivo huérfano')
+    def limpiar_archivos(modo, gracia):
+        """Garbage-collect upload files no longer referenced by any record"""
+        from app.services.limpieza_service import limpiar_archivos
+        resumen = limpiar_archivos(modo=modo, gracia_horas=gracia)
+        print(f"{resumen['archivos_revisados']} archivos revisados, "
+              f"{resumen['huerfanos']} huérfanos ({resumen['bytes_recuperados'] / 1024 / 1024:.1f} MB), "
+              f"{resumen['referencias_corregidas']} referencias corregidas, "
+              f"{resumen['faltantes']} rutas sin archivo")
+        if resumen['cuarentena'] and resumen['huerfanos']:
+            print(f"Lote de cuarentena: {resumen['cuarentena']}")
+    
+    @app.cli.command()
+    @click.option('--lote', type=int, default=200, help='Filas por lote (un commit por lote)')
+    @click.option('--reiniciar', is_flag=True, help='Ignorar los puntos de control y empezar de cero')
+    def migrar_uploads(lote, reiniciar):
+        """Move files from the flat upload folders into the sharded store (resumable)"""
+        from app.services.migracion_service import migrar_uploads
+        resumen = migrar_uploads(tamano_lote=lote, reiniciar=reiniciar)
+        print(f"{resumen['archivos']} archivos migrados, {resumen['rutas']} rutas reescritas, "
+              f"{resumen['faltantes']} rutas sin archivo")
+        print("Los originales quedan como huérfanos: ejecute `flask limpiar-archivos` para recogerlos")
+
+    @app.cli.command()
+    @click.option('--lote', type=int, default=200, help='Filas por lote (un commit por lote)')
+    @click.option('--reiniciar', is_flag=True, help='Ignorar los puntos de control y empezar de cero')
+    def cifrar_documentos(lote, reiniciar):
+        """Encrypt identity documents stored in plaintext (resumable)"""
+        from app.services.migracion_service import cifrar_documentos
+        resumen = cifrar_documentos(tamano_lote=lote, reiniciar=reiniciar)
+        print(f"{resumen['archivos']} documentos cifrados, {resumen['rutas']} rutas reescritas, "
+              f"{resumen['faltantes']} rutas sin archivo")
+
+    @app.cli.command()
+    @click.option('--mb', type=int, default=10, help='Tamaño del documento de prueba en MB')
+    @click.option('--repeticiones', type=int, default=5, help='Se reporta la mejor de N ejecuciones')
+    def benchmark_cifrado(mb, repeticiones):
+        """Measure streaming document encryption/decryption throughput"""
+        from app.services.cifrado_service import medir_rendimiento
+        resultado = medir_rendimiento(tamano=mb * 1024 * 1024, repeticiones=repeticiones)
+        print(f"Documento de {mb} MB:")
+        print(f"  cifrar:    {resultado['cifrar_ms']} ms ({resultado['cifrar_mb_s']} MB/s)")
+        print(f"  descifrar: {resultado['descifrar_ms']} ms ({resultado['descifrar_mb_s']} MB/s)")
+
+    @app.cli.command()
+    @click.option('--filas', type=int, default=1000, help='Filas del listado simulado')
+    @click.option('--campos', type=int, default=7, help='Columnas cifradas por fila')
+    def benchmark_columnas(filas, campos):
+        """Measure per-row decryption cost of encrypted columns on list endpoints"""
+        from app.services.benchmark_service import medir_columnas
+        resultado = medir_columnas(filas=filas, campos=campos)
+        print(f"Listado de {filas} filas x {campos} columnas cifradas (µs por fila):")
+        print(f"  propiedades (antes):        {resultado['propiedades_us_fila']}")
+        print(f"  EncryptedText, leídas:      {resultado['tipo_us_fila']}")
+        print(f"  EncryptedText, sin leer:    {resultado['tipo_sin_leer_us_fila']}")
+
+    @app.cli.command('benchmark-cripto')
+    @click.option('--salida', type=click.Path(dir_okay=False), default=None, help='Guardar el JSON en este archivo')
+    @click.option('--base', type=click.Path(exists=True, dir_okay=False), default=None,
+                  help='JSON de una corrida anterior para detectar regresiones')
+    @click.option('--tolerancia', type=float, default=0.25, help='Aumento tolerado frente a --base (0.25 = 25%)')
+    @click.option('--repeticiones', type=int, default=5, help='Se toma la mejor de N ejecuciones')
+    def benchmark_cripto(salida, base, tolerancia, repeticiones):
+        """Run the encryption micro-benchmark suite and report it as JSON"""
+        import json
+        from app.services.benchmark_service import comparar_suite, suite_cifrado
+        resultado = suite_cifrado(repeticiones=repeticiones)
+        texto = json.dumps(resultado, indent=2, sort_keys=True, ensure_ascii=False)
+        if salida:
+            with open(salida, 'w', encoding='utf-8') as f:
+                f.write(texto + '\n')
+            print(f"Resultados guardados en {salida}")
+        else:
+            print(texto)
+
+        if base:
+            with open(base, encoding='utf-8') as f:
+                regresiones = comparar_suite(resultado, json.load(f), tolerancia)
+            for nombre, antes, ahora, cambio in regresiones:
+                print(f"REGRESIÓN {nombre}: {antes} -> {ahora} µs/op (+{cambio}%)")
+            if regresiones:
+                raise click.exceptions.Exit(1)
+            print(f"Sin regresiones frente a {base}")
+
+    @app.cli.command()
+    def medir_transferencia():
+        """Compare bytes read from the database by list endpoints, full entity vs projection"""
+        from app.services.benchmark_service import medir_transferencia
+        for listado, datos in medir_transferencia().items():
+            print(f"{listado}: {datos['filas']} filas, {datos['antes']:,} -> {datos['despues']:,} bytes "
+                  f"({datos['ahorro_pct']}% menos)")
+
+    @app.cli.command()
+    @click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Primera fecha (YYYY-MM-DD)')
+    @click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Última fecha (YYYY-MM-DD)')
+    def reconstruir_libro(desde, hasta):
+        """Rebuild the per-vehicle weekly profitability ledger from the source tables"""
+        from app.services.libro_service import reconstruir_libro
+        
+        def avance(semana, filas):
+            print(f"  {semana.isoformat()}: {filas} vehículos")
+        
+        semanas = reconstruir_libro(
+            desde=desde.date() if desde else None, hasta=hasta.date() if hasta else None, avance=avance
+        )
+        print(f"{semanas} semanas recalculadas")
+
+    @app.cli.command()
+    @click.option('--lote', type=int, default=1000, help='Propietarios por lote (un commit por lote)')
+    def reparar_contadores(lote):
+        """Recompute owner counter caches (vehicles, references, active rentals) that drifted"""
+        from app.services.contador_service import reparar_contadores
+        resumen = reparar_contadores(tamano_lote=lote)
+        print(f"{resumen['corregidos']} de {resumen['revisados']} propietarios corregidos")
+
+    @app.cli.command()
+    @click.option('--lote', type=int, default=100, help='Archivos por lote (un commit por lote)')
+    def calcular_huellas(lote):
+        """Compute perceptual hashes for document images that lack one"""
+        from app.services.huella_service import calcular_pendientes
+        resumen = calcular_pendientes(tamano_lote=lote)
+        print(f"{resumen['calculadas']} huellas calculadas, {resumen['errores']} errores")
+
+    @app.cli.command('rotate-keys')
+    @click.option('--lote', type=int, default=None, help='Filas por lote (por defecto ROTACION_LOTE)')
+    @click.option('--procesos', type=int, default=None, help='Procesos para el cifrado (0 = sin pool)')
+    @click.option('--pausa', type=float, default=None, help='Segundos entre lotes (por defecto ROTACION_PAUSA)')
+    @click.option('--reiniciar', is_flag=True, help='Ignorar los puntos de control y empezar de cero')
+    def rotate_keys(lote, procesos, pausa, reiniciar):
+        """Re-encrypt all encrypted columns and stored documents with the current FERNET_KEY (online, resumable)"""
+        from app.services.rotacion_service import rotar_claves
+        
+        if not app.config.get('INDICES_KEY'):
+            raise click.ClickException(
+                "Configure INDICES_KEY con la FERNET_KEY anterior antes de rotar: "
+                "los HMAC de las sombras y las huellas de documentos se calcularon con ella"
+            )
+        
+        def avance(tabla, resumen):
+            print(f"  {tabla}: {resumen['filas']} filas revisadas, {resumen['valores']} valores "
+                  f"y {resumen['documentos']} documentos recifrados")
+        
+        resumen = rotar_claves(tamano_lote=lote, procesos=procesos, pausa=pausa, reiniciar=reiniciar, avance=avance)
+        print(f"{resumen['valores']} valores recifrados en {resumen['filas']} filas, "
+              f"{resumen['documentos']} documentos recifrados")
+        if resumen['ilegibles']:
+            print(f"ATENCIÓN: {resumen['ilegibles']} valores o documentos no se pudieron recifrar (ver log). "
+                  "No quite las claves anteriores")
+        else:
+            print("Ya puede quitar las claves anteriores de FERNET_KEYS_ANTERIORES")
+
+    @app.cli.command()
+    @click.option('--lote', type=int, default=500, help='Vehículos por lote (un commit por lote)')
+    @click.option('--reiniciar', is_flag=True, help='Ignorar el punto de control y empezar de cero')
+    def rellenar_sombras(lote, reiniciar):
+        """Backfill the queryable price/availability columns of vehiculos (resumable)"""
+        from app.services.sombra_service import rellenar_sombras
+        actualizadas = rellenar_sombras(tamano_lote=lote, reiniciar=reiniciar)
+        print(f"{actualizadas} vehículos actualizados")
+
+    # ?fields= con campos que el endpoint no ofrece
+    from app.services.proyeccion_service import CamposInvalidos
+
+    @app.errorhandler(CamposInvalidos)
+    def handle_campos_invalidos(e):
+        return jsonify({'success': False, 'message': str(e)}), 400
+
     # Manejador de error para OperationalError (problemas de conexión)
     @app.errorhandler(OperationalError)
     def handle_db_connection_error(e):
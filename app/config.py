@@ -32,6 +32,27 @@ class Config:
         # Generate a key if none provided (for development only)
         FERNET_KEY = b'DksZJAUDwI-aha-8ENccA_SlMoQkqTH-qEFBn4CcQVs='
     
+    # Rotación de claves: FERNET_KEY cifra; estas solo descifran lo que aún no se
+    # ha recifrado con `flask rotate-keys` (separadas por comas, más reciente primero)
+    FERNET_KEYS_ANTERIORES = [k.strip() for k in os.getenv('FERNET_KEYS_ANTERIORES', '').split(',') if k.strip()]
+    ROTACION_LOTE = 500  # Filas por lote (un commit corto por lote)
+    ROTACION_PAUSA = 0.2  # Segundos entre lotes para no saturar la base en línea
+    # Clave fija de los HMAC consultables (sombra de disponibilidad, huella de documentos): no rota con FERNET_KEY.
+    # Sin ella se usa FERNET_KEY, así que antes de la primera rotación fijarla con su valor actual
+    INDICES_KEY = os.getenv('INDICES_KEY')
+    
+    # Copias consultables de Vehiculo.precio_semanal y disponible (ver sombra_service).
+    # Precio: 'claro' (valor exacto) o 'tramo' (redondeado hacia abajo a PRECIO_TRAMO).
+    # Disponibilidad: 'claro' o 'hmac'. Al cambiarlas, ejecutar `flask rellenar-sombras --reiniciar`
+    SOMBRA_PRECIO = os.getenv('SOMBRA_PRECIO', 'claro')
+    SOMBRA_DISPONIBLE = os.getenv('SOMBRA_DISPONIBLE', 'claro')
+    PRECIO_TRAMO = 50
+    
+    # Descifrado en paralelo de resultados grandes (ver descifrado_service)
+    DESCIFRADO_UMBRAL = 5000  # Tokens distintos a partir de los cuales se usa el pool de procesos
+    DESCIFRADO_PROCESOS = None  # None = un proceso por CPU
+    DESCIFRADO_MEMORIA = 32 * 1024 * 1024  # Bytes de texto cifrado en vuelo por petición
+    
     # Session configuration
     SESSION_COOKIE_SECURE =  True
     SESSION_COOKIE_HTTPONLY = True
@@ -54,6 +75,41 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)),  'app', 'static', 'uploads')
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg','mp4'}
     
+    # Backend de almacenamiento de archivos subidos: 'local' (/static) o 's3' (S3, MinIO...)
+    ALMACENAMIENTO = os.getenv('ALMACENAMIENTO', 'local')
+    S3_BUCKET = os.getenv('S3_BUCKET')
+    S3_PREFIJO = os.getenv('S3_PREFIJO', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # MinIO: http://localhost:9000
+    S3_REGION = os.getenv('S3_REGION')
+    S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY')
+    S3_SECRET_KEY = os.getenv('S3_SECRET_KEY')
+    ARCHIVOS_URL_EXPIRA = 300  # Segundos de validez de las URLs prefirmadas
+    
+    # Entrega de archivos subidos (/archivos): delegar la transferencia al servidor web
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'  # Apache mod_xsendfile
+    ARCHIVOS_X_ACCEL_PREFIJO = os.getenv('ARCHIVOS_X_ACCEL_PREFIJO') or None  # Nginx, ej. '/protegido/'
+    
+    SUBIDAS_HILOS = 4  # Hilos para procesar en paralelo las subidas de varios archivos
+    HUELLA_UMBRAL = 8  # Bits de diferencia (de 64) para considerar dos documentos posibles duplicados
+    
+    # Subidas reanudables por bloques (videos de vehículos)
+    SUBIDA_TAMANO_BLOQUE = int(8 * 1024 * 1024)  # Máximo por bloque, debe ser menor que MAX_CONTENT_LENGTH
+    SUBIDA_TAMANO_MAXIMO = int(2 * 1024 * 1024 * 1024)  # Máximo del archivo completo
+    SUBIDA_EXPIRACION_HORAS = 48  # Subidas sin actividad cuyo temporal puede recoger la limpieza
+    
+    # Limpieza de archivos huérfanos (flask limpiar-archivos)
+    CUARENTENA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'cuarentena')  # Fuera de /static
+    LIMPIEZA_GRACIA_HORAS = 24  # No tocar archivos más recientes (subidas en curso)
+    
+    # Tareas en segundo plano (flask worker)
+    TAREAS_PROCESOS = 2  # Procesos worker por defecto
+    TAREAS_INTERVALO = 2  # Segundos entre consultas a la cola cuando está vacía
+    TAREAS_LATIDO = 30  # Segundos entre latidos del worker mientras ejecuta una tarea
+    TAREAS_TIMEOUT = 300  # Segundos sin latido antes de reencolar una tarea en_proceso (worker caído)
+    
+    # Mora (proceso nocturno: flask actualizar-mora)
+    PENALIZACION_DIARIA_MORA = '0.00'  # Penalización por día de atraso en detalles semanales
+    
     # Security headers (Flask-Talisman)
     TALISMAN_FORCE_HTTPS = False
     TALISMAN_CONTENT_SECURITY_POLICY = {
@@ -3,16 +3,22 @@ Database Models for AlexRentaCar Admin App
 Maps SQL schema to SQLAlchemy ORM with encryption support
 """
 from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from cryptography.fernet import Fernet ,InvalidToken# <-- Importar InvalidToken de cryptography.fernet
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken# <-- Importar InvalidToken de cryptography.fernet
 from app import db
 from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper, deferred
+from sqlalchemy.orm.attributes import InstrumentedAttribute, set_committed_value
+from sqlalchemy.types import TypeDecorator
 
 
 # ==================== Funciones Helper de Cifrado ====================
-def get_cipher():
-    """Obtiene la instancia de Fernet cipher"""
+def claves_fernet():
+    """(FERNET_KEY, *FERNET_KEYS_ANTERIORES) como bytes; la primera es la que cifra"""
     key = current_app.config.get('FERNET_KEY')
     
     # Validar que la clave existe
@@ -21,17 +27,29 @@ def get_cipher():
         raise ValueError("FERNET_KEY no está configurada en la aplicación")
     
     # Si la clave es string, convertir a bytes (Fernet requiere bytes)
-    if isinstance(key, str):
-        key = key.encode()
-    
-    # Validar formato de la clave
+    claves = [key] + list(current_app.config.get('FERNET_KEYS_ANTERIORES') or [])
+    return tuple(k.encode() if isinstance(k, str) else k for k in claves)
+
+
+@lru_cache(maxsize=4)
+def _construir_cipher(claves):
+    # Validar formato de las claves
     try:
-        return Fernet(key)
+        return MultiFernet([Fernet(k) for k in claves])
     except Exception as e:
         # Clave mal formateada (no base64 URL-safe)
         raise ValueError(f"FERNET_KEY inválida: {str(e)}")
 
 
+def get_cipher():
+    """
+    Obtiene el cipher (MultiFernet): cifra con FERNET_KEY y descifra con ella o
+    con cualquiera de FERNET_KEYS_ANTERIORES, así que cambiar la clave no rompe
+    los datos existentes mientras `flask rotate-keys` los recifra
+    """
+    return _construir_cipher(claves_fernet())
+
+
 def encrypt_data(data):
     """Cifra datos sensibles (como Cédula, Licencia, Teléfono)"""
     if data is None or data == '':
@@ -70,6 +88,121 @@ def decrypt_data(encrypted_data):
         raise
 
 
+# ==================== Tipos de columna cifrados ====================
+def descifrar_token(token):
+    """
+    Descifra un token Fernet. Sin memo entre peticiones: el texto en claro no
+    queda en la memoria del proceso más allá de la sesión que lo leyó
+    """
+    return get_cipher().decrypt(token.encode()).decode()
+
+
+class Cifrado:
+    """
+    Valor de una columna cifrada tal como llega de la base, todavía sin descifrar.
+    En los modelos se descifra la primera vez que se lee el atributo; en un
+    SELECT de columnas, con en_claro()
+    """
+    __slots__ = ('token', 'tipo')
+
+    def __init__(self, token, tipo):
+        self.token = token
+        self.tipo = tipo
+
+    def descifrar(self):
+        return self.tipo.desde_texto(descifrar_token(self.token))
+
+    def __repr__(self):
+        return '<Cifrado>'
+
+
+def en_claro(valor):
+    """Valor en claro de un resultado de columna cifrada"""
+    return valor.descifrar() if isinstance(valor, Cifrado) else valor
+
+
+class EncryptedText(TypeDecorator):
+    """
+    Columna de texto cifrada con Fernet (get_cipher). En Python el atributo es el
+    valor en claro: se cifra al escribir (también en bulk inserts/updates) y se
+    descifra al leer el atributo, no al cargar la fila: las columnas que la
+    petición no usa nunca se descifran
+    """
+    impl = db.Text
+    cache_ok = True
+
+    def a_texto(self, value):
+        return value if isinstance(value, str) else str(value)
+
+    def desde_texto(self, texto):
+        return texto
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, Cifrado):
+            return value.token  # Copiado sin leerlo: se guarda el mismo token
+        if value is None or value == '':
+            return None
+        return get_cipher().encrypt(self.a_texto(value).encode()).decode()
+
+    def process_result_value(self, value, dialect):
+        if value is None or value == '':
+            return None
+        return Cifrado(value, self)
+
+
+class EncryptedInteger(EncryptedText):
+    cache_ok = True
+
+    def desde_texto(self, texto):
+        return int(texto)
+
+
+class EncryptedNumeric(EncryptedText):
+    cache_ok = True
+
+    def desde_texto(self, texto):
+        return Decimal(texto)
+
+
+class EncryptedBool(EncryptedText):
+    """Se guarda '1'/'0' cifrado. `nulo_como`: valor que se lee cuando la columna es NULL"""
+    cache_ok = True
+
+    def __init__(self, nulo_como=None):
+        super().__init__()
+        self.nulo_como = nulo_como
+
+    def a_texto(self, value):
+        return '1' if value else '0'
+
+    def desde_texto(self, texto):
+        return bool(int(texto))
+
+    def process_result_value(self, value, dialect):
+        if value is None or value == '':
+            return self.nulo_como
+        return super().process_result_value(value, dialect)
+
+
+class _AtributoCifrado(InstrumentedAttribute):
+    """Atributo de modelo de una columna cifrada: descifra el valor al leerlo por primera vez"""
+    __slots__ = ()
+
+    def __get__(self, instance, owner):
+        valor = super().__get__(instance, owner)
+        if isinstance(valor, Cifrado):
+            valor = valor.descifrar()
+            set_committed_value(instance, self.key, valor)
+        return valor
+
+
+@event.listens_for(Mapper, 'mapper_configured')
+def _instrumentar_cifradas(mapper, clase):
+    for prop in mapper.column_attrs:
+        if isinstance(prop.columns[0].type, EncryptedText):
+            mapper.class_manager[prop.key].__class__ = _AtributoCifrado
+
+
 # ==================== TABLA: usuarios ====================
 class Usuario(UserMixin, db.Model):
     __tablename__ = 'usuarios'
@@ -254,16 +387,16 @@ class Propietario(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='SET NULL'))
 
-    # Campos encriptados (YA ESTABAN CORRECTOS con mapeo explícito)
-    _nombre_apellido = db.Column("nombre_apellido", db.Text, nullable=False)
-    _documento_buena_conducta_path = db.Column("documento_buena_conducta_path", db.Text)
-    _cedula = db.Column("cedula", db.Text)
-    _cedula_path = db.Column("cedula_path", db.Text)
-    _licencia = db.Column("licencia", db.Text)
-    _licencia_path = db.Column("licencia_path", db.Text)
-    _direccion = db.Column("direccion", db.Text)
-    _telefono = db.Column("telefono", db.Text)
-    _email = db.Column("email", db.Text)
+    # Campos encriptados (se cifran/descifran en el tipo de columna)
+    nombre_apellido = db.Column('nombre_apellido', EncryptedText, nullable=False)
+    documento_buena_conducta_path = db.Column('documento_buena_conducta_path', EncryptedText)
+    cedula = db.Column('cedula', EncryptedText)
+    cedula_path = db.Column('cedula_path', EncryptedText)
+    licencia = db.Column('licencia', EncryptedText)
+    licencia_path = db.Column('licencia_path', EncryptedText)
+    direccion = db.Column('direccion', EncryptedText)
+    telefono = db.Column('telefono', EncryptedText)
+    email = db.Column('email', EncryptedText)
 
     usuario_registro_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='CASCADE'))
     fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
@@ -271,99 +404,19 @@ class Propietario(db.Model):
     fecha_hora_actualizo = db.Column(db.DateTime, default=datetime.utcnow,
                                      onupdate=datetime.utcnow)
     
+    # Contadores cacheados: los mantiene contador_service en cada flush
+    vehiculos_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    referencias_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    alquileres_activos_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     vehiculos = db.relationship('Vehiculo', backref='propietario', lazy='dynamic')
     referencias = db.relationship('ReferenciaPropietario', backref='propietario',
                                   cascade='all, delete-orphan', lazy='dynamic')
 
-    # ------------------------
-    # PROPIEDADES ENCRIPTADAS
-    # ------------------------
-
-    # nombre_apellido
-    @property
-    def nombre_apellido(self):
-        return decrypt_data(self._nombre_apellido)
-
-    @nombre_apellido.setter
-    def nombre_apellido(self, value):
-        self._nombre_apellido = encrypt_data(value)
-
-    # documento_buena_conducta_path
-    @property
-    def documento_buena_conducta_path(self):
-        return decrypt_data(self._documento_buena_conducta_path)
-
-    @documento_buena_conducta_path.setter
-    def documento_buena_conducta_path(self, value):
-        self._documento_buena_conducta_path = encrypt_data(value)
-
-    # cedula
-    @property
-    def cedula(self):
-        return decrypt_data(self._cedula)
-    
-    @cedula.setter
-    def cedula(self, value):
-        self._cedula = encrypt_data(value)
-
-    # cedula_path
-    @property
-    def cedula_path(self):
-        return decrypt_data(self._cedula_path)
-
-    @cedula_path.setter
-    def cedula_path(self, value):
-        self._cedula_path = encrypt_data(value)
-
-    # licencia
-    @property
-    def licencia(self):
-        return decrypt_data(self._licencia)
-
-    @licencia.setter
-    def licencia(self, value):
-        self._licencia = encrypt_data(value)
-
-    # licencia_path
-    @property
-    def licencia_path(self):
-        return decrypt_data(self._licencia_path)
-
-    @licencia_path.setter
-    def licencia_path(self, value):
-        self._licencia_path = encrypt_data(value)
-
-    # direccion
-    @property
-    def direccion(self):
-        return decrypt_data(self._direccion)
-
-    @direccion.setter
-    def direccion(self, value):
-        self._direccion = encrypt_data(value)
-
-    # telefono
-    @property
-    def telefono(self):
-        return decrypt_data(self._telefono)
-
-    @telefono.setter
-    def telefono(self, value):
-        self._telefono = encrypt_data(value)
-
-    # email
-    @property
-    def email(self):
-        return decrypt_data(self._email)
-
-    @email.setter
-    def email(self, value):
-        self._email = encrypt_data(value)
-        
     @property
     def tipo_socio(self):
         """Calcula el tipo de socio según cantidad de vehículos"""
-        cantidad_vehiculos = self.vehiculos.count()
+        cantidad_vehiculos = self.vehiculos_count or 0
         if cantidad_vehiculos >= 3:
             return 'SOCIO_POTENCIAL'
         elif cantidad_vehiculos >= 1:
@@ -393,12 +446,12 @@ class ReferenciaPropietario(db.Model):
     propietario_id = db.Column(db.Integer,  db.ForeignKey('propietarios.id', ondelete='CASCADE'),   nullable=False, index=True)
     
     # CORRECCIÓN
-    _nombre_apellido = db.Column('nombre_apellido', db.Text, nullable=False)
+    nombre_apellido = db.Column('nombre_apellido', EncryptedText, nullable=False)
     
     parentesco_id = db.Column(db.Integer,  db.ForeignKey('parentescos.id', ondelete='CASCADE'),  nullable=False)
     
     # CORRECCIÓN
-    _telefono = db.Column('telefono', db.Text, nullable=False)
+    telefono = db.Column('telefono', EncryptedText, nullable=False)
     
     usuario_registro_id = db.Column(db.Integer,   db.ForeignKey('usuarios.id', ondelete='CASCADE'))
     fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
@@ -406,25 +459,7 @@ class ReferenciaPropietario(db.Model):
     fecha_hora_actualizo = db.Column(db.DateTime, default=datetime.utcnow,  onupdate=datetime.utcnow)
     
     parentesco = db.relationship('Parentesco', backref='referencias_propietarios') 
-    
-    # nombre_apellido
-    @property
-    def nombre_apellido(self):
-        return decrypt_data(self._nombre_apellido)
-
-    @nombre_apellido.setter
-    def nombre_apellido(self, value):
-        self._nombre_apellido = encrypt_data(value)
-        
-    # telefono
-    @property
-    def telefono(self):
-        return decrypt_data(self._telefono)
 
-    @telefono.setter
-    def telefono(self, value):
-        self._telefono = encrypt_data(value)
-    
     def __repr__(self):
         return f'<ReferenciaPropietario {self.nombre_apellido}>'
 
@@ -435,17 +470,17 @@ class Inquilino(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     # CORRECCIÓN
-    _nombre_apellido = db.Column('nombre_apellido', db.Text, nullable=False, index=True)
-    _direccion = db.Column('direccion', db.Text)  
-    _telefono = db.Column('telefono', db.Text)
-    _email = db.Column('email', db.Text)
-    _documento_buena_conducta_path = db.Column('documento_buena_conducta_path', db.Text)
+    nombre_apellido = db.Column('nombre_apellido', EncryptedText, nullable=False, index=True)
+    direccion = db.Column('direccion', EncryptedText)  
+    telefono = db.Column('telefono', EncryptedText)
+    email = db.Column('email', EncryptedText)
+    documento_buena_conducta_path = db.Column('documento_buena_conducta_path', EncryptedText)
     
     # Estos ya estaban bien mapeados:
-    _cedula = db.Column('cedula', db.Text)  
-    _cedula_path = db.Column('cedula_path', db.Text)
-    _licencia = db.Column('licencia', db.Text)  
-    _licencia_path = db.Column('licencia_path', db.Text)
+    cedula = db.Column('cedula', EncryptedText)  
+    cedula_path = db.Column('cedula_path', EncryptedText)
+    licencia = db.Column('licencia', EncryptedText)  
+    licencia_path = db.Column('licencia_path', EncryptedText)
     
     usuario_registro_id = db.Column(db.Integer,  db.ForeignKey('usuarios.id', ondelete='CASCADE'))
     fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
@@ -456,79 +491,7 @@ class Inquilino(db.Model):
     garantes = db.relationship('GaranteInquilino', backref='inquilino', cascade='all, delete-orphan', lazy='dynamic')
     referencias = db.relationship('ReferenciaInquilino', backref='inquilino',  cascade='all, delete-orphan', lazy='dynamic')
     deudas = db.relationship('Deuda', backref='inquilino', lazy='dynamic')
-    
-    @property
-    def nombre_apellido(self):
-        return decrypt_data(self._nombre_apellido)
-    
-    @nombre_apellido.setter
-    def nombre_apellido(self, value):
-        self._nombre_apellido = encrypt_data(value) if value else None
-        
-    @property
-    def direccion(self):
-        return decrypt_data(self._direccion)
-    
-    @direccion.setter
-    def direccion(self, value):
-        self._direccion = encrypt_data(value) if value else None
-        
-    @property
-    def telefono(self):
-        return decrypt_data(self._telefono)
-    
-    @telefono.setter
-    def telefono(self, value):
-        self._telefono = encrypt_data(value) if value else None
-        
-    @property
-    def email(self):
-        return decrypt_data(self._email)
-    
-    @email.setter
-    def email(self, value):
-        self._email = encrypt_data(value) if value else None
-        
-    @property
-    def documento_buena_conducta_path(self):
-        return decrypt_data(self._documento_buena_conducta_path)
-    
-    @documento_buena_conducta_path.setter
-    def documento_buena_conducta_path(self, value):
-        self._documento_buena_conducta_path = encrypt_data(value) if value else None       
-    
-    @property
-    def cedula(self):
-        return decrypt_data(self._cedula)
-    
-    @cedula.setter
-    def cedula(self, value):
-        self._cedula = encrypt_data(value) if value else None
-         
-    @property
-    def cedula_path(self):
-        return decrypt_data(self._cedula_path)
-    
-    @cedula_path.setter
-    def cedula_path(self, value):
-        self._cedula_path = encrypt_data(value) if value else None
-    
-    @property
-    def licencia(self):
-        return decrypt_data(self._licencia)
-    
-    @licencia.setter
-    def licencia(self, value):
-        self._licencia = encrypt_data(value) if value else None
-        
-    @property
-    def licencia_path(self):
-        return decrypt_data(self._licencia_path)
-    
-    @licencia_path.setter
-    def licencia_path(self, value):
-        self._licencia_path = encrypt_data(value) if value else None
-         
+
     def __repr__(self):
         return f'<Inquilino {self.nombre_apellido}>'
 
@@ -540,19 +503,19 @@ class GaranteInquilino(db.Model):
     inquilino_id = db.Column(db.Integer,  db.ForeignKey('inquilinos.id', ondelete='CASCADE'),  nullable=False, index=True)
     
     # CORRECCIÓN
-    _nombre_apellido = db.Column('nombre_apellido', db.Text, nullable=False)
-    _direccion = db.Column('direccion', db.Text)
-    _telefono = db.Column('telefono', db.Text)
-    _email = db.Column('email', db.Text)
+    nombre_apellido = db.Column('nombre_apellido', EncryptedText, nullable=False)
+    direccion = db.Column('direccion', EncryptedText)
+    telefono = db.Column('telefono', EncryptedText)
+    email = db.Column('email', EncryptedText)
     
     #  AGREGAR ESTOS DOS CAMPOS
-    _cedula = db.Column('cedula', db.Text)
-    _cedula_path = db.Column('cedula_path', db.Text)
+    cedula = db.Column('cedula', EncryptedText)
+    cedula_path = db.Column('cedula_path', EncryptedText)
     
     parentesco_id = db.Column(db.Integer,  db.ForeignKey('parentescos.id', ondelete='CASCADE'),  nullable=False)
     
     # CORRECCIÓN
-    _documento_referencia_laboral_path = db.Column('documento_referencia_laboral_path', db.Text)
+    documento_referencia_laboral_path = db.Column('documento_referencia_laboral_path', EncryptedText)
     
     usuario_registro_id = db.Column(db.Integer,  db.ForeignKey('usuarios.id', ondelete='CASCADE'))
     fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
@@ -560,69 +523,8 @@ class GaranteInquilino(db.Model):
     fecha_hora_actualizo = db.Column(db.DateTime, default=datetime.utcnow,  onupdate=datetime.utcnow)
     
     parentesco = db.relationship('Parentesco', backref='garantes')
-    
-    # nombre_apellido
-    @property
-    def nombre_apellido(self):
-        return decrypt_data(self._nombre_apellido)
-
-    @nombre_apellido.setter
-    def nombre_apellido(self, value):
-        self._nombre_apellido = encrypt_data(value)
-
-    # direccion
-    @property
-    def direccion(self):
-        return decrypt_data(self._direccion)
 
-    @direccion.setter
-    def direccion(self, value):
-        self._direccion = encrypt_data(value)
-
-    # telefono
-    @property
-    def telefono(self):
-        return decrypt_data(self._telefono)
-
-    @telefono.setter
-    def telefono(self, value):
-        self._telefono = encrypt_data(value)
-
-    # email
-    @property
-    def email(self):
-        return decrypt_data(self._email)
-
-    @email.setter
-    def email(self, value):
-        self._email = encrypt_data(value)
-        
     # AGREGAR ESTAS PROPERTIES
-    @property
-    def cedula(self):
-        return decrypt_data(self._cedula)
-
-    @cedula.setter
-    def cedula(self, value):
-        self._cedula = encrypt_data(value) if value else None
-    
-    @property
-    def cedula_path(self):
-        return decrypt_data(self._cedula_path)
-
-    @cedula_path.setter
-    def cedula_path(self, value):
-        self._cedula_path = encrypt_data(value) if value else None
-
-
-    # documento_referencia_laboral_path
-    @property
-    def documento_referencia_laboral_path(self):
-        return decrypt_data(self._documento_referencia_laboral_path)
-
-    @documento_referencia_laboral_path.setter
-    def documento_referencia_laboral_path(self, value):
-        self._documento_referencia_laboral_path = encrypt_data(value)
 
     def __repr__(self):
         return f'<GaranteInquilino {self.nombre_apellido}>'
@@ -634,12 +536,12 @@ class ReferenciaInquilino(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     inquilino_id = db.Column(db.Integer, db.ForeignKey('inquilinos.id', ondelete='CASCADE'), nullable=False, index=True)
-    _nombre_apellido = db.Column('nombre_apellido', db.Text, nullable=False)
-    _telefono = db.Column('telefono', db.Text, nullable=False)
+    nombre_apellido = db.Column('nombre_apellido', EncryptedText, nullable=False)
+    telefono = db.Column('telefono', EncryptedText, nullable=False)
     
     # ✅ AGREGAR ESTOS DOS CAMPOS
-    _cedula = db.Column('cedula', db.Text)
-    _cedula_path = db.Column('cedula_path', db.Text)
+    cedula = db.Column('cedula', EncryptedText)
+    cedula_path = db.Column('cedula_path', EncryptedText)
     
     parentesco_id = db.Column(db.Integer, db.ForeignKey('parentescos.id', ondelete='CASCADE'), nullable=False)
     usuario_registro_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='CASCADE'))
@@ -650,38 +552,8 @@ class ReferenciaInquilino(db.Model):
     parentesco = db.relationship('Parentesco', backref='referencias_inquilinos')
     
     # Properties existentes...
-    @property
-    def nombre_apellido(self):
-        return decrypt_data(self._nombre_apellido)
-
-    @nombre_apellido.setter
-    def nombre_apellido(self, value):
-        self._nombre_apellido = encrypt_data(value)
-
-    @property
-    def telefono(self):
-        return decrypt_data(self._telefono)
-
-    @telefono.setter
-    def telefono(self, value):
-        self._telefono = encrypt_data(value)
 
     #  AGREGAR ESTAS PROPERTIES
-    @property
-    def cedula(self):
-        return decrypt_data(self._cedula)
-
-    @cedula.setter
-    def cedula(self, value):
-        self._cedula = encrypt_data(value) if value else None
-    
-    @property
-    def cedula_path(self):
-        return decrypt_data(self._cedula_path)
-
-    @cedula_path.setter
-    def cedula_path(self, value):
-        self._cedula_path = encrypt_data(value) if value else None
 
     def __repr__(self):
         return f'<ReferenciaInquilino {self.nombre_apellido}>'
@@ -699,17 +571,22 @@ class Vehiculo(db.Model):
     propietario_id = db.Column(db.Integer,  db.ForeignKey('propietarios.id', ondelete='CASCADE'),  nullable=False, index=True)
     
     # CORRECCIÓN: Mapeo explícito a la columna 'placa' de la base de datos
-    _placa = db.Column('placa', db.Text, unique=True, nullable=False, index=True)
+    placa = db.Column('placa', EncryptedText, unique=True, nullable=False, index=True)
     
     marca_modelo_vehiculo_id = db.Column(db.Integer,   db.ForeignKey('vehiculo_marca_modelo.id',  ondelete='RESTRICT'),   nullable=False)
     
     # CORRECCIÓN: Mapeo explícito para el resto de columnas encriptadas
-    _ano = db.Column('ano', db.Text)
-    _color = db.Column('color', db.Text)
-    _descripcion = db.Column('descripcion', db.Text)
-    _precio_semanal = db.Column('precio_semanal', db.Text, nullable=False)
-    _condiciones = db.Column('condiciones', db.Text)
-    _disponible = db.Column('disponible', db.Text)
+    ano = db.Column('ano', EncryptedInteger)
+    color = db.Column('color', EncryptedText)
+    # Cifradas y voluminosas: diferidas, solo se leen al usarlas (ver proyeccion_service)
+    descripcion = deferred(db.Column('descripcion', EncryptedText), group='detalle')
+    precio_semanal = db.Column('precio_semanal', EncryptedNumeric, nullable=False)
+    condiciones = deferred(db.Column('condiciones', EncryptedText), group='detalle')
+    disponible = db.Column('disponible', EncryptedBool(nulo_como=True), default=True)
+    # Copias consultables (indexadas) de precio y disponibilidad, según SOMBRA_PRECIO y
+    # SOMBRA_DISPONIBLE. Las mantiene sombra_service al guardar; no asignarlas a mano
+    precio_indice = db.Column(db.Numeric(10, 2), index=True)
+    disponible_indice = db.Column(db.String(64), index=True)
     
     usuario_registro_id = db.Column(db.Integer,   db.ForeignKey('usuarios.id', ondelete='CASCADE'))
     fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
@@ -721,82 +598,6 @@ class Vehiculo(db.Model):
     trabajos = db.relationship('TrabajoVehiculo', backref='vehiculo', 
                                cascade='all, delete-orphan', lazy='dynamic')
     deudas = db.relationship('Deuda', backref='vehiculo', lazy='dynamic')
-    
-    # placa
-    @property
-    def placa(self):
-        return decrypt_data(self._placa)
-
-    @placa.setter
-    def placa(self, value):
-        self._placa = encrypt_data(value)
-
-    # ano
-    @property
-    def ano(self):
-        if self._ano is None:
-            return None
-        return int(decrypt_data(self._ano))
-
-    @ano.setter
-    def ano(self, value):
-        if value is None:
-            self._ano = None
-        else:
-            self._ano = encrypt_data(str(value))
-
-    # color
-    @property
-    def color(self):
-        return decrypt_data(self._color)
-
-    @color.setter
-    def color(self, value):
-        self._color = encrypt_data(value)
-
-    # descripcion
-    @property
-    def descripcion(self):
-        return decrypt_data(self._descripcion)
-
-    @descripcion.setter
-    def descripcion(self, value):
-        self._descripcion = encrypt_data(value)
-
-    # precio_semanal
-    @property
-    def precio_semanal(self):
-        from decimal import Decimal
-        if self._precio_semanal is None:
-            return None
-        return Decimal(decrypt_data(self._precio_semanal))
-
-    @precio_semanal.setter
-    def precio_semanal(self, value):
-        if value is None:
-            self._precio_semanal = None
-        else:
-            self._precio_semanal = encrypt_data(str(value))
-
-    # condiciones
-    @property
-    def condiciones(self):
-        return decrypt_data(self._condiciones)
-
-    @condiciones.setter
-    def condiciones(self, value):
-        self._condiciones = encrypt_data(value)
-
-    # disponible
-    @property
-    def disponible(self):
-        if self._disponible is None:
-            return True  # assuming default True
-        return bool(int(decrypt_data(self._disponible)))
-
-    @disponible.setter
-    def disponible(self, value):
-        self._disponible = encrypt_data('1' if value else '0')
 
     def __repr__(self):
         return f'<Vehiculo {self.placa}>'
@@ -808,6 +609,8 @@ class VehiculoImagen(db.Model):
     vehiculo_id = db.Column(db.Integer, db.ForeignKey('vehiculos.id', ondelete='CASCADE'), nullable=False, index=True)
     tipo = db.Column(db.Enum('imagen', 'video'), default='imagen', nullable=False)
     ruta = db.Column(db.String(500), nullable=False)
+    ruta_miniatura = db.Column(db.String(500))  # Variante pequeña (listas/tarjetas), ver media_service
+    ruta_display = db.Column(db.String(500))  # Variante para galerías
     nombre_archivo = db.Column(db.String(255))
     orden = db.Column(db.Integer, default=0)
     es_principal = db.Column(db.Boolean, default=False)
@@ -819,6 +622,16 @@ class VehiculoImagen(db.Model):
     def __repr__(self):
         return f'<VehiculoImagen {self.id} - Vehiculo {self.vehiculo_id}>'
     
+    @property
+    def miniatura(self):
+        """Ruta de la miniatura, o el original mientras no se haya generado"""
+        return self.ruta_miniatura or self.ruta
+    
+    @property
+    def display(self):
+        """Ruta de la variante para galerías, o el original"""
+        return self.ruta_display or self.ruta
+    
 # ==================== TABLA: mecanicos ====================
 class Mecanico(db.Model):
     __tablename__ = 'mecanicos'
@@ -952,6 +765,9 @@ class PiezaUsada(db.Model):
 
 
 # ==================== TABLA: alquileres ====================
+ESTADOS_ALQUILER_ACTIVOS = (2, 3)  # En curso, Validado (ids de estados_alquiler)
+
+
 class Alquiler(db.Model):
     __tablename__ = 'alquileres'
     
@@ -1114,7 +930,13 @@ class DetalleAlquilerSemanal(db.Model):
     # Deuda
     tiene_deuda = db.Column(db.Boolean, default=False)
     monto_deuda = db.Column(db.Numeric(10, 2), default=0.00)
-    fecha_limite_pago = db.Column(db.Date)  # Jueves de la semana
+    fecha_limite_pago = db.Column(db.Date, index=True)  # Jueves de la semana
+    
+    # Mora (recalculada por el proceso nocturno, ver mora_service)
+    en_mora = db.Column(db.Boolean, default=False, nullable=False, index=True)
+    dias_mora = db.Column(db.Integer, default=0, nullable=False, index=True)
+    penalizacion_mora = db.Column(db.Numeric(10, 2), default=0.00)
+    fecha_calculo_mora = db.Column(db.Date)
     
     # Nómina final
     nomina_final = db.Column(db.Numeric(10, 2), nullable=False)  # ingreso + deuda
@@ -1145,19 +967,69 @@ class DetalleAlquilerSemanal(db.Model):
     
     @property
     def esta_en_mora(self):
-        """Verifica si el pago está en mora"""
-        if not self.pago_confirmado and self.fecha_limite_pago:
-            from datetime import date
-            return date.today() > self.fecha_limite_pago
-        return False
-    
-    @property
-    def dias_mora(self):
-        """Calcula días de mora"""
-        if self.esta_en_mora:
-            from datetime import date
-            return (date.today() - self.fecha_limite_pago).days
-        return 0
+        """Verifica si el pago está en mora (según el último cálculo de mora)"""
+        return bool(self.en_mora) and not self.pago_confirmado
+
+
+# ==================== TABLA: snapshots_semanas ====================
+class SnapshotSemana(db.Model):
+    """
+    Instantánea inmutable de una semana cerrada.
+    Guarda el JSON de detalles (gzip) y el Excel ya generados al cerrar la semana
+    """
+    __tablename__ = 'snapshots_semanas'
+
+    id = db.Column(db.Integer, primary_key=True)
+    semana_alquiler_id = db.Column(db.Integer, db.ForeignKey('semanas_alquiler.id', ondelete='CASCADE'), nullable=False, unique=True, index=True)
+
+    # Payloads diferidos: validar el ETag no requiere leer los blobs
+    datos_json_gz = db.deferred(db.Column(db.LargeBinary(length=16777215), nullable=False))
+    excel = db.deferred(db.Column(db.LargeBinary(length=16777215), nullable=False))
+    etag = db.Column(db.String(64), nullable=False)
+    etag_excel = db.Column(db.String(64), nullable=False)
+
+    usuario_registro_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='CASCADE'))
+    fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
+
+    semana = db.relationship('SemanaAlquiler', backref=db.backref('snapshot', uselist=False, cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<SnapshotSemana {self.semana_alquiler_id} - {self.etag[:12]}>'
+
+
+# ==================== TABLA: libro_vehiculos_semanal ====================
+class LibroVehiculoSemana(db.Model):
+    """
+    Libro de rentabilidad: una fila por vehículo y semana (lunes a domingo) con lo
+    que generó y lo que costó. Lo mantiene libro_service a partir de los detalles
+    semanales, trabajos y piezas usadas; no se edita a mano.
+    """
+    __tablename__ = 'libro_vehiculos_semanal'
+    __table_args__ = (
+        db.UniqueConstraint('semana_inicio', 'vehiculo_id', name='uq_libro_semana_vehiculo'),
+        db.Index('ix_libro_propietario_semana', 'propietario_id', 'semana_inicio'),
+        db.Index('ix_libro_vehiculo_semana', 'vehiculo_id', 'semana_inicio'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    vehiculo_id = db.Column(db.Integer, db.ForeignKey('vehiculos.id', ondelete='CASCADE'), nullable=False)
+    propietario_id = db.Column(db.Integer, db.ForeignKey('propietarios.id', ondelete='CASCADE'), nullable=False)
+    semana_inicio = db.Column(db.Date, nullable=False)  # Lunes de la semana
+
+    # Detalles semanales (por la fecha de inicio de su SemanaAlquiler)
+    ingreso = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # Σ ingreso_calculado
+    nomina_empresa = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # Σ nomina_empresa
+    descuentos = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # Σ monto_descuento
+    inversion_mecanica = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # Σ inversion_mecanica
+
+    # Trabajos no cancelados (por su fecha_inicio) y sus piezas
+    costo_trabajos = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # Σ TrabajoVehiculo.costo
+    costo_piezas = db.Column(db.Numeric(12, 2), nullable=False, default=0)  # Σ cantidad * costo_unitario
+
+    fecha_hora_actualizo = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<LibroVehiculoSemana {self.vehiculo_id} - {self.semana_inicio}>'
 
 
 # ==================== TABLA: historico_porcentajes_ganancia ====================
@@ -1231,9 +1103,11 @@ class Deuda(db.Model):
                             db.ForeignKey('alquileres.id', ondelete='CASCADE'), 
                             nullable=False)
     monto_deuda = db.Column(db.Numeric(10, 2), nullable=False)
-    dias_retraso = db.Column(db.Integer, nullable=False)
+    dias_retraso = db.Column(db.Integer, nullable=False, index=True)
     penalizacion_diaria = db.Column(db.Numeric(10, 2), default=0.00)
-    estado = db.Column(db.Enum('pendiente', 'pagado', 'condonado'), default='pendiente')
+    penalizacion_acumulada = db.Column(db.Numeric(10, 2), default=0.00)  # dias_retraso * penalizacion_diaria
+    fecha_calculo_mora = db.Column(db.Date)
+    estado = db.Column(db.Enum('pendiente', 'pagado', 'condonado'), default='pendiente', index=True)
     fecha_vencimiento = db.Column(db.Date, nullable=False, index=True)
     notas = db.Column(db.Text)
     usuario_registro_id = db.Column(db.Integer, 
@@ -1277,6 +1151,156 @@ class Pago(db.Model):
         return f'<Pago {self.id} - ${self.monto}>'
     
 
+# ==================== TABLA: tareas ====================
+class Tarea(db.Model):
+    """
+    Cola de trabajos en segundo plano (sin broker externo).
+    Los procesos de `flask worker` toman las tareas pendientes y las ejecutan
+    """
+    __tablename__ = 'tareas'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(100), nullable=False, index=True)
+    parametros = db.Column(db.Text)  # JSON
+    estado = db.Column(db.Enum('pendiente', 'en_proceso', 'completada', 'fallida', 'cancelada'),
+                       default='pendiente', nullable=False, index=True)
+    
+    # Progreso visible mientras corre
+    progreso = db.Column(db.Integer, default=0)  # 0-100
+    mensaje = db.Column(db.String(255))
+    
+    # Reintentos
+    intentos = db.Column(db.Integer, default=0, nullable=False)
+    max_intentos = db.Column(db.Integer, default=3, nullable=False)
+    ejecutar_despues = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    error = db.Column(db.Text)
+    
+    # Resultado (JSON) y archivo generado opcional (ej. Excel)
+    resultado = db.Column(db.Text)
+    archivo = db.deferred(db.Column(db.LargeBinary(length=16777215)))
+    archivo_nombre = db.Column(db.String(255))
+    archivo_mimetype = db.Column(db.String(150))
+    
+    worker = db.Column(db.String(100))
+    latido = db.Column(db.DateTime, index=True)  # Lo renueva el worker mientras ejecuta la tarea
+    fecha_inicio = db.Column(db.DateTime)
+    fecha_fin = db.Column(db.DateTime)
+    
+    usuario_registro_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='SET NULL'))
+    fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_hora_actualizo = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    usuario = db.relationship('Usuario', backref=db.backref('tareas', lazy='dynamic'))
+    
+    def __repr__(self):
+        return f'<Tarea {self.id} - {self.tipo} ({self.estado})>'
+    
+    @property
+    def terminada(self):
+        return self.estado in ('completada', 'fallida', 'cancelada')
+
+
+# ==================== TABLA: archivos ====================
+class Archivo(db.Model):
+    """
+    Archivo subido, guardado una sola vez por contenido (SHA-256).
+    `referencias` cuenta cuántos campos (imágenes de vehículo, documentos) apuntan a él.
+    Los documentos cifrados (`cifrado`, ruta terminada en .enc) se identifican por
+    un HMAC del contenido en lugar del SHA-256
+    """
+    __tablename__ = 'archivos'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    ruta = db.Column(db.String(500), unique=True, nullable=False)  # Relativa a /static
+    tamano = db.Column(db.BigInteger, nullable=False)
+    extension = db.Column(db.String(10))
+    nombre_original = db.Column(db.String(255))
+    referencias = db.Column(db.Integer, default=0, nullable=False)
+    cifrado = db.Column(db.Boolean, default=False, nullable=False)  # Contenido en AES-GCM por bloques
+    fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_hora_actualizo = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    huella = db.relationship('HuellaImagen', backref='archivo', uselist=False, cascade='all, delete-orphan')
+    
+    def __repr__(self):
+        return f'<Archivo {self.sha256[:12]} ({self.referencias} refs)>'
+
+
+# ==================== TABLA: huellas_imagen ====================
+class HuellaImagen(db.Model):
+    """
+    Hash perceptual (dHash de 64 bits) de una imagen de documento, para detectar
+    la misma foto subida de nuevo aunque esté recomprimida o redimensionada.
+    El hash se parte en 4 segmentos de 16 bits indexados (búsqueda multi-índice)
+    """
+    __tablename__ = 'huellas_imagen'
+
+    id = db.Column(db.Integer, primary_key=True)
+    archivo_id = db.Column(db.Integer, db.ForeignKey('archivos.id', ondelete='CASCADE'), unique=True, nullable=False)
+    hash = db.Column(db.BigInteger, nullable=False)  # 64 bits con signo
+    segmento_0 = db.Column(db.Integer, nullable=False, index=True)
+    segmento_1 = db.Column(db.Integer, nullable=False, index=True)
+    segmento_2 = db.Column(db.Integer, nullable=False, index=True)
+    segmento_3 = db.Column(db.Integer, nullable=False, index=True)
+    fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<HuellaImagen {self.archivo_id} - {self.hash & 0xFFFFFFFFFFFFFFFF:016x}>'
+
+
+# ==================== TABLA: subidas ====================
+class Subida(db.Model):
+    """
+    Subida reanudable por bloques (videos de vehículos).
+    Cada bloque es una parte de una subida multipart del backend de almacenamiento;
+    al finalizar el archivo pasa al almacén y se crea el VehiculoImagen
+    """
+    __tablename__ = 'subidas'
+
+    id = db.Column(db.String(32), primary_key=True)  # Token hexadecimal aleatorio
+    vehiculo_id = db.Column(db.Integer, db.ForeignKey('vehiculos.id', ondelete='CASCADE'), nullable=False, index=True)
+    nombre_original = db.Column(db.String(255), nullable=False)
+    extension = db.Column(db.String(10), nullable=False)
+    tamano_total = db.Column(db.BigInteger, nullable=False)
+    recibido = db.Column(db.BigInteger, default=0, nullable=False)  # Offset del siguiente bloque
+    sha256 = db.Column(db.String(64))  # Hash declarado del archivo completo; el verificado una vez armado
+    ruta_temporal = db.Column(db.String(500))  # Clave del objeto en armado, NULL al terminar
+    upload_id = db.Column(db.String(255))  # Id de la subida por partes en el backend, NULL una vez armado
+    partes = db.Column(db.Text)  # JSON [[numero, etag, sha256], ...]
+    estado = db.Column(db.Enum('en_curso', 'completada', 'cancelada', 'fallida'), default='en_curso', nullable=False, index=True)
+    vehiculo_imagen_id = db.Column(db.Integer, db.ForeignKey('vehiculos_imagenes.id', ondelete='SET NULL'))
+
+    usuario_registro_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='SET NULL'))
+    fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_hora_actualizo = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    vehiculo = db.relationship('Vehiculo', backref=db.backref('subidas', lazy='dynamic', cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<Subida {self.id} - {self.recibido}/{self.tamano_total}>'
+
+
+# ==================== TABLA: puntos_control ====================
+class PuntoControl(db.Model):
+    """
+    Avance de procesos por lotes reanudables: guarda el último id procesado
+    de cada tabla para continuar donde quedó si el proceso se interrumpe
+    """
+    __tablename__ = 'puntos_control'
+
+    id = db.Column(db.Integer, primary_key=True)
+    clave = db.Column(db.String(150), unique=True, nullable=False)  # '<proceso>:<tabla>'
+    ultimo_id = db.Column(db.Integer, default=0, nullable=False)
+    procesados = db.Column(db.Integer, default=0, nullable=False)
+    completado = db.Column(db.Boolean, default=False, nullable=False)
+    fecha_hora_registro = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_hora_actualizo = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PuntoControl {self.clave} - {self.ultimo_id}>'
+
+
 # ==================== TABLA: historico_usuarios ====================
 class HistoricoUsuario(db.Model):
     __tablename__ = 'historico_usuarios'
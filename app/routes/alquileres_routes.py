@@ -7,7 +7,7 @@ AGREGAR ESTAS RUTAS A TU APLICACIÃ“N FLASK
 Crear archivo: app/routes/alquileres_routes.py
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, send_file
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 from sqlalchemy import func, and_, or_
@@ -17,7 +17,18 @@ from app.models import (
     Alquiler, Vehiculo, Inquilino, Propietario, Banco, Usuario, EstadoAlquiler,
     TrabajoVehiculo, TipoTrabajo, Mecanico
 )
+from app.services.semana_service import (
+    serializar_semana, generar_excel_semana, nombre_excel_semana, EXCEL_MIMETYPE,
+    crear_snapshot_semana, obtener_snapshot_semana, invalidar_snapshot_semana
+)
+from app.services.nomina_service import (
+    calcular_nomina, aplicar_nomina, totalizar_semana, repreciar_porcentaje
+)
+from app.services.mora_service import limpiar_mora
+from app.services.tarea_service import encolar
 from functools import wraps
+from io import BytesIO
+import gzip
 
 alquileres_bp = Blueprint('alquiler', __name__)
 
@@ -196,19 +207,10 @@ def crear_semana():
         fecha_limite = fecha_inicio + timedelta(days=(3 - fecha_inicio.weekday()) % 7)
         
         # Create detalles
-        total_vehiculos = 0
-        socios = set()
-        inquilinos = set()
-        ingreso_total = 0
+        detalles = []
         
         for alquiler in alquileres_activos:
             vehiculo = Vehiculo.query.get(alquiler.vehiculo_id)
-            inquilino = Inquilino.query.get(alquiler.inquilino_id)
-            propietario = Propietario.query.get(vehiculo.propietario_id)
-            
-            # ✅ CORRECCIÓN: Calcular precio diario correctamente
-            precio_semanal = float(vehiculo.precio_semanal)
-            precio_diario = precio_semanal / 7
             
             # Calcular días reales trabajados en esta semana
             dias_trabajados_semana = min(
@@ -216,9 +218,6 @@ def crear_semana():
                 7
             )
             
-            ingreso_calculado = precio_diario * dias_trabajados_semana
-            nomina_empresa = ingreso_calculado * (float(porcentaje.porcentaje) / 100)
-            
             # Check if tiene deuda
             tiene_deuda = date.today() > fecha_limite
             
@@ -228,29 +227,23 @@ def crear_semana():
                 vehiculo_id=alquiler.vehiculo_id,
                 inquilino_id=alquiler.inquilino_id,
                 propietario_id=vehiculo.propietario_id,
-                precio_semanal=precio_semanal,
+                precio_semanal=vehiculo.precio_semanal,
                 dias_trabajo=dias_trabajados_semana,
-                ingreso_calculado=ingreso_calculado,
                 porcentaje_empresa=porcentaje.porcentaje,
-                nomina_empresa=nomina_empresa,
                 tiene_deuda=tiene_deuda,
                 fecha_limite_pago=fecha_limite,
-                nomina_final=ingreso_calculado,
                 usuario_registro_id=current_user.id
             )
             
             db.session.add(detalle)
-            
-            total_vehiculos += 1
-            socios.add(propietario.id)
-            inquilinos.add(inquilino.id)
-            ingreso_total += ingreso_calculado
+            detalles.append(detalle)
+        
+        # ✅ Nómina de toda la semana en una sola pasada (centavos enteros)
+        aplicar_nomina(detalles)
         
         # Update semana totals
-        semana.total_vehiculos = total_vehiculos
-        semana.total_socios = len(socios)
-        semana.total_inquilinos = len(inquilinos)
-        semana.ingreso_total = ingreso_total
+        totalizar_semana(semana)
+        total_vehiculos = semana.total_vehiculos
         
         db.session.commit()
         
@@ -312,109 +305,37 @@ def ver_detalles_semana(id):
     try:
         semana = SemanaAlquiler.query.get_or_404(id)
         
-        # ✅ FILTRADO CORRECTO: Solo detalles de ESTA semana
-        detalles = DetalleAlquilerSemanal.query.filter_by(
-            semana_alquiler_id=id
-        ).all()
-        
-        detalles_data = []
-        for detalle in detalles:
-            try:
-                vehiculo = Vehiculo.query.get(detalle.vehiculo_id)
-                inquilino = Inquilino.query.get(detalle.inquilino_id)
-                propietario = Propietario.query.get(detalle.propietario_id)
-                
-                # Get marca y modelo
-                marca_modelo = vehiculo.marca_modelo if vehiculo else None
-                
-                # Get iniciales propietario
-                iniciales = '??'
-                propietario_nombre = ''
-                if propietario:
-                    propietario_nombre = propietario.nombre_apellido or ''
-                    nombre_parts = propietario_nombre.split() if propietario_nombre else ['?']
-                    iniciales = ''.join([p[0].upper() for p in nombre_parts[:2]])
-                
-                # Get datos del vehículo
-                vehiculo_marca = ''
-                vehiculo_modelo_str = ''
-                vehiculo_placa = ''
-                if vehiculo:
-                    vehiculo_placa = vehiculo.placa or ''
-                    if marca_modelo:
-                        vehiculo_marca = marca_modelo.marca or ''
-                        vehiculo_modelo_str = marca_modelo.modelo or ''
-                
-                # Get datos del inquilino
-                inquilino_nombre = ''
-                inquilino_telefono = ''
-                if inquilino:
-                    inquilino_nombre = inquilino.nombre_apellido or ''
-                    inquilino_telefono = inquilino.telefono or ''
-                
-                # ✅ CALCULAR INVERSIONES TOTALES
-                inversiones_totales = db.session.query(
-                    func.sum(TrabajoVehiculo.costo)
-                ).join(
-                    DetalleAlquilerSemanal,
-                    DetalleAlquilerSemanal.trabajo_vehiculo_id == TrabajoVehiculo.id
-                ).filter(
-                    DetalleAlquilerSemanal.id == detalle.id
-                ).scalar() or 0
-                
-                detalles_data.append({
-                    'id': detalle.id,
-                    'vehiculo_id': detalle.vehiculo_id,
-                    'inquilino_id': detalle.inquilino_id,
-                    'propietario_id': detalle.propietario_id,
-                    'propietario_nombre': propietario_nombre,
-                    'propietario_iniciales': iniciales,
-                    'vehiculo_marca': vehiculo_marca,
-                    'vehiculo_modelo': vehiculo_modelo_str,
-                    'vehiculo_placa': vehiculo_placa,
-                    'inquilino_nombre': inquilino_nombre,
-                    'inquilino_telefono': inquilino_telefono,
-                    'precio_semanal': float(detalle.precio_semanal),
-                    'dias_trabajo': detalle.dias_trabajo,
-                    'ingreso_calculado': float(detalle.ingreso_calculado),
-                    'inversion_mecanica': float(detalle.inversion_mecanica or 0),
-                    'inversiones_totales': float(inversiones_totales),
-                    'concepto_inversion': detalle.concepto_inversion or '',
-                    'monto_descuento': float(detalle.monto_descuento or 0),
-                    'concepto_descuento': detalle.concepto_descuento or '',
-                    'nomina_empresa': float(detalle.nomina_empresa),
-                    'porcentaje_empresa': float(detalle.porcentaje_empresa),
-                    'tiene_deuda': detalle.tiene_deuda,
-                    'monto_deuda': float(detalle.monto_deuda or 0),
-                    'nomina_final': float(detalle.nomina_final),
-                    'banco_id': detalle.banco_id,
-                    'fecha_confirmacion_pago': detalle.fecha_confirmacion_pago.isoformat() if detalle.fecha_confirmacion_pago else '',
-                    'pago_confirmado': detalle.pago_confirmado,
-                    'notas': detalle.notas or ''
-                })
-            except Exception as e:
-                print(f"❌ Error procesando detalle {detalle.id}: {str(e)}")
-                continue
+        # Las semanas cerradas se sirven desde su snapshot inmutable
+        snapshot = obtener_snapshot_semana(semana)
+        if snapshot:
+            return _respuesta_snapshot_json(snapshot)
         
-        return jsonify({
-            'success': True,
-            'semana': {
-                'id': semana.id,
-                'fecha_inicio': semana.fecha_inicio.strftime('%d/%m/%Y'),
-                'fecha_fin': semana.fecha_fin.strftime('%d/%m/%Y'),
-                'total_vehiculos': semana.total_vehiculos,
-                'total_socios': semana.total_socios,
-                'total_inquilinos': semana.total_inquilinos,
-                'ingreso_total': float(semana.ingreso_total)
-            },
-            'detalles': detalles_data
-        })
+        return jsonify(serializar_semana(semana))
         
     except Exception as e:
         print(f"❌ Error en ver_detalles_semana: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+def _respuesta_snapshot_json(snapshot):
+    """Respuesta JSON desde un snapshot, con ETag fuerte y gzip si el cliente lo acepta"""
+    usa_gzip = 'gzip' in request.accept_encodings
+    etag = f'{snapshot.etag}-gz' if usa_gzip else snapshot.etag
+    
+    if request.if_none_match.contains(etag):
+        respuesta = Response(status=304)
+    elif usa_gzip:
+        respuesta = Response(snapshot.datos_json_gz, mimetype='application/json')
+        respuesta.headers['Content-Encoding'] = 'gzip'
+    else:
+        respuesta = Response(gzip.decompress(snapshot.datos_json_gz), mimetype='application/json')
+    
+    respuesta.set_etag(etag)
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
 
 # ==========================================
 # GUARDAR CAMBIOS EN DETALLES
@@ -425,10 +346,18 @@ def guardar_cambios_semana(id):
     """Guarda los cambios realizados en los detalles de la semana"""
     
     try:
+        semana = SemanaAlquiler.query.get_or_404(id)
+        
+        if semana.estado != 'abierta':
+            return jsonify({
+                'success': False,
+                'message': 'No se puede editar una semana cerrada'
+            }), 400
+        
         data = request.get_json()
         cambios = data.get('cambios', [])
         
-        updated_count = 0
+        actualizados = []
         
         for cambio in cambios:
             detalle = DetalleAlquilerSemanal.query.get(cambio['id'])
@@ -450,27 +379,20 @@ def guardar_cambios_semana(id):
                 
                 detalle.pago_confirmado = cambio.get('pago_confirmado', False)
                 detalle.notas = cambio.get('notas')
-                
-                # Recalculate
-                #detalle.ingreso_calculado = float(detalle.precio_semanal) * int(detalle.dias_trabajo)
-                #detalle.nomina_empresa = detalle.ingreso_calculado * (float(detalle.porcentaje_empresa) / 100)
-                #detalle.nomina_final = detalle.ingreso_calculado + float(detalle.monto_deuda or 0)
-                #  Recalculate con fÃ³rmula correcta
-                precio_diario = float(detalle.precio_semanal) / 7
-                detalle.ingreso_calculado = precio_diario * int(detalle.dias_trabajo)
-                detalle.nomina_empresa =  precio_diario * int(detalle.dias_trabajo) #detalle.ingreso_calculado * (float(detalle.porcentaje_empresa) / 100)
-                detalle.nomina_final =  precio_diario * int(detalle.dias_trabajo) #detalle.ingreso_calculado + float(detalle.monto_deuda or 0)
+                limpiar_mora(detalle)
                 
                 detalle.usuario_actualizo_id = current_user.id
                 detalle.fecha_hora_actualizo = datetime.utcnow()
                 
-                updated_count += 1
+                actualizados.append(detalle)
+        
+        # Recalculate nómina de los detalles editados en una sola pasada
+        aplicar_nomina(actualizados)
+        updated_count = len(actualizados)
         
         # Recalculate semana totals
-        semana = SemanaAlquiler.query.get(id)
         if semana:
-            detalles = DetalleAlquilerSemanal.query.filter_by(semana_alquiler_id=id).all()
-            semana.ingreso_total = sum(float(d.ingreso_calculado) for d in detalles)
+            totalizar_semana(semana)
             semana.usuario_actualizo_id = current_user.id
             semana.fecha_hora_actualizo = datetime.utcnow()
         
@@ -595,6 +517,12 @@ def agregar_alquiler_a_semana():
         # Get semana
         semana = SemanaAlquiler.query.get_or_404(semana_id)
         
+        if semana.estado != 'abierta':
+            return jsonify({
+                'success': False,
+                'message': 'No se puede agregar alquileres a una semana cerrada'
+            }), 400
+        
         # Get vehÃ­culo
         vehiculo = Vehiculo.query.get_or_404(vehiculo_id)
         propietario = Propietario.query.get(vehiculo.propietario_id)
@@ -620,8 +548,8 @@ def agregar_alquiler_a_semana():
             }), 400
         
         # âœ… PASO 1: Crear registro en tabla ALQUILERES
-        precio_semanal = float(vehiculo.precio_semanal)
-        ingreso = precio_semanal * dias_trabajo
+        porcentaje = PorcentajeGanancia.query.get(semana.porcentaje_ganancia_id)
+        nomina = calcular_nomina(vehiculo.precio_semanal, dias_trabajo, porcentaje.porcentaje)
         
         nuevo_alquiler = Alquiler(
             vehiculo_id=vehiculo_id,
@@ -631,7 +559,7 @@ def agregar_alquiler_a_semana():
             fecha_alquiler_fin=semana.fecha_fin,
             semana=semana.numero_semana,
             dia_trabajo=dias_trabajo,
-            ingreso=ingreso,
+            ingreso=nomina['ingreso_calculado'],
             monto_descuento=0.00,
             usuario_registro_id=current_user.id,
             usuario_actualizo_id=current_user.id  # âœ… Agregado
@@ -641,11 +569,6 @@ def agregar_alquiler_a_semana():
         db.session.flush()  # Para obtener el ID
         
         # âœ… PASO 2: Ahora crear el detalle con alquiler_id
-        porcentaje = PorcentajeGanancia.query.get(semana.porcentaje_ganancia_id)
-        
-        ingreso_calculado = precio_semanal * dias_trabajo
-        nomina_empresa = ingreso_calculado * (float(porcentaje.porcentaje) / 100)
-        
         # Calculate fecha limite (jueves)
         fecha_limite = semana.fecha_inicio + timedelta(
             days=(3 - semana.fecha_inicio.weekday()) % 7
@@ -658,31 +581,21 @@ def agregar_alquiler_a_semana():
             vehiculo_id=vehiculo_id,
             inquilino_id=inquilino_id,
             propietario_id=vehiculo.propietario_id,
-            precio_semanal=precio_semanal,
+            precio_semanal=vehiculo.precio_semanal,
             dias_trabajo=dias_trabajo,
-            ingreso_calculado=ingreso_calculado,
+            ingreso_calculado=nomina['ingreso_calculado'],
             porcentaje_empresa=porcentaje.porcentaje,
-            nomina_empresa=nomina_empresa,
+            nomina_empresa=nomina['nomina_empresa'],
             tiene_deuda=tiene_deuda,
             fecha_limite_pago=fecha_limite,
-            nomina_final=ingreso_calculado,
+            nomina_final=nomina['nomina_final'],
             usuario_registro_id=current_user.id
         )
         
         db.session.add(detalle)
         
         # Update semana totals
-        semana.total_vehiculos = (semana.total_vehiculos or 0) + 1
-        semana.ingreso_total = float(semana.ingreso_total or 0) + ingreso_calculado
-        
-        # Recalculate unique propietarios and inquilinos
-        semana.total_socios = db.session.query(
-            func.count(func.distinct(DetalleAlquilerSemanal.propietario_id))
-        ).filter_by(semana_alquiler_id=semana_id).scalar() + 1
-        
-        semana.total_inquilinos = db.session.query(
-            func.count(func.distinct(DetalleAlquilerSemanal.inquilino_id))
-        ).filter_by(semana_alquiler_id=semana_id).scalar() + 1
+        totalizar_semana(semana)
         
         semana.usuario_actualizo_id = current_user.id
         semana.fecha_hora_actualizo = datetime.utcnow()
@@ -742,6 +655,12 @@ def agregar_alquiler_a_semana_():
     # Get semana
     semana = SemanaAlquiler.query.get_or_404(semana_id)
     
+    if semana.estado != 'abierta':
+        return jsonify({
+            'success': False,
+            'message': 'No se puede agregar alquileres a una semana cerrada'
+        }), 400
+    
     # Get vehÃ­culo
     vehiculo = Vehiculo.query.get_or_404(vehiculo_id)
     propietario = Propietario.query.get(vehiculo.propietario_id)
@@ -759,9 +678,7 @@ def agregar_alquiler_a_semana_():
     porcentaje = PorcentajeGanancia.query.get(semana.porcentaje_ganancia_id)
     
     # Calculate
-    precio_semanal = float(vehiculo.precio_semanal)
-    ingreso_calculado = precio_semanal * dias_trabajo
-    nomina_empresa = ingreso_calculado * (float(porcentaje.porcentaje) / 100)
+    nomina = calcular_nomina(vehiculo.precio_semanal, dias_trabajo, porcentaje.porcentaje)
     
     # Calculate fecha limite (jueves)
     fecha_limite = semana.fecha_inicio + timedelta(
@@ -776,31 +693,21 @@ def agregar_alquiler_a_semana_():
         vehiculo_id=vehiculo_id,
         inquilino_id=inquilino_id,
         propietario_id=vehiculo.propietario_id,
-        precio_semanal=precio_semanal,
+        precio_semanal=vehiculo.precio_semanal,
         dias_trabajo=dias_trabajo,
-        ingreso_calculado=ingreso_calculado,
+        ingreso_calculado=nomina['ingreso_calculado'],
         porcentaje_empresa=porcentaje.porcentaje,
-        nomina_empresa=nomina_empresa,
+        nomina_empresa=nomina['nomina_empresa'],
         tiene_deuda=tiene_deuda,
         fecha_limite_pago=fecha_limite,
-        nomina_final=ingreso_calculado,
+        nomina_final=nomina['nomina_final'],
         usuario_registro_id=current_user.id
     )
     
     db.session.add(detalle)
     
     # Update semana totals
-    semana.total_vehiculos = (semana.total_vehiculos or 0) + 1
-    semana.ingreso_total = float(semana.ingreso_total or 0) + ingreso_calculado
-    
-    # Recalculate unique propietarios and inquilinos
-    semana.total_socios = db.session.query(
-        func.count(func.distinct(DetalleAlquilerSemanal.propietario_id))
-    ).filter_by(semana_alquiler_id=semana_id).scalar() + 1
-    
-    semana.total_inquilinos = db.session.query(
-        func.count(func.distinct(DetalleAlquilerSemanal.inquilino_id))
-    ).filter_by(semana_alquiler_id=semana_id).scalar() + 1
+    totalizar_semana(semana)
     
     semana.usuario_actualizo_id = current_user.id
     semana.fecha_hora_actualizo = datetime.utcnow()
@@ -840,20 +747,8 @@ def eliminar_detalle(id):
             }), 400
         
         # Update semana totals
-        semana.total_vehiculos = max(0, semana.total_vehiculos - 1)
-        semana.ingreso_total = float(semana.ingreso_total or 0) - float(detalle.ingreso_calculado or 0)
-        
-        # Recalculate propietarios and inquilinos
         db.session.delete(detalle)
-        db.session.flush()
-        
-        semana.total_socios = db.session.query(
-            func.count(func.distinct(DetalleAlquilerSemanal.propietario_id))
-        ).filter_by(semana_alquiler_id=semana_id).scalar() or 0
-        
-        semana.total_inquilinos = db.session.query(
-            func.count(func.distinct(DetalleAlquilerSemanal.inquilino_id))
-        ).filter_by(semana_alquiler_id=semana_id).scalar() or 0
+        totalizar_semana(semana)
         
         db.session.commit()
         
@@ -874,7 +769,7 @@ def eliminar_detalle(id):
 @login_required
 @admin_required
 def cerrar_semana(id):
-    """Cierra una semana de trabajo - SOLO ADMIN"""
+    """Cierra una semana de trabajo y genera su snapshot inmutable - SOLO ADMIN"""
     
     try:
         semana = SemanaAlquiler.query.get_or_404(id)
@@ -886,6 +781,8 @@ def cerrar_semana(id):
         semana.usuario_actualizo_id = current_user.id
         semana.fecha_hora_actualizo = datetime.utcnow()
         
+        crear_snapshot_semana(semana, usuario_id=current_user.id)
+        
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Semana cerrada exitosamente'})
@@ -895,97 +792,76 @@ def cerrar_semana(id):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+# ==========================================
+# REABRIR SEMANA (CON VALIDACIÓN ADMIN)
+# ==========================================
+@alquileres_bp.route('/alquiler/semanas/<int:id>/reabrir', methods=['POST'])
+@login_required
+@admin_required
+def reabrir_semana(id):
+    """Reabre una semana cerrada e invalida su snapshot - SOLO ADMIN"""
+    
+    try:
+        semana = SemanaAlquiler.query.get_or_404(id)
+        
+        if semana.estado != 'cerrada':
+            return jsonify({'success': False, 'message': 'Solo se pueden reabrir semanas cerradas'}), 400
+        
+        semana.estado = 'abierta'
+        semana.usuario_actualizo_id = current_user.id
+        semana.fecha_hora_actualizo = datetime.utcnow()
+        
+        invalidar_snapshot_semana(semana)
+        
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Semana reabierta exitosamente'})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 # ==========================================
 # EXPORTAR A EXCEL
 # ==========================================
 @alquileres_bp.route('/alquiler/semanas/<int:id>/exportar-excel')
 @login_required
 def exportar_excel_semana(id):
-    """Exporta los detalles de una semana a Excel"""
+    """Exporta los detalles de una semana a Excel (?async=1 lo genera en segundo plano)"""
     
     try:
-        import openpyxl
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        from io import BytesIO
-        from flask import send_file
-        
         semana = SemanaAlquiler.query.get_or_404(id)
-        detalles = DetalleAlquilerSemanal.query.filter_by(semana_alquiler_id=id).all()
-        
-        # Create workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f"Semana {semana.numero_semana}"
-        
-        # Header
-        headers = [
-            'Propietario', 'VehÃ­culo', 'Placa', 'Inquilino', 'Tel. Inquilino',
-            'Semanal', 'DT', 'Ingreso', 'InversiÃ³n', 'Concepto Desc.',
-            'NÃ³mina', '% Empresa', 'Deuda', 'NÃ³mina 2', 'Banco',
-            'Conf. Pago', 'DT2'
-        ]
-        
-        ws.append(headers)
         
-        # Style header
-        for cell in ws[1]:
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-        
-        # Add data
-        for detalle in detalles:
-            vehiculo = Vehiculo.query.get(detalle.vehiculo_id)
-            inquilino = Inquilino.query.get(detalle.inquilino_id)
-            propietario = Propietario.query.get(detalle.propietario_id)
-            banco = Banco.query.get(detalle.banco_id) if detalle.banco_id else None
-            marca_modelo = vehiculo.marca_modelo_vehiculo if vehiculo else None
-            
-            ws.append([
-                propietario.nombre_apellido if propietario else '',
-                f"{marca_modelo.marca} {marca_modelo.modelo}" if marca_modelo else '',
-                vehiculo.placa if vehiculo else '',
-                inquilino.nombre_apellido if inquilino else '',
-                inquilino.telefono if inquilino else '',
-                float(detalle.precio_semanal),
-                detalle.dias_trabajo,
-                float(detalle.ingreso_calculado),
-                float(detalle.inversion_mecanica or 0),
-                detalle.concepto_descuento or '',
-                float(detalle.nomina_empresa),
-                float(detalle.porcentaje_empresa),
-                float(detalle.monto_deuda or 0),
-                float(detalle.nomina_final),
-                banco.banco if banco else '',
-                detalle.fecha_confirmacion_pago.strftime('%d/%m/%Y') if detalle.fecha_confirmacion_pago else '',
-                detalle.dias_trabajo
-            ])
-        
-        # Auto-adjust columns
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Save to BytesIO
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        filename = f"semana_{semana.fecha_inicio.strftime('%Y%m%d')}_{semana.fecha_fin.strftime('%Y%m%d')}.xlsx"
+        if request.args.get('async') == '1':
+            t = encolar('exportar_excel_semana', {'semana_id': semana.id}, usuario_id=current_user.id)
+            return jsonify({
+                'success': True,
+                'tarea_id': t.id,
+                'estado_url': url_for('tareas.estado_tarea', id=t.id),
+                'archivo_url': url_for('tareas.descargar_archivo_tarea', id=t.id)
+            }), 202
+        
+        # Semana cerrada: servir el Excel congelado con su ETag
+        snapshot = obtener_snapshot_semana(semana)
+        if snapshot:
+            respuesta = send_file(
+                BytesIO(snapshot.excel),
+                mimetype=EXCEL_MIMETYPE,
+                as_attachment=True,
+                download_name=nombre_excel_semana(semana),
+                etag=snapshot.etag_excel,
+                conditional=True
+            )
+            respuesta.cache_control.private = True
+            respuesta.cache_control.no_cache = True
+            return respuesta
         
         return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            BytesIO(generar_excel_semana(semana)),
+            mimetype=EXCEL_MIMETYPE,
             as_attachment=True,
-            download_name=filename
+            download_name=nombre_excel_semana(semana)
         )
         
     except Exception as e:
@@ -1126,9 +1002,15 @@ def editar_porcentaje_ganancia(id):
         
         porcentaje.usuario_actualizo_id = current_user.id
         
+        mensaje = 'Porcentaje actualizado exitosamente'
+        if request.form.get('repreciar_abiertas') == 'on':
+            db.session.flush()
+            resumen = repreciar_porcentaje(porcentaje, aplicar=True)
+            mensaje += f" ({resumen['total_detalles']} detalles recalculados en {resumen['total_semanas']} semanas)"
+        
         db.session.commit()
         
-        flash('Porcentaje actualizado exitosamente', 'success')
+        flash(mensaje, 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -1137,6 +1019,67 @@ def editar_porcentaje_ganancia(id):
     return redirect(url_for('alquiler.porcentajes_ganancia'))
 
 
+@alquileres_bp.route('/alquiler/porcentajes_ganancia/<int:id>/repreciar', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def repreciar_porcentaje_ganancia(id):
+    """
+    Recalcula la nómina de los detalles que usan el porcentaje.
+    GET devuelve la vista previa (dry-run); POST aplica los cambios en una sola transacción.
+    Parámetros: alcance=abiertas|rango, desde/hasta (YYYY-MM-DD) para alcance=rango.
+    """
+    
+    try:
+        porcentaje = PorcentajeGanancia.query.get_or_404(id)
+        params = request.get_json(silent=True) or request.values
+        
+        alcance = params.get('alcance', 'abiertas')
+        if alcance not in ('abiertas', 'rango'):
+            return jsonify({'success': False, 'message': 'Alcance inválido'}), 400
+        
+        desde = params.get('desde')
+        hasta = params.get('hasta')
+        desde = datetime.strptime(desde, '%Y-%m-%d').date() if desde else None
+        hasta = datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else None
+        
+        if alcance == 'rango' and not (desde or hasta):
+            return jsonify({'success': False, 'message': 'Indique desde y/o hasta para el rango'}), 400
+        
+        aplicar = request.method == 'POST'
+        
+        if aplicar and str(params.get('async')) == '1':
+            t = encolar('repreciar_porcentaje', {
+                'porcentaje_id': porcentaje.id,
+                'alcance': alcance,
+                'desde': desde.isoformat() if desde else None,
+                'hasta': hasta.isoformat() if hasta else None
+            }, usuario_id=current_user.id)
+            return jsonify({
+                'success': True,
+                'tarea_id': t.id,
+                'estado_url': url_for('tareas.estado_tarea', id=t.id)
+            }), 202
+        
+        resumen = repreciar_porcentaje(porcentaje, alcance, desde, hasta, aplicar=aplicar)
+        
+        if aplicar:
+            db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f"{resumen['total_detalles']} detalles {'actualizados' if aplicar else 'por actualizar'}",
+            'porcentaje': float(porcentaje.porcentaje),
+            **resumen
+        })
+        
+    except ValueError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Formato de fecha inválido'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 @alquileres_bp.route('/alquiler/porcentajes_ganancia/<int:id>/eliminar', methods=['POST'])
 @login_required
 def eliminar_porcentaje_ganancia(id):
@@ -1367,6 +1310,55 @@ def eliminar_semana(id):
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+# ==========================================
+# DETALLES EN MORA
+# ==========================================
+@alquileres_bp.route('/alquiler/mora')
+@login_required
+def detalles_en_mora():
+    """Lista los detalles en mora según el último cálculo nocturno (filtrado en SQL)"""
+    
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 50, type=int), 200)
+        dias_min = request.args.get('dias_min', 1, type=int)
+        semana_id = request.args.get('semana_id', type=int)
+        
+        query = DetalleAlquilerSemanal.query.filter(
+            DetalleAlquilerSemanal.en_mora.is_(True),
+            DetalleAlquilerSemanal.dias_mora >= dias_min
+        )
+        if semana_id:
+            query = query.filter(DetalleAlquilerSemanal.semana_alquiler_id == semana_id)
+        
+        pagina = query.order_by(
+            DetalleAlquilerSemanal.dias_mora.desc(),
+            DetalleAlquilerSemanal.id
+        ).paginate(page=page, per_page=per_page, error_out=False)
+        
+        return jsonify({
+            'success': True,
+            'total': pagina.total,
+            'page': pagina.page,
+            'pages': pagina.pages,
+            'detalles': [{
+                'id': d.id,
+                'semana_alquiler_id': d.semana_alquiler_id,
+                'vehiculo_id': d.vehiculo_id,
+                'inquilino_id': d.inquilino_id,
+                'propietario_id': d.propietario_id,
+                'fecha_limite_pago': d.fecha_limite_pago.isoformat() if d.fecha_limite_pago else None,
+                'dias_mora': d.dias_mora,
+                'penalizacion_mora': float(d.penalizacion_mora or 0),
+                'nomina_final': float(d.nomina_final),
+                'fecha_calculo_mora': d.fecha_calculo_mora.isoformat() if d.fecha_calculo_mora else None
+            } for d in pagina.items]
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 # ==========================================
 # OBTENER INVERSIONES DE DETALLE (NUEVO)
 # ==========================================
@@ -1494,11 +1486,10 @@ def editar_detalle_completo(id):
         
         detalle.pago_confirmado = data.get('pago_confirmado', False)
         detalle.notas = data.get('notas', '')
+        limpiar_mora(detalle)
         
         # Recalculate
-        detalle.ingreso_calculado = float(detalle.precio_semanal) * int(detalle.dias_trabajo)
-        detalle.nomina_empresa = detalle.ingreso_calculado * (float(detalle.porcentaje_empresa) / 100)
-        detalle.nomina_final = detalle.ingreso_calculado + float(detalle.monto_deuda or 0)
+        aplicar_nomina([detalle])
         
         detalle.usuario_actualizo_id = current_user.id
         detalle.fecha_hora_actualizo = datetime.utcnow()
@@ -1508,21 +1499,7 @@ def editar_detalle_completo(id):
         semana.fecha_hora_actualizo = datetime.utcnow()
         
         # Recalculate totals
-        detalles = DetalleAlquilerSemanal.query.filter_by(
-            semana_alquiler_id=detalle.semana_alquiler_id
-        ).all()
-        
-        semana.ingreso_total = sum(float(d.ingreso_calculado) for d in detalles)
-        semana.total_vehiculos = len(detalles)
-        
-        # Recalculate unique counts
-        semana.total_socios = db.session.query(
-            func.count(func.distinct(DetalleAlquilerSemanal.propietario_id))
-        ).filter_by(semana_alquiler_id=detalle.semana_alquiler_id).scalar()
-        
-        semana.total_inquilinos = db.session.query(
-            func.count(func.distinct(DetalleAlquilerSemanal.inquilino_id))
-        ).filter_by(semana_alquiler_id=detalle.semana_alquiler_id).scalar()
+        totalizar_semana(semana)
         
         db.session.commit()
         
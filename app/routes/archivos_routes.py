@@ -0,0 +1,179 @@
+"""
+Archivos Routes - Entrega protegida de archivos subidos
+
+Los documentos de identidad y la media de vehículos ya no salen por /static:
+/archivos/<ruta> verifica la sesión y los permisos, responde con ETag y
+Last-Modified (304 si no cambió) y admite Range para adelantar videos.
+
+En producción la transferencia la hace el servidor web:
+- Apache (mod_xsendfile): USE_X_SENDFILE = True
+- Nginx: ARCHIVOS_X_ACCEL_PREFIJO = '/protegido/' con
+
+      location /protegido/ {
+          internal;
+          alias /ruta/a/app/static/;
+      }
+
+  y /static/uploads/ sin acceso directo.
+- S3 (ALMACENAMIENTO = 's3'): redirección a una URL prefirmada del bucket.
+
+Los documentos cifrados (.enc) no pueden delegarse: siempre pasan por aquí y
+se descifran al vuelo, bloque a bloque (cifrado_service).
+
+/archivos/duplicados busca documentos parecidos por hash perceptual (huella_service).
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+
+from flask import Blueprint, current_app, request, send_file, abort, redirect, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import or_
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+from app.models import VehiculoImagen, VehiculoMarcaModelo, Banco
+from app.services.almacen_service import CARPETA
+from app.services.almacenamiento_service import almacenamiento
+from app.services.cifrado_service import SUFIJO, TAMANO_BLOQUE, abrir_documento, es_cifrado
+from app.services.huella_service import UMBRAL_MAXIMO, buscar_similares, calcular_huella, duplicados_de
+
+archivos_bp = Blueprint('archivos', __name__)
+
+UN_ANIO = 365 * 24 * 3600
+
+
+def _es_media(ruta):
+    """Fotos/videos de vehículos y logos: visibles para cualquier usuario autenticado"""
+    return (
+        VehiculoImagen.query.filter(or_(
+            VehiculoImagen.ruta == ruta,
+            VehiculoImagen.ruta_miniatura == ruta,
+            VehiculoImagen.ruta_display == ruta
+        )).first() is not None
+        or VehiculoMarcaModelo.query.filter_by(logo_path=ruta).first() is not None
+        or Banco.query.filter_by(logo_path=ruta).first() is not None
+    )
+
+
+def _puede_ver(ruta):
+    """Los documentos (cédulas, licencias...) solo los ve el administrador"""
+    return current_user.rol == 'admin' or _es_media(ruta)
+
+
+def _cache_control(respuesta, ruta):
+    # Los archivos del almacén se nombran por su hash: su contenido nunca cambia
+    respuesta.cache_control.public = False
+    respuesta.cache_control.private = True
+    if ruta.startswith(f'{CARPETA}/'):
+        respuesta.cache_control.max_age = UN_ANIO
+        respuesta.cache_control.immutable = True
+    else:
+        respuesta.cache_control.no_cache = True
+    return respuesta
+
+
+def _servir_cifrado(backend, ruta):
+    """Entrega un documento .enc descifrándolo en streaming (admite Range con disco local)"""
+    estado = backend.estado(ruta)
+    if estado is None:
+        abort(404)
+    if not _puede_ver(ruta):
+        abort(403)
+
+    lector = abrir_documento(backend, ruta, tamano_cifrado=estado[0])
+    respuesta = current_app.response_class(
+        wrap_file(request.environ, lector, buffer_size=TAMANO_BLOQUE),
+        mimetype=mimetypes.guess_type(ruta[:-len(SUFIJO)])[0] or 'application/octet-stream',
+        direct_passthrough=True
+    )
+    respuesta.content_length = lector.tamano
+    # El nombre es la huella del contenido: sirve de ETag fuerte
+    respuesta.set_etag(ruta.rsplit('/', 1)[-1].split('.', 1)[0])
+    respuesta.last_modified = estado[1]
+    respuesta.make_conditional(
+        request, accept_ranges=lector.seekable(), complete_length=lector.tamano
+    )
+    return _cache_control(respuesta, ruta)
+
+
+@archivos_bp.route('/duplicados', methods=['GET', 'POST'])
+@login_required
+def duplicados():
+    """
+    Posibles duplicados de un documento por hash perceptual (solo administrador):
+    GET ?ruta=<documento guardado>, o POST con 'archivo' para revisarlo antes de guardarlo
+    """
+    if current_user.rol != 'admin':
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    umbral = request.values.get('umbral', type=int)
+    if umbral is not None and not 0 <= umbral <= UMBRAL_MAXIMO:
+        return jsonify({'success': False, 'message': f'El umbral debe estar entre 0 y {UMBRAL_MAXIMO}'}), 400
+    try:
+        if request.method == 'POST':
+            file = request.files.get('archivo')
+            if not file or not file.filename:
+                return jsonify({'success': False, 'message': 'Archivo requerido'}), 400
+            huella = calcular_huella(file.read())
+            if huella is None:
+                return jsonify({'success': False, 'message': 'Detección de duplicados no disponible'}), 503
+            similares = buscar_similares(huella, umbral)
+        else:
+            ruta = request.args.get('ruta', '')
+            similares = duplicados_de(ruta, umbral)
+            if similares is None:
+                return jsonify({'success': False, 'message': 'El documento aún no tiene huella calculada'}), 404
+
+        return jsonify({'success': True, 'duplicados': similares})
+    except (OSError, ValueError) as e:
+        # Pillow no reconoce el contenido como imagen
+        return jsonify({'success': False, 'message': f'No se pudo leer la imagen: {str(e)}'}), 400
+
+
+@archivos_bp.route('/<path:ruta>')
+@login_required
+def servir_archivo(ruta):
+    """Entrega un archivo de /static/uploads verificando permisos"""
+    if not ruta.startswith('uploads/'):
+        abort(404)
+
+    if safe_join(current_app.static_folder, ruta) is None:
+        abort(404)
+
+    backend = almacenamiento()
+    if es_cifrado(ruta):
+        return _servir_cifrado(backend, ruta)
+
+    absoluta = backend.ruta_local(ruta)
+    if absoluta is None:
+        # Backend remoto (S3): redirigir a una URL prefirmada de corta duración
+        if not _puede_ver(ruta):
+            abort(403)
+        respuesta = redirect(backend.url_descarga(
+            ruta, expira=current_app.config.get('ARCHIVOS_URL_EXPIRA', 300)
+        ))
+        respuesta.cache_control.no_store = True
+        return respuesta
+
+    if not os.path.isfile(absoluta):
+        abort(404)
+    if not _puede_ver(ruta):
+        abort(403)
+
+    prefijo = current_app.config.get('ARCHIVOS_X_ACCEL_PREFIJO')
+    if prefijo:
+        # Nginx entrega el archivo (incluidos los Range); aquí solo los encabezados
+        estado = os.stat(absoluta)
+        respuesta = current_app.response_class(
+            mimetype=mimetypes.guess_type(ruta)[0] or 'application/octet-stream'
+        )
+        respuesta.headers['X-Accel-Redirect'] = prefijo.rstrip('/') + '/' + quote(ruta)
+        respuesta.set_etag(f'{estado.st_mtime_ns:x}-{estado.st_size:x}')
+        respuesta.last_modified = int(estado.st_mtime)
+        respuesta.make_conditional(request)
+        return _cache_control(respuesta, ruta)
+
+    # send_file atiende If-None-Match / If-Modified-Since / Range y, con
+    # USE_X_SENDFILE, delega la transferencia al servidor web
+    respuesta = send_file(absoluta, conditional=True, etag=True, max_age=None)
+    return _cache_control(respuesta, ruta)
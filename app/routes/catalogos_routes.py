@@ -9,17 +9,12 @@ from app.models import (
     Usuario, RegistroAcceso,HistoricoVehiculoMarcaModelo,HistoricoBanco,HistoricoParentesco, VehiculoMarcaModelo, EstadoAlquiler,
     MetodoPago, TipoCuenta, Banco, Parentesco
 )
+from app.services.almacen_service import guardar_archivo, liberar_archivo
 from datetime import datetime
-import os
-from werkzeug.utils import secure_filename
 
 catalogo_bp = Blueprint('catalogo', __name__, url_prefix='/catalogo')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-UPLOAD_FOLDER = 'app/static/uploads/logos'
-
-# Ensure upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -78,15 +73,7 @@ def crear_marca_modelo():
         if 'logo' in request.files:
             file = request.files['logo']
             if file and file.filename and allowed_file(file.filename):
-                # Create unique filename
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename)
-                unique_filename = f"{name}_{timestamp}{ext}"
-                
-                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                file.save(filepath)
-                logo_path = f'uploads/logos/{unique_filename}'
+                logo_path, _ = guardar_archivo(file)
         
         # Create new record
         nueva_marca = VehiculoMarcaModelo(
@@ -159,24 +146,11 @@ def editar_marca_modelo(id):
         if 'logo' in request.files:
             file = request.files['logo']
             if file and file.filename and allowed_file(file.filename):
-                # Delete old logo if exists
-                if marca.logo_path:
-                    old_logo = os.path.join('app/static', marca.logo_path)
-                    if os.path.exists(old_logo):
-                        try:
-                            os.remove(old_logo)
-                        except Exception as e:
-                            print(f"Error deleting old logo: {e}")
-                
-                # Save new logo
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename)
-                unique_filename = f"{name}_{timestamp}{ext}"
+                # Release old logo (deleted after commit)
+                liberar_archivo(marca.logo_path)
                 
-                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                file.save(filepath)
-                marca.logo_path = f'uploads/logos/{unique_filename}'
+                # Save new logo (content-addressed store)
+                marca.logo_path, _ = guardar_archivo(file)
         
         # Register in history
         #registrar_historico(marca, 'UPDATE')
@@ -201,14 +175,8 @@ def eliminar_marca_modelo(id):
         # Register in history before deletion
         #registrar_historico(marca, 'DELETE')
         
-        # Delete logo file if exists
-        if marca.logo_path:
-            logo_file = os.path.join('app/static', marca.logo_path)
-            if os.path.exists(logo_file):
-                try:
-                    os.remove(logo_file)
-                except Exception as e:
-                    print(f"Error deleting logo file: {e}")
+        # Release logo file (deleted after commit)
+        liberar_archivo(marca.logo_path)
         
         marca_nombre = f"{marca.marca} {marca.modelo}"
         db.session.delete(marca)
@@ -654,14 +622,7 @@ def crear_banco():
         if 'logo' in request.files:
             file = request.files['logo']
             if file and file.filename and allowed_file(file.filename):
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename)
-                unique_filename = f"{name}_{timestamp}{ext}"
-                
-                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                file.save(filepath)
-                logo_path = f'uploads/logos/{unique_filename}'
+                logo_path, _ = guardar_archivo(file)
         
         # Create new bank
         nuevo_banco = Banco(
@@ -737,24 +698,11 @@ def editar_banco(id):
         if 'logo' in request.files:
             file = request.files['logo']
             if file and file.filename and allowed_file(file.filename):
-                # Delete old logo if exists
-                if banco.logo_path:
-                    old_logo = os.path.join('app/static', banco.logo_path)
-                    if os.path.exists(old_logo):
-                        try:
-                            os.remove(old_logo)
-                        except Exception as e:
-                            print(f"Error deleting old logo: {e}")
-                
-                # Save new logo
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = secure_filename(file.filename)
-                name, ext = os.path.splitext(filename)
-                unique_filename = f"{name}_{timestamp}{ext}"
+                # Release old logo (deleted after commit)
+                liberar_archivo(banco.logo_path)
                 
-                filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-                file.save(filepath)
-                banco.logo_path = f'uploads/logos/{unique_filename}'
+                # Save new logo (content-addressed store)
+                banco.logo_path, _ = guardar_archivo(file)
         
         # Register in history
         registrar_historico_banco(banco, 'UPDATE')
@@ -779,14 +727,8 @@ def eliminar_banco(id):
         # Register in history before deletion
         registrar_historico_banco(banco, 'DELETE')
         
-        # Delete logo file if exists
-        if banco.logo_path:
-            logo_file = os.path.join('app/static', banco.logo_path)
-            if os.path.exists(logo_file):
-                try:
-                    os.remove(logo_file)
-                except Exception as e:
-                    print(f"Error deleting logo file: {e}")
+        # Release logo file (deleted after commit)
+        liberar_archivo(banco.logo_path)
         
         banco_nombre = f"{banco.banco} - {banco.cuenta}"
         db.session.delete(banco)
@@ -10,19 +10,21 @@ from app.models import (
     HistoricoInquilino, HistoricoReferenciaInquilino, HistoricoGaranteInquilino,
     Usuario
 )
+from app.services.almacen_service import guardar_documento, liberar_archivo
+from app.services.huella_service import encolar_huella
+from app.services.proyeccion_service import (
+    campos_inquilino, campos_pedidos, leer_campos, opciones_campos, serializar
+)
 from datetime import datetime
-import os
 import re  # Para validaciones
-from werkzeug.utils import secure_filename
 import logging  # Para logging
 
 inquilino_bp = Blueprint('inquilino', __name__, url_prefix='/inquilino')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'pdf'}
-UPLOAD_FOLDER = 'app/static/uploads/inquilinos'
 
-# Ensure upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Campos de /api/inquilinos cuando no se pasa ?fields=
+CAMPOS_API_INQUILINOS = ('id', 'nombre_apellido', 'cedula', 'licencia', 'telefono', 'email')
 
 
 def allowed_file(filename):
@@ -42,31 +44,24 @@ def admin_required(f):
 
 
 def save_document(file, prefix):
-    """Save document and return path"""
+    """Save document encrypted in the content-addressed store and return path"""
     if file and file.filename and allowed_file(file.filename):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{prefix}_{name}_{timestamp}{ext}"
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
         try:
-            file.save(filepath)
-            return f'uploads/inquilinos/{unique_filename}'
+            # Sin variantes: una miniatura sería una copia en claro del documento
+            ruta, nuevo = guardar_documento(file)
         except IOError as e:
-            app.logger.error(f"Error al guardar archivo: {str(e)}")
+            logging.error(f"Error al guardar archivo: {str(e)}")
             return None
+        if nuevo:
+            encolar_huella(ruta, usuario_id=current_user.id)
+        return ruta
     return None
 
 
 def delete_document(path):
-    """Delete document from filesystem"""
+    """Release document (file removed when no longer referenced)"""
     if path:
-        full_path = os.path.join('app/static', path)
-        if os.path.exists(full_path):
-            try:
-                os.remove(full_path)
-            except IOError as e:
-                app.logger.error(f"Error al eliminar archivo: {str(e)}")
+        liberar_archivo(path)
 
 
 def registrar_historico_inquilino(inquilino, tipo_operacion):
@@ -320,9 +315,12 @@ def eliminar_inquilino(id):
         delete_document(inquilino.licencia_path)
         delete_document(inquilino.documento_buena_conducta_path)
         
-        # Delete garante documents
+        # Delete garante and referencia documents (removed by cascade)
         for garante in inquilino.garantes:
+            delete_document(garante.cedula_path)
             delete_document(garante.documento_referencia_laboral_path)
+        for ref in inquilino.referencias:
+            delete_document(ref.cedula_path)
         
         nombre = inquilino.nombre_apellido
         db.session.delete(inquilino)
@@ -341,23 +339,14 @@ def eliminar_inquilino(id):
 @login_required
 @admin_required
 def ver_inquilino(id):
-    """Get inquilino details"""
-    inquilino = Inquilino.query.get_or_404(id)
+    """Get inquilino details (acepta ?fields=)"""
+    disponibles = campos_inquilino()
+    campos = campos_pedidos(disponibles, disponibles)
+    inquilino = Inquilino.query.options(*opciones_campos(Inquilino, disponibles, campos)).filter_by(id=id).first_or_404()
     
     return jsonify({
         'success': True,
-        'inquilino': {
-            'id': inquilino.id,
-            'nombre_apellido': inquilino.nombre_apellido,
-            'cedula': inquilino.cedula,
-            'licencia': inquilino.licencia,
-            'telefono': inquilino.telefono,
-            'email': inquilino.email,
-            'direccion': inquilino.direccion,
-            'cedula_path': inquilino.cedula_path,
-            'licencia_path': inquilino.licencia_path,
-            'documento_buena_conducta_path': inquilino.documento_buena_conducta_path
-        }
+        'inquilino': serializar(inquilino, disponibles, campos)
     })
 
 
@@ -757,21 +746,12 @@ def eliminar_garante(id):
 @inquilino_bp.route('/api/inquilinos')
 @login_required
 def api_inquilinos():
-    """API: List all inquilinos"""
-    inquilinos = Inquilino.query.order_by(Inquilino.nombre_apellido).all()
-    
-    result = []
-    for inq in inquilinos:
-        result.append({
-            'id': inq.id,
-            'nombre_apellido': inq.nombre_apellido,
-            'cedula': inq.cedula,
-            'licencia': inq.licencia,
-            'telefono': inq.telefono,
-            'email': inq.email
-        })
+    """API: List all inquilinos (acepta ?fields=id,nombre_apellido,...)"""
+    disponibles = campos_inquilino()
+    campos = campos_pedidos(disponibles, CAMPOS_API_INQUILINOS)
+    inquilinos = leer_campos(Inquilino, disponibles, campos, lambda q: q.order_by(Inquilino.nombre_apellido))
     
-    return jsonify(result)
+    return jsonify([serializar(inq, disponibles, campos) for inq in inquilinos])
 
 
 @inquilino_bp.route('/api/inquilinos/buscar')
@@ -9,6 +9,7 @@ from app.models import (
     Mecanico, TipoTrabajo, TrabajoVehiculo, Pieza, 
     PiezaUsada, Vehiculo
 )
+from app.services.proyeccion_service import vehiculo_selector
 
 mecanicos_bp = Blueprint('mecanicos', __name__)
 
@@ -96,7 +97,7 @@ def crear_trabajo():
         flash('Trabajo creado exitosamente', 'success')
         return redirect(url_for('mecanicos.trabajos_vehiculos'))
     
-    vehiculos = Vehiculo.query.all()
+    vehiculos = Vehiculo.query.options(*vehiculo_selector()).all()
     mecanicos = Mecanico.query.filter_by(activo=True).all()
     tipos = TipoTrabajo.query.all()
     
@@ -22,38 +22,26 @@ from app.models import (
     HistoricoPropietario,
     HistoricoReferenciaPropietario
 )
+from app.services.almacen_service import guardar_archivo
 from datetime import datetime
-from werkzeug.utils import secure_filename
-import os
 
 
 modulos_bp = Blueprint('modulos', __name__)
 
 # Configuración de archivos
-UPLOAD_FOLDER = 'app/static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def handle_file_upload(file, folder):
-    """Handle file upload and return path"""
+def handle_file_upload(file):
+    """Handle file upload (content-addressed store) and return path"""
     if not file or not file.filename:
         return None
     
     if allowed_file(file.filename):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_{timestamp}{ext}"
-        
-        upload_path = os.path.join(UPLOAD_FOLDER, folder)
-        os.makedirs(upload_path, exist_ok=True)
-        
-        filepath = os.path.join(upload_path, unique_filename)
-        file.save(filepath)
-        
-        return f'uploads/{folder}/{unique_filename}'
+        ruta, _ = guardar_archivo(file)
+        return ruta
     
     return None
 
@@ -453,9 +441,16 @@ def deudas():
     page = request.args.get('page', 1, type=int)
     per_page = 20
     estado = request.args.get('estado', 'pendiente')
+    dias_min = request.args.get('dias_min', type=int)
     
-    deudas = Deuda.query.filter_by(estado=estado).order_by(
-        Deuda.fecha_vencimiento.asc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
+    # dias_retraso lo mantiene el proceso nocturno (flask actualizar-mora)
+    query = Deuda.query.filter_by(estado=estado)
+    if dias_min is not None:
+        query = query.filter(Deuda.dias_retraso >= dias_min)
+        orden = (Deuda.dias_retraso.desc(), Deuda.fecha_vencimiento.asc())
+    else:
+        orden = (Deuda.fecha_vencimiento.asc(),)
+    
+    deudas = query.order_by(*orden).paginate(page=page, per_page=per_page, error_out=False)
     
     return render_template('modulos/deudas.html', deudas=deudas)
\ No newline at end of file
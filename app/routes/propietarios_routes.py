@@ -7,19 +7,29 @@ from functools import wraps
 from app import db
 from app.models import (
     Usuario, Propietario, HistoricoPropietario, ReferenciaPropietario,
-    Vehiculo, VehiculoMarcaModelo, VehiculoImagen, TrabajoVehiculo 
+    Vehiculo, VehiculoMarcaModelo, VehiculoImagen, TrabajoVehiculo, Subida
+)
+from app.services.media_service import encolar_variantes, tipo_por_contenido
+from app.services.almacen_service import guardar_archivos, guardar_documento, liberar_archivo
+from app.services.huella_service import encolar_huella
+from app.services.proyeccion_service import (
+    campos_pedidos, campos_propietario, opciones_campos, propietario_busqueda, serializar, vehiculo_completo
+)
+from app.services.subida_service import (
+    OffsetInvalido, SubidaFallida, iniciar_subida, agregar_bloque, finalizar_subida, cancelar_subida,
+    marcar_fallida, subida_a_dict
 )
 from datetime import datetime
-import os
-from werkzeug.utils import secure_filename
 
 propietario_bp = Blueprint('propietario', __name__, url_prefix='/propietario')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'pdf'}
-UPLOAD_FOLDER = 'app/static/uploads/propietarios'
 
-# Ensure upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Campos de /api/propietarios cuando no se pasa ?fields=
+CAMPOS_API_PROPIETARIOS = (
+    'id', 'nombre_apellido', 'cedula', 'licencia', 'telefono', 'email', 'vehiculos_count',
+    'referencias_count', 'tiene_cedula_doc', 'tiene_licencia_doc', 'tiene_buena_conducta_doc'
+)
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -36,28 +46,20 @@ def admin_required(f):
     return decorated_function
 
 def save_document(file, prefix):
-    """Save uploaded document and return the path"""
+    """Save uploaded document encrypted in the content-addressed store and return the path"""
     if file and file.filename and allowed_file(file.filename):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{prefix}_{name}_{timestamp}{ext}"
-        
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(filepath)
-        return f'uploads/propietarios/{unique_filename}'
+        # Sin variantes: una miniatura sería una copia en claro del documento
+        ruta, nuevo = guardar_documento(file)
+        if nuevo:
+            encolar_huella(ruta, usuario_id=current_user.id)
+        return ruta
     return None
 
 def delete_document(path):
-    """Delete a document file"""
+    """Release a document (the file is removed when nothing else references it)"""
     if path:
-        full_path = os.path.join('app/static', path)
-        if os.path.exists(full_path):
-            try:
-                os.remove(full_path)
-                return True
-            except Exception as e:
-                print(f"Error deleting file: {e}")
+        liberar_archivo(path)
+        return True
     return False
 
 
@@ -252,8 +254,9 @@ def ver_propietario(id):
         'cedula_path': propietario.cedula_path,
         'licencia_path': propietario.licencia_path,
         'documento_buena_conducta_path': propietario.documento_buena_conducta_path,
-        'vehiculos_count': propietario.vehiculos.count(),
-        'referencias_count': propietario.referencias.count(),
+        'vehiculos_count': propietario.vehiculos_count,
+        'referencias_count': propietario.referencias_count,
+        'alquileres_activos_count': propietario.alquileres_activos_count,
         'fecha_registro': propietario.fecha_hora_registro.strftime('%d/%m/%Y %H:%M') if propietario.fecha_hora_registro else None,
         'fecha_actualizacion': propietario.fecha_hora_actualizo.strftime('%d/%m/%Y %H:%M') if propietario.fecha_hora_actualizo else None
     })
@@ -379,21 +382,11 @@ def registrar_historico_propietario(propietario, tipo_operacion):
 @login_required
 @admin_required
 def api_propietarios():
-    """API endpoint for owners list"""
-    propietarios = Propietario.query.all()
-    return jsonify([{
-        'id': p.id,
-        'nombre_apellido': p.nombre_apellido,
-        'cedula': p.cedula,
-        'licencia': p.licencia,
-        'telefono': p.telefono,
-        'email': p.email,
-        'vehiculos_count': p.vehiculos.count(),
-        'referencias_count': p.referencias.count(),
-        'tiene_cedula_doc': bool(p.cedula_path),
-        'tiene_licencia_doc': bool(p.licencia_path),
-        'tiene_buena_conducta_doc': bool(p.documento_buena_conducta_path)
-    } for p in propietarios])
+    """API endpoint for owners list (acepta ?fields=)"""
+    disponibles = campos_propietario()
+    campos = campos_pedidos(disponibles, CAMPOS_API_PROPIETARIOS)
+    propietarios = Propietario.query.options(*opciones_campos(Propietario, disponibles, campos)).all()
+    return jsonify([serializar(p, disponibles, campos) for p in propietarios])
 
 
 @propietario_bp.route('/api/propietarios/buscar')
@@ -404,7 +397,7 @@ def buscar_propietarios():
     if len(query) < 2:
         return jsonify([])
     
-    propietarios = Propietario.query.all()
+    propietarios = Propietario.query.options(*propietario_busqueda()).all()
     
     results = []
     for p in propietarios:
@@ -416,7 +409,7 @@ def buscar_propietarios():
                 'nombre_apellido': nombre,
                 'cedula': cedula,
                 'telefono': p.telefono,
-                'vehiculos_count': p.vehiculos.count()
+                'vehiculos_count': p.vehiculos_count
             })
     
     return jsonify(results[:10])
@@ -428,7 +421,7 @@ def vehiculos_propietario(id):
     """Obtener vehículos del propietario"""
     try:
         propietario = Propietario.query.get_or_404(id)
-        vehiculos = propietario.vehiculos.all()
+        vehiculos = propietario.vehiculos.options(*vehiculo_completo()).all()
         
         vehiculos_data = []
         for v in vehiculos:
@@ -446,6 +439,8 @@ def vehiculos_propietario(id):
                     'id': img.id,
                     'tipo': img.tipo,
                     'ruta': img.ruta,
+                    'miniatura': img.miniatura,
+                    'display': img.display,
                     'es_principal': img.es_principal
                 } for img in imagenes]
             })
@@ -493,7 +488,7 @@ def reparaciones_propietario(id):
         return jsonify({
             'success': True,
             'propietario': propietario.nombre_apellido,
-            'total_vehiculos': propietario.vehiculos.count(),
+            'total_vehiculos': propietario.vehiculos_count,
             'total_reparaciones': len(reparaciones),
             'reparaciones': reparaciones
         })
@@ -504,24 +499,40 @@ def reparaciones_propietario(id):
 # ==================== CRUD VEHÍCULO CON IMÁGENES ====================
 
 ALLOWED_VEHICLE_MEDIA = {'png', 'jpg', 'jpeg', 'mp4'}
-UPLOAD_FOLDER_VEHICLES = 'app/static/uploads/vehiculos'
-os.makedirs(UPLOAD_FOLDER_VEHICLES, exist_ok=True)
 
 def allowed_vehicle_media(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_VEHICLE_MEDIA
 
-def save_vehicle_media(file, vehiculo_id):
-    """Guardar imagen o video del vehículo"""
-    if file and file.filename and allowed_vehicle_media(file.filename):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"vehiculo_{vehiculo_id}_{timestamp}{ext}"
-        
-        filepath = os.path.join(UPLOAD_FOLDER_VEHICLES, unique_filename)
-        file.save(filepath)
-        return f'uploads/vehiculos/{unique_filename}'
-    return None
+def save_vehicle_media(files, vehiculo_id, orden_inicial=0, primera_principal=False):
+    """
+    Guardar imágenes/videos del vehículo en paralelo (hash, tipo y escritura en
+    el pool de hilos) y agregar sus VehiculoImagen a la sesión. Retorna las imágenes creadas
+    """
+    validos = [f for f in files if f and f.filename and allowed_vehicle_media(f.filename)]
+    if not validos:
+        return []
+
+    guardados = guardar_archivos(validos, detectar_tipo=tipo_por_contenido)
+    imagenes = [
+        VehiculoImagen(
+            vehiculo_id=vehiculo_id,
+            tipo=guardado['tipo'],
+            ruta=guardado['ruta'],
+            nombre_archivo=guardado['nombre'],
+            orden=orden_inicial + i,
+            es_principal=primera_principal and i == 0,
+            usuario_registro_id=current_user.id
+        )
+        for i, guardado in enumerate(guardados)
+    ]
+    db.session.add_all(imagenes)
+
+    # Miniaturas y variantes en segundo plano
+    db.session.flush()
+    for imagen in imagenes:
+        if imagen.tipo == 'imagen':
+            encolar_variantes(imagen_id=imagen.id, usuario_id=current_user.id)
+    return imagenes
 
 
 @propietario_bp.route('/propietario/vehiculos/crear', methods=['POST'])
@@ -562,29 +573,15 @@ def crear_vehiculo():
         db.session.flush()
         
         # Procesar imágenes/videos
-        files = request.files.getlist('media_files')
-        for i, file in enumerate(files):
-            if file and file.filename:
-                ruta = save_vehicle_media(file, nuevo_vehiculo.id)
-                if ruta:
-                    extension = file.filename.rsplit('.', 1)[1].lower()
-                    tipo = 'video' if extension == 'mp4' else 'imagen'
-                    
-                    imagen = VehiculoImagen(
-                        vehiculo_id=nuevo_vehiculo.id,
-                        tipo=tipo,
-                        ruta=ruta,
-                        nombre_archivo=file.filename,
-                        orden=i,
-                        es_principal=(i == 0),
-                        usuario_registro_id=current_user.id
-                    )
-                    db.session.add(imagen)
+        save_vehicle_media(request.files.getlist('media_files'), nuevo_vehiculo.id, primera_principal=True)
         
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Vehículo creado exitosamente', 'vehiculo_id': nuevo_vehiculo.id})
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -612,28 +609,14 @@ def editar_vehiculo(id):
         # Agregar nuevas imágenes si hay
         files = request.files.getlist('media_files')
         if files and files[0].filename:
-            orden_actual = vehiculo.imagenes.count()
-            for i, file in enumerate(files):
-                if file and file.filename:
-                    ruta = save_vehicle_media(file, vehiculo.id)
-                    if ruta:
-                        extension = file.filename.rsplit('.', 1)[1].lower()
-                        tipo = 'video' if extension == 'mp4' else 'imagen'
-                        
-                        imagen = VehiculoImagen(
-                            vehiculo_id=vehiculo.id,
-                            tipo=tipo,
-                            ruta=ruta,
-                            nombre_archivo=file.filename,
-                            orden=orden_actual + i,
-                            es_principal=False,
-                            usuario_registro_id=current_user.id
-                        )
-                        db.session.add(imagen)
+            save_vehicle_media(files, vehiculo.id, orden_inicial=vehiculo.imagenes.count())
         
         db.session.commit()
         return jsonify({'success': True, 'message': 'Vehículo actualizado exitosamente'})
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -676,4 +659,136 @@ def eliminar_imagen_vehiculo(id):
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'message': str(e)}), 500
\ No newline at end of file
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# ==================== SUBIDAS POR BLOQUES (VIDEOS) ====================
+#
+# 1. POST   /propietario/vehiculos/<id>/subidas        {nombre, tamano, sha256?}
+# 2. PATCH  /propietario/vehiculos/subidas/<token>      cuerpo = bytes del bloque
+#           Headers: Upload-Offset, X-Chunk-Sha256
+# 3. POST   /propietario/vehiculos/subidas/<token>/finalizar
+#
+# GET de la subida retorna `recibido` para reanudar tras un corte.
+
+@propietario_bp.route('/propietario/vehiculos/<int:id>/subidas', methods=['POST'])
+@login_required
+@admin_required
+def iniciar_subida_vehiculo(id):
+    """Iniciar una subida reanudable de imagen/video del vehículo"""
+    vehiculo = Vehiculo.query.get_or_404(id)
+    data = request.get_json() or {}
+    nombre = (data.get('nombre') or '').strip()
+
+    if not nombre or not allowed_vehicle_media(nombre):
+        return jsonify({'success': False, 'message': 'Tipo de archivo no permitido'}), 400
+
+    try:
+        subida = iniciar_subida(
+            vehiculo.id,
+            nombre,
+            int(data.get('tamano') or 0),
+            sha256=data.get('sha256'),
+            usuario_id=current_user.id
+        )
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Subida iniciada', 'subida': subida_a_dict(subida)}), 201
+
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@propietario_bp.route('/propietario/vehiculos/subidas/<token>', methods=['GET'])
+@login_required
+@admin_required
+def estado_subida_vehiculo(token):
+    """Estado de la subida (offset desde donde continuar)"""
+    subida = Subida.query.get_or_404(token)
+    return jsonify({'success': True, 'subida': subida_a_dict(subida)})
+
+
+@propietario_bp.route('/propietario/vehiculos/subidas/<token>', methods=['PATCH'])
+@login_required
+@admin_required
+def agregar_bloque_subida_vehiculo(token):
+    """Agregar un bloque; se escribe directo del stream al archivo temporal"""
+    subida = Subida.query.get_or_404(token)
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'message': 'Header Upload-Offset requerido'}), 400
+
+    try:
+        recibido = agregar_bloque(
+            subida,
+            offset,
+            request.stream,
+            request.content_length,
+            request.headers.get('X-Chunk-Sha256')
+        )
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Bloque recibido', 'recibido': recibido})
+
+    except OffsetInvalido as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'recibido': e.recibido}), 409
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'recibido': subida.recibido}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@propietario_bp.route('/propietario/vehiculos/subidas/<token>/finalizar', methods=['POST'])
+@login_required
+@admin_required
+def finalizar_subida_vehiculo(token):
+    """Finalizar la subida y crear la imagen/video del vehículo"""
+    subida = Subida.query.get_or_404(token)
+    try:
+        imagen = finalizar_subida(subida, usuario_id=current_user.id)
+        db.session.commit()
+        return jsonify({
+            'success': True,
+            'message': 'Archivo subido exitosamente',
+            'imagen': {
+                'id': imagen.id,
+                'tipo': imagen.tipo,
+                'ruta': imagen.ruta,
+                'nombre_archivo': imagen.nombre_archivo,
+                'orden': imagen.orden,
+                'es_principal': imagen.es_principal
+            }
+        })
+
+    except SubidaFallida as e:
+        db.session.rollback()
+        marcar_fallida(subida)
+        db.session.commit()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@propietario_bp.route('/propietario/vehiculos/subidas/<token>', methods=['DELETE'])
+@login_required
+@admin_required
+def cancelar_subida_vehiculo(token):
+    """Cancelar una subida en curso"""
+    subida = Subida.query.get_or_404(token)
+    try:
+        if not cancelar_subida(subida):
+            return jsonify({'success': False, 'message': f'La subida ya está {subida.estado}'}), 400
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Subida cancelada'})
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
@@ -1,12 +1,19 @@
 """
 === app/routes/reportes_routes.py ===
 """
-from flask import Blueprint, render_template, jsonify
+from flask import Blueprint, render_template, jsonify, request
 from flask_login import login_required
 from app import db, cache
-from app.models import Alquiler, Pago, Deuda, Vehiculo, Propietario, Inquilino
-from sqlalchemy import func, extract
-from datetime import datetime, timedelta
+from app.models import (
+    ESTADOS_ALQUILER_ACTIVOS, Alquiler, Pago, Deuda, Vehiculo, VehiculoMarcaModelo, Propietario, Inquilino
+)
+from app.services.descifrado_service import leer_descifrado
+from app.services.libro_service import estado_cuenta_propietario, rentabilidad
+from app.services.proyeccion_service import placa_legible
+from app.services.sombra_service import contar_disponibles
+from sqlalchemy import case, func, extract
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
 reportes_bp = Blueprint('reportes', __name__)
 
@@ -17,13 +24,13 @@ def dashboard():
     """Main dashboard with statistics"""
     # Get statistics
     total_vehiculos = Vehiculo.query.count()
-    vehiculos_disponibles = Vehiculo.query.filter_by(disponible=True).count()
+    vehiculos_disponibles = contar_disponibles()
     total_propietarios = Propietario.query.count()
     total_inquilinos = Inquilino.query.count()
     
     # Active rentals
     alquileres_activos = Alquiler.query.filter(
-        Alquiler.estado_id.in_([2, 3])  # En curso, Validado
+        Alquiler.estado_id.in_(ESTADOS_ALQUILER_ACTIVOS)
     ).count()
     
     # Pending debts
@@ -64,8 +71,8 @@ def reportes_propietarios():
     """Owners reports"""
     propietarios = db.session.query(
         Propietario,
-        func.count(Vehiculo.id).label('total_vehiculos')
-    ).outerjoin(Vehiculo).group_by(Propietario.id).all()
+        Propietario.vehiculos_count.label('total_vehiculos')
+    ).all()
     
     return render_template('reportes/reportes_propietarios.html',
                          propietarios=propietarios)
@@ -74,12 +81,38 @@ def reportes_propietarios():
 @reportes_bp.route('/inquilinos')
 @login_required
 def reportes_inquilinos():
-    """Tenants reports"""
+    """
+    Tenants reports. Cada agregado sale de su propia subconsulta agrupada por
+    inquilino (una fila por inquilino), así que unirlas no multiplica filas
+    (alquileres x deudas) ni infla las sumas
+    """
+    alquileres = db.session.query(
+        Alquiler.inquilino_id,
+        func.count(Alquiler.id).label('total'),
+        func.sum(case((Alquiler.estado_id.in_(ESTADOS_ALQUILER_ACTIVOS), 1), else_=0)).label('activos')
+    ).group_by(Alquiler.inquilino_id).subquery()
+    
+    deudas = db.session.query(
+        Deuda.inquilino_id,
+        func.sum(Deuda.monto_deuda).label('pendiente'),
+        func.max(Deuda.dias_retraso).label('dias_mora')
+    ).filter(Deuda.estado == 'pendiente').group_by(Deuda.inquilino_id).subquery()
+    
+    pagos = db.session.query(
+        Alquiler.inquilino_id,
+        func.max(Pago.fecha_pago).label('ultimo_pago')
+    ).join(Pago, Pago.alquiler_id == Alquiler.id).group_by(Alquiler.inquilino_id).subquery()
+    
     inquilinos = db.session.query(
         Inquilino,
-        func.count(Alquiler.id).label('total_alquileres'),
-        func.sum(Deuda.monto_deuda).label('total_deudas')
-    ).outerjoin(Alquiler).outerjoin(Deuda).group_by(Inquilino.id).all()
+        func.coalesce(alquileres.c.total, 0).label('total_alquileres'),
+        func.coalesce(alquileres.c.activos, 0).label('alquileres_activos'),
+        func.coalesce(deudas.c.pendiente, 0).label('total_deudas'),
+        func.coalesce(deudas.c.dias_mora, 0).label('dias_mora'),
+        pagos.c.ultimo_pago
+    ).outerjoin(alquileres, alquileres.c.inquilino_id == Inquilino.id
+    ).outerjoin(deudas, deudas.c.inquilino_id == Inquilino.id
+    ).outerjoin(pagos, pagos.c.inquilino_id == Inquilino.id).all()
     
     return render_template('reportes/reportes_inquilinos.html',
                          inquilinos=inquilinos)
@@ -127,3 +160,68 @@ def api_ingresos_mensuales():
         'ingresos': [ingresos[i] for i in range(1, 13)]
     })
 
+
+# ==================== RENTABILIDAD (libro por vehículo y semana) ====================
+
+def _rango_fechas():
+    """?desde= / ?hasta= (YYYY-MM-DD); por defecto, del 1 de enero a hoy"""
+    hasta = request.args.get('hasta', type=date.fromisoformat) or date.today()
+    desde = request.args.get('desde', type=date.fromisoformat) or date(hasta.year, 1, 1)
+    return desde, hasta
+
+
+def _json(datos):
+    return {
+        k: float(v) if isinstance(v, Decimal) else v.isoformat() if isinstance(v, date) else v
+        for k, v in datos.items()
+    }
+
+
+def _vehiculos(ids):
+    """{id: {'placa', 'marca_modelo'}} de los vehículos del reporte, en una consulta"""
+    if not ids:
+        return {}
+    filas = leer_descifrado(
+        [Vehiculo.id, Vehiculo.placa, VehiculoMarcaModelo.marca, VehiculoMarcaModelo.modelo],
+        lambda q: q.outerjoin(VehiculoMarcaModelo, Vehiculo.marca_modelo_vehiculo_id == VehiculoMarcaModelo.id)
+        .where(Vehiculo.id.in_(list(ids)))
+    )
+    return {
+        f.id: {'placa': placa_legible(f), 'marca_modelo': f"{f.marca} {f.modelo}" if f.marca else ''}
+        for f in filas
+    }
+
+
+@reportes_bp.route('/api/rentabilidad')
+@login_required
+def api_rentabilidad():
+    """Rentabilidad por vehículo en un rango (?desde=&hasta=&propietario_id=&vehiculo_id=)"""
+    desde, hasta = _rango_fechas()
+    filas = rentabilidad(
+        desde, hasta,
+        propietario_id=request.args.get('propietario_id', type=int),
+        vehiculo_id=request.args.get('vehiculo_id', type=int)
+    )
+    vehiculos = _vehiculos({f['vehiculo_id'] for f in filas})
+    return jsonify({
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'vehiculos': [{**_json(f), **vehiculos.get(f['vehiculo_id'], {})} for f in filas]
+    })
+
+
+@reportes_bp.route('/api/propietarios/<int:id>/estado-cuenta')
+@login_required
+def api_estado_cuenta_propietario(id):
+    """Estado de cuenta semanal de un propietario (?desde=&hasta=)"""
+    propietario = Propietario.query.get_or_404(id)
+    desde, hasta = _rango_fechas()
+    estado = estado_cuenta_propietario(propietario.id, desde, hasta)
+    vehiculos = _vehiculos({m['vehiculo_id'] for m in estado['movimientos']})
+    return jsonify({
+        'propietario': propietario.nombre_apellido,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'movimientos': [{**_json(m), **vehiculos.get(m['vehiculo_id'], {})} for m in estado['movimientos']],
+        'totales': _json(estado['totales'])
+    })
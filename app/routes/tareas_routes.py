@@ -0,0 +1,76 @@
+"""
+Tareas Routes - Consulta de trabajos en segundo plano
+"""
+from flask import Blueprint, jsonify, request, send_file, abort
+from flask_login import login_required, current_user
+from io import BytesIO
+from app import db
+from app.models import Tarea
+from app.services.tarea_service import tarea_a_dict, cancelar
+
+tareas_bp = Blueprint('tareas', __name__)
+
+
+def _obtener_tarea(id):
+    """Retorna la tarea si pertenece al usuario actual (o si es admin)"""
+    t = Tarea.query.get_or_404(id)
+    if current_user.rol != 'admin' and t.usuario_registro_id != current_user.id:
+        abort(403)
+    return t
+
+
+@tareas_bp.route('/')
+@login_required
+def listar_tareas():
+    """Últimas tareas del usuario (todas si es admin)"""
+    query = Tarea.query
+    if current_user.rol != 'admin':
+        query = query.filter_by(usuario_registro_id=current_user.id)
+
+    estado = request.args.get('estado')
+    if estado:
+        query = query.filter_by(estado=estado)
+
+    limite = min(request.args.get('limit', 50, type=int), 200)
+    tareas = query.order_by(Tarea.id.desc()).limit(limite).all()
+
+    return jsonify({'success': True, 'tareas': [tarea_a_dict(t) for t in tareas]})
+
+
+@tareas_bp.route('/<int:id>')
+@login_required
+def estado_tarea(id):
+    """Estado y progreso de una tarea (para polling)"""
+    t = _obtener_tarea(id)
+    return jsonify({'success': True, 'tarea': tarea_a_dict(t)})
+
+
+@tareas_bp.route('/<int:id>/archivo')
+@login_required
+def descargar_archivo_tarea(id):
+    """Descarga el archivo generado por una tarea completada"""
+    t = _obtener_tarea(id)
+    if t.estado != 'completada' or not t.archivo_nombre:
+        return jsonify({'success': False, 'message': 'La tarea no tiene archivo disponible'}), 404
+
+    return send_file(
+        BytesIO(t.archivo),
+        mimetype=t.archivo_mimetype,
+        as_attachment=True,
+        download_name=t.archivo_nombre
+    )
+
+
+@tareas_bp.route('/<int:id>/cancelar', methods=['POST'])
+@login_required
+def cancelar_tarea(id):
+    """Cancela una tarea que todavía no empezó"""
+    t = _obtener_tarea(id)
+    try:
+        if not cancelar(t):
+            return jsonify({'success': False, 'message': f'La tarea ya está {t.estado}'}), 400
+        return jsonify({'success': True, 'message': 'Tarea cancelada'})
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
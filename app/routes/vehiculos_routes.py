@@ -4,6 +4,7 @@ Vehiculos Routes - CRUD completo para vehiculos, historial alquileres y reparaci
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from functools import wraps
+from werkzeug.exceptions import HTTPException
 from app import db
 from app.models import (
     Vehiculo, Alquiler, VehiculoMarcaModelo, Propietario,
@@ -11,9 +12,13 @@ from app.models import (
     Usuario
 )
 from datetime import datetime
-import os
-from werkzeug.utils import secure_filename
 from app.models import encrypt_data, decrypt_data  # Para placa encriptada
+from app.services.almacen_service import guardar_archivo, liberar_archivo
+from app.services.sombra_service import filtro_disponible, filtro_precio, refinar_precio
+from app.services.proyeccion_service import (
+    CamposInvalidos, campos_pedidos, campos_vehiculo, opciones_campos, propietario_selector, serializar,
+    vehiculo_completo, vehiculo_resumen
+)
 
 # Intentar importar TrabajoVehiculo (el nombre correcto según tu modelo)
 try:
@@ -26,10 +31,13 @@ except ImportError:
 vehiculo_bp = Blueprint('vehiculo', __name__, url_prefix='/vehiculo')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'pdf'}
-UPLOAD_FOLDER = 'app/static/uploads/vehiculos'
 
-# Ensure upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Campos por defecto cuando no se pasa ?fields=
+CAMPOS_EDITAR_VEHICULO = (
+    'id', 'placa', 'marca_modelo_vehiculo_id', 'propietario_id', 'ano', 'color', 'descripcion',
+    'precio_semanal', 'condiciones', 'disponible'
+)
+CAMPOS_API_VEHICULOS = ('id', 'marca', 'modelo', 'placa', 'ano', 'color', 'precio_semanal')
 
 
 def allowed_file(filename):
@@ -49,24 +57,17 @@ def admin_required(f):
 
 
 def save_document(file, prefix):
-    """Save document and return path"""
+    """Save document in the content-addressed store and return path"""
     if file and file.filename and allowed_file(file.filename):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{prefix}_{name}_{timestamp}{ext}"
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(filepath)
-        return f'uploads/vehiculos/{unique_filename}'
+        ruta, _ = guardar_archivo(file)
+        return ruta
     return None
 
 
 def delete_document(path):
-    """Delete document from filesystem"""
+    """Release document (file removed when no longer referenced)"""
     if path:
-        full_path = os.path.join('app/static', path)
-        if os.path.exists(full_path):
-            os.remove(full_path)
+        liberar_archivo(path)
 
 
 def registrar_historico_vehiculo(vehiculo, tipo_operacion):
@@ -100,7 +101,7 @@ def registrar_historico_vehiculo(vehiculo, tipo_operacion):
 @admin_required
 def vehiculos():
     """List all vehiculos"""
-    vehiculos = Vehiculo.query.order_by(Vehiculo.fecha_hora_registro.desc()).all()
+    vehiculos = Vehiculo.query.options(*vehiculo_completo()).order_by(Vehiculo.fecha_hora_registro.desc()).all()
     marca_modelos = VehiculoMarcaModelo.query.order_by(VehiculoMarcaModelo.marca).all()
     
     # Si Propietario tiene columnas nombre y apellido separadas, ordenar por nombre
@@ -110,7 +111,7 @@ def vehiculos():
         propietarios = Propietario.query.order_by(Propietario.nombre).all()
     except AttributeError:
         # Si no existe la columna nombre, traer todos y ordenar en Python
-        propietarios = Propietario.query.all()
+        propietarios = Propietario.query.options(*propietario_selector()).all()
         try:
             propietarios = sorted(propietarios, key=lambda p: (p.nombre_apellido or '').lower())
         except:
@@ -223,6 +224,10 @@ def eliminar_vehiculo(id):
     try:
         registrar_historico_vehiculo(vehiculo, 'DELETE')
         
+        # Release image/video files (the rows are removed by cascade)
+        for imagen in vehiculo.imagenes:
+            delete_document(imagen.ruta)
+        
         db.session.delete(vehiculo)
         db.session.commit()
         
@@ -237,35 +242,20 @@ def eliminar_vehiculo(id):
 @login_required
 @admin_required
 def get_vehiculo(id):
-    """Get vehiculo details for edit"""
+    """Get vehiculo details for edit (acepta ?fields=)"""
     try:
-        vehiculo = Vehiculo.query.get_or_404(id)
-        
-        # Desencriptar placa para form - con manejo de errores
-        placa_decrypted = None
-        if vehiculo.placa:
-            try:
-                placa_decrypted = decrypt_data(vehiculo.placa)
-            except Exception as decrypt_error:
-                # Si falla la desencriptación, asumir que está en texto plano
-                print(f"⚠️  Placa no encriptada o error de desencriptación: {decrypt_error}")
-                placa_decrypted = vehiculo.placa
+        disponibles = campos_vehiculo()
+        campos = campos_pedidos(disponibles, CAMPOS_EDITAR_VEHICULO)
+        vehiculo = Vehiculo.query.options(
+            *opciones_campos(Vehiculo, disponibles, campos)
+        ).filter_by(id=id).first_or_404()
         
         return jsonify({
             'success': True, 
-            'vehiculo': {
-                'id': vehiculo.id,
-                'placa': placa_decrypted,
-                'marca_modelo_vehiculo_id': vehiculo.marca_modelo_vehiculo_id,
-                'propietario_id': vehiculo.propietario_id,
-                'ano': vehiculo.ano,
-                'color': vehiculo.color,
-                'descripcion': vehiculo.descripcion,
-                'precio_semanal': float(vehiculo.precio_semanal) if vehiculo.precio_semanal else None,
-                'condiciones': vehiculo.condiciones,
-                'disponible': vehiculo.disponible
-            }
+            'vehiculo': serializar(vehiculo, disponibles, campos)
         })
+    except (HTTPException, CamposInvalidos):
+        raise
     except Exception as e:
         print(f"Error en get_vehiculo: {str(e)}")
         import traceback
@@ -422,30 +412,24 @@ def historial_vehiculo(id):
 @vehiculo_bp.route('/api/vehiculos')
 @login_required
 def api_vehiculos():
-    """API: List all vehiculos"""
-    vehiculos = Vehiculo.query.order_by(Vehiculo.marca_modelo_vehiculo_id).all()
+    """
+    API: List all vehiculos (acepta ?fields=id,placa,..., ?disponible=1|0
+    y ?precio_min= / ?precio_max=, filtrados en SQL sobre las columnas sombra)
+    """
+    disponibles = campos_vehiculo()
+    campos = campos_pedidos(disponibles, CAMPOS_API_VEHICULOS)
+    precio_min = request.args.get('precio_min', type=float)
+    precio_max = request.args.get('precio_max', type=float)
     
-    result = []
-    for veh in vehiculos:
-        # Desencriptar placa con manejo de errores
-        placa = None
-        if veh.placa:
-            try:
-                placa = decrypt_data(veh.placa)
-            except:
-                placa = veh.placa  # Si falla, usar texto plano
-        
-        result.append({
-            'id': veh.id,
-            'marca': veh.marca_modelo.marca,
-            'modelo': veh.marca_modelo.modelo,
-            'placa': placa,
-            'ano': veh.ano,
-            'color': veh.color,
-            'precio_semanal': veh.precio_semanal
-        })
+    # Con política 'tramo' el rango se afina sobre el precio descifrado
+    cargar = campos + ['precio_semanal'] if precio_min is not None or precio_max is not None else campos
+    query = Vehiculo.query.options(*opciones_campos(Vehiculo, disponibles, cargar))
+    if request.args.get('disponible') in ('1', '0'):
+        query = query.filter(filtro_disponible(request.args['disponible'] == '1'))
+    query = query.filter(*filtro_precio(precio_min, precio_max))
+    vehiculos = refinar_precio(query.order_by(Vehiculo.marca_modelo_vehiculo_id).all(), precio_min, precio_max)
     
-    return jsonify(result)
+    return jsonify([serializar(veh, disponibles, campos) for veh in vehiculos])
 
 
 @vehiculo_bp.route('/api/vehiculos/buscar')
@@ -454,7 +438,7 @@ def api_buscar_vehiculos():
     """API: Search vehiculos"""
     query = request.args.get('q', '').strip().lower()
     
-    vehiculos = Vehiculo.query.all()
+    vehiculos = Vehiculo.query.options(*vehiculo_resumen()).all()
     
     result = []
     for veh in vehiculos:
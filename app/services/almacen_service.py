@@ -0,0 +1,437 @@
+"""
+Almacén Service - Almacenamiento de archivos direccionado por contenido
+
+Cada archivo subido se guarda una sola vez según su SHA-256:
+
+    uploads/archivos/ab/cd/abcd...ef.jpg
+
+Si se sube de nuevo el mismo contenido (la misma foto de WhatsApp con otro
+nombre) se reutiliza el archivo existente y se suma una referencia en la tabla
+`archivos`. Al eliminar un documento se resta la referencia; el archivo físico
+(y sus variantes) se borra solo cuando nadie más lo usa y después del commit,
+para que un rollback no deje registros apuntando a archivos inexistentes.
+
+Los archivos se escriben y eliminan a través del backend configurado
+(disco local o S3, ver almacenamiento_service). Los documentos de identidad
+se guardan cifrados (guardar_documento, ver cifrado_service).
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import shutil
+import tempfile
+import uuid
+
+from flask import current_app
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Archivo
+from app.services.almacenamiento_service import almacenamiento
+from app.services.cifrado_service import SUFIJO, EscritorCifrado, huella_documento
+
+
+CARPETA = 'uploads/archivos'
+TAMANO_BLOQUE = 64 * 1024
+
+
+def _ruta_legada(ruta):
+    """Archivos anteriores al almacén: siempre en el disco local, bajo /static"""
+    return os.path.join(current_app.static_folder, ruta)
+
+
+def ruta_para(sha256, extension, cifrado=False):
+    """Ruta relativa (a /static) de un contenido, repartida en dos niveles de carpetas"""
+    nombre = f'{sha256}.{extension}' if extension else sha256
+    if cifrado:
+        nombre += SUFIJO
+    return f'{CARPETA}/{sha256[:2]}/{sha256[2:4]}/{nombre}'
+
+
+def carpeta_temporal():
+    """Carpeta local donde se escriben los archivos antes de conocer su hash"""
+    return almacenamiento().carpeta_temporal()
+
+
+def guardar_archivo(file):
+    """
+    Guarda un FileStorage en el almacén calculando el SHA-256 mientras se escribe.
+    Retorna (ruta, nuevo): nuevo=False si el contenido ya existía y solo se sumó una referencia.
+    No hace commit.
+    """
+    extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+
+    digest = hashlib.sha256()
+    tamano = 0
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta_temporal())
+    try:
+        with os.fdopen(descriptor, 'wb') as destino:
+            while True:
+                bloque = file.stream.read(TAMANO_BLOQUE)
+                if not bloque:
+                    break
+                digest.update(bloque)
+                destino.write(bloque)
+                tamano += len(bloque)
+    except Exception:
+        os.remove(temporal)
+        raise
+
+    return registrar_temporal(temporal, digest.hexdigest(), tamano, extension, file.filename)
+
+
+def cifrar_a_temporal(origen):
+    """
+    Cifra un stream hacia un archivo temporal local calculando su huella.
+    El texto plano nunca se escribe en disco. Retorna (temporal, huella, tamaño)
+    """
+    huella = huella_documento()
+    tamano = 0
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta_temporal())
+    try:
+        with os.fdopen(descriptor, 'wb') as destino:
+            escritor = EscritorCifrado(destino)
+            for bloque in iter(lambda: origen.read(TAMANO_BLOQUE), b''):
+                huella.update(bloque)
+                escritor.write(bloque)
+                tamano += len(bloque)
+            escritor.close()
+    except Exception:
+        os.remove(temporal)
+        raise
+    return temporal, huella.hexdigest(), tamano
+
+
+def guardar_documento(file):
+    """
+    Igual que guardar_archivo para documentos de identidad: el contenido se
+    cifra mientras se escribe y se deduplica por su huella (HMAC).
+    Retorna (ruta, nuevo). No hace commit.
+    """
+    extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+    temporal, huella, tamano = cifrar_a_temporal(file.stream)
+    return registrar_temporal(temporal, huella, tamano, extension, file.filename, cifrado=True)
+
+
+def registrar_temporal(temporal, sha256, tamano, extension, nombre_original, cifrado=False):
+    """
+    Mueve un archivo temporal local ya escrito (y con su SHA-256 calculado) al almacén.
+    Retorna (ruta, nuevo) igual que guardar_archivo. No hace commit.
+    """
+    existente = Archivo.query.filter_by(sha256=sha256).first()
+    if existente is not None:
+        os.remove(temporal)
+        retener_archivo(existente.ruta)
+        return existente.ruta, False
+
+    ruta = ruta_para(sha256, extension, cifrado)
+    almacenamiento().guardar_desde_archivo(ruta, temporal)
+    return _registrar(ruta, sha256, tamano, extension, nombre_original, cifrado)
+
+
+def registrar_objeto(objeto, sha256, tamano, extension, nombre_original):
+    """
+    Igual que registrar_temporal para un objeto ya escrito en el backend
+    (subidas por partes): se mueve a su ruta definitiva. No hace commit.
+    """
+    backend = almacenamiento()
+    existente = Archivo.query.filter_by(sha256=sha256).first()
+    if existente is not None:
+        backend.eliminar(objeto)
+        retener_archivo(existente.ruta)
+        return existente.ruta, False
+
+    ruta = ruta_para(sha256, extension)
+    backend.mover(objeto, ruta)
+    return _registrar(ruta, sha256, tamano, extension, nombre_original)
+
+
+def recuperar_objeto(sha256, tamano, extension, nombre_original):
+    """
+    Reintento de un registrar_objeto cuyo commit falló: el objeto ya se movió a
+    su ruta definitiva (o se eliminó por existir el contenido) y el registro se
+    perdió con el rollback. Retorna (ruta, nuevo), o None si el contenido ya no
+    está en el almacén. No hace commit.
+    """
+    existente = Archivo.query.filter_by(sha256=sha256).first()
+    if existente is not None:
+        retener_archivo(existente.ruta)
+        return existente.ruta, False
+
+    ruta = ruta_para(sha256, extension)
+    if not almacenamiento().existe(ruta):
+        return None
+    return _registrar(ruta, sha256, tamano, extension, nombre_original)
+
+
+def hash_objeto(ruta):
+    """(sha256, tamaño) de un objeto del backend, leído en streaming"""
+    digest = hashlib.sha256()
+    tamano = 0
+    with almacenamiento().abrir(ruta) as origen:
+        for bloque in iter(lambda: origen.read(1024 * 1024), b''):
+            digest.update(bloque)
+            tamano += len(bloque)
+    return digest.hexdigest(), tamano
+
+
+def _registrar(ruta, sha256, tamano, extension, nombre_original, cifrado=False):
+    """Crea el registro de un contenido recién escrito en su ruta definitiva"""
+    _conservar(ruta)
+    try:
+        with db.session.begin_nested():
+            db.session.add(Archivo(
+                sha256=sha256,
+                ruta=ruta,
+                tamano=tamano,
+                extension=extension,
+                nombre_original=(nombre_original or '')[:255],
+                referencias=1,
+                cifrado=cifrado
+            ))
+    except IntegrityError:
+        # Otra petición registró el mismo contenido al mismo tiempo
+        existente = Archivo.query.filter_by(sha256=sha256).first()
+        retener_archivo(existente.ruta)
+        return existente.ruta, False
+
+    return ruta, True
+
+
+# ==================== SUBIDAS MÚLTIPLES EN PARALELO ====================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    """Pool de hilos compartido (acotado por SUBIDAS_HILOS) para las subidas múltiples"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=current_app.config.get('SUBIDAS_HILOS', 4),
+                    thread_name_prefix='subidas'
+                )
+    return _executor
+
+
+def preparar_archivo(file, backend, detectar_tipo=None):
+    """
+    Parte de guardar_archivo que no toca la base de datos (segura en hilos):
+    copia el archivo a disco calculando el SHA-256, detecta el tipo por sus
+    primeros bytes y lo escribe en el backend si el contenido aún no existe.
+    """
+    digest = hashlib.sha256()
+    tamano = 0
+    cabecera = b''
+    descriptor, temporal = tempfile.mkstemp(dir=backend.carpeta_temporal())
+    try:
+        with os.fdopen(descriptor, 'wb') as destino:
+            for bloque in iter(lambda: file.stream.read(TAMANO_BLOQUE), b''):
+                if not cabecera:
+                    cabecera = bloque[:32]
+                digest.update(bloque)
+                destino.write(bloque)
+                tamano += len(bloque)
+
+        tipo, extension = detectar_tipo(cabecera) if detectar_tipo else (None, None)
+        if detectar_tipo and tipo is None:
+            raise ValueError(f'{file.filename}: el contenido no es una imagen o video válido')
+        if extension is None:
+            extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+
+        sha256 = digest.hexdigest()
+        ruta = ruta_para(sha256, extension)
+        escrito = not backend.existe(ruta)
+        if escrito:
+            backend.guardar_desde_archivo(ruta, temporal)
+        else:
+            os.remove(temporal)
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+    return {
+        'nombre': file.filename,
+        'sha256': sha256,
+        'tamano': tamano,
+        'extension': extension,
+        'tipo': tipo,
+        'ruta': ruta,
+        'escrito': escrito
+    }
+
+
+def registrar_preparado(preparado):
+    """Registra (o suma la referencia de) un archivo preparado. Hilo principal, no hace commit"""
+    existente = Archivo.query.filter_by(sha256=preparado['sha256']).first()
+    if existente is not None:
+        if preparado['escrito'] and existente.ruta != preparado['ruta']:
+            # Mismo contenido guardado antes con otra extensión
+            almacenamiento().eliminar(preparado['ruta'])
+        retener_archivo(existente.ruta)
+        return existente.ruta, False
+    return _registrar(
+        preparado['ruta'], preparado['sha256'], preparado['tamano'],
+        preparado['extension'], preparado['nombre']
+    )
+
+
+def guardar_archivos(files, detectar_tipo=None):
+    """
+    Guarda varios FileStorage en paralelo: hash, detección de tipo y escritura
+    en el backend corren en el pool de hilos; los registros se crean después en
+    el hilo principal (la sesión no es segura entre hilos). Retorna una lista
+    de dicts con 'ruta', 'nuevo', 'tipo' y 'nombre' en el orden recibido. No hace commit.
+    """
+    backend = almacenamiento()
+    futuros = [_pool().submit(preparar_archivo, file, backend, detectar_tipo) for file in files]
+
+    # Esperar a todos antes de fallar: ningún hilo sigue leyendo la petición
+    preparados, error = [], None
+    for futuro in futuros:
+        try:
+            preparados.append(futuro.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+
+    resultado = []
+    for preparado in preparados:
+        ruta, nuevo = registrar_preparado(preparado)
+        resultado.append({'ruta': ruta, 'nuevo': nuevo, 'tipo': preparado['tipo'], 'nombre': preparado['nombre']})
+    return resultado
+
+
+def importar_archivo(ruta):
+    """
+    Incorpora al almacén un archivo guardado con el esquema anterior (carpetas planas).
+    Se enlaza (hard link) o copia: el original queda intacto hasta que
+    `flask limpiar-archivos` lo recoja como huérfano. Retorna la nueva ruta,
+    o None si el archivo no existe. No hace commit.
+    """
+    origen = _ruta_legada(ruta)
+    if not os.path.isfile(origen):
+        return None
+
+    digest = hashlib.sha256()
+    tamano = 0
+    with open(origen, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE), b''):
+            digest.update(bloque)
+            tamano += len(bloque)
+
+    sha256 = digest.hexdigest()
+    temporal = os.path.join(carpeta_temporal(), f'{sha256}.{uuid.uuid4().hex}')
+    try:
+        os.link(origen, temporal)
+    except OSError:
+        shutil.copy2(origen, temporal)
+
+    nombre = os.path.basename(ruta)
+    extension = nombre.rsplit('.', 1)[1].lower() if '.' in nombre else ''
+    nueva, _ = registrar_temporal(temporal, sha256, tamano, extension, nombre)
+    return nueva
+
+
+def cifrar_existente(ruta):
+    """
+    Cifra un documento guardado en claro, en el almacén o en las carpetas antiguas.
+    La copia en claro del almacén se libera (se borra tras el commit si nadie más
+    la usa); las antiguas quedan para `flask limpiar-archivos`. Retorna la nueva
+    ruta, o None si el archivo no existe. No hace commit.
+    """
+    anterior = Archivo.query.filter_by(ruta=ruta).first()
+    if anterior is not None:
+        backend = almacenamiento()
+        if not backend.existe(ruta):
+            return None
+        with backend.abrir(ruta) as origen:
+            temporal, huella, tamano = cifrar_a_temporal(origen)
+        extension, nombre = anterior.extension, anterior.nombre_original
+    else:
+        legada = _ruta_legada(ruta)
+        if not os.path.isfile(legada):
+            return None
+        with open(legada, 'rb') as origen:
+            temporal, huella, tamano = cifrar_a_temporal(origen)
+        nombre = os.path.basename(ruta)
+        extension = nombre.rsplit('.', 1)[1].lower() if '.' in nombre else ''
+
+    nueva, _ = registrar_temporal(temporal, huella, tamano, extension, nombre, cifrado=True)
+    if anterior is not None:
+        liberar_archivo(ruta)
+    return nueva
+
+
+def _conservar(ruta):
+    """
+    Quita la ruta de los archivos por eliminar tras el commit: reemplazar un
+    documento por el mismo contenido libera y vuelve a guardar el mismo archivo
+    """
+    pendientes = db.session.info.get('archivos_por_eliminar')
+    if pendientes and ruta in pendientes:
+        db.session.info['archivos_por_eliminar'] = [r for r in pendientes if r != ruta]
+
+
+def retener_archivo(ruta):
+    """Suma una referencia a un archivo del almacén (UPDATE atómico)"""
+    _conservar(ruta)
+    return db.session.execute(
+        update(Archivo)
+        .where(Archivo.ruta == ruta)
+        .values(referencias=Archivo.referencias + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def liberar_archivo(ruta):
+    """
+    Resta una referencia. Si llega a cero se elimina el registro y, tras el commit,
+    el archivo y sus variantes. Los archivos anteriores al almacén (sin registro)
+    se eliminan directamente tras el commit. No hace commit.
+    """
+    if not ruta:
+        return
+
+    archivo = Archivo.query.filter_by(ruta=ruta).first()
+    if archivo is not None:
+        db.session.execute(
+            update(Archivo)
+            .where(Archivo.id == archivo.id)
+            .values(referencias=Archivo.referencias - 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.refresh(archivo)
+        if archivo.referencias > 0:
+            return
+        db.session.delete(archivo)
+
+    db.session.info.setdefault('archivos_por_eliminar', []).append(ruta)
+
+
+@event.listens_for(Session, 'after_commit')
+def _eliminar_archivos_liberados(session):
+    rutas = session.info.pop('archivos_por_eliminar', None)
+    if not rutas:
+        return
+
+    from app.services.media_service import eliminar_variantes
+    backend = almacenamiento()
+    for ruta in rutas:
+        try:
+            eliminar_variantes(ruta)
+            backend.eliminar(ruta)
+        except Exception as e:
+            current_app.logger.error(f"Error al eliminar archivo {ruta}: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_archivos_liberados(session):
+    session.info.pop('archivos_por_eliminar', None)
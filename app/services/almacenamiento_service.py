@@ -0,0 +1,357 @@
+"""
+Almacenamiento Service - Backend de almacenamiento de los archivos subidos
+
+Todas las lecturas y escrituras de archivos subidos pasan por aquí, así la
+aplicación puede correr en varios nodos detrás de un balanceador usando un
+bucket S3 compartido en lugar del disco local.
+
+    ALMACENAMIENTO = 'local'   -> carpeta /static (por defecto)
+    ALMACENAMIENTO = 's3'      -> bucket S3 o compatible (MinIO, Ceph, R2...)
+
+Las rutas son siempre relativas ('uploads/archivos/ab/cd/<sha>.jpg') y se usan
+como clave del objeto en S3. Para probar el backend S3 en local basta un MinIO:
+
+    docker run -p 9000:9000 minio/minio server /data
+    S3_ENDPOINT_URL=http://localhost:9000 S3_BUCKET=uploads ...
+
+boto3 es opcional: solo se necesita con ALMACENAMIENTO = 's3'.
+"""
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime
+
+from flask import current_app
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 es opcional
+    boto3 = None
+
+TAMANO_BLOQUE = 64 * 1024
+
+
+class ChecksumInvalido(ValueError):
+    """El contenido recibido no coincide con el SHA-256 declarado"""
+
+
+class AlmacenamientoLocal:
+    """Archivos en el disco local, bajo la carpeta /static de la aplicación"""
+
+    nombre = 'local'
+
+    def __init__(self, raiz, cuarentena):
+        self.raiz = raiz
+        self.carpeta_cuarentena = cuarentena
+
+    def ruta_local(self, ruta):
+        """Ruta absoluta en disco (None en backends remotos)"""
+        return os.path.join(self.raiz, *ruta.split('/'))
+
+    def carpeta_temporal(self):
+        """Carpeta de preparación en el mismo disco: el paso final es un os.replace atómico"""
+        carpeta = os.path.join(self.raiz, 'uploads', 'archivos', 'tmp')
+        os.makedirs(carpeta, exist_ok=True)
+        return carpeta
+
+    # ---------- Objetos ----------
+
+    def guardar(self, ruta, origen):
+        """Escribe un stream (file-like) en la ruta, por bloques"""
+        destino = self.ruta_local(ruta)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        temporal = f'{destino}.{uuid.uuid4().hex}.tmp'
+        with open(temporal, 'wb') as salida:
+            shutil.copyfileobj(origen, salida, TAMANO_BLOQUE)
+        os.replace(temporal, destino)
+
+    def guardar_desde_archivo(self, ruta, temporal):
+        """Mueve un archivo local ya escrito a la ruta indicada"""
+        destino = self.ruta_local(ruta)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(temporal, destino)
+
+    def abrir(self, ruta):
+        """Stream de lectura del archivo (usar con `with`)"""
+        return open(self.ruta_local(ruta), 'rb')
+
+    def existe(self, ruta):
+        return os.path.isfile(self.ruta_local(ruta))
+
+    def estado(self, ruta):
+        """(tamaño, fecha de modificación) o None si no existe"""
+        try:
+            info = os.stat(self.ruta_local(ruta))
+        except FileNotFoundError:
+            return None
+        return info.st_size, datetime.fromtimestamp(info.st_mtime)
+
+    def eliminar(self, ruta):
+        try:
+            os.remove(self.ruta_local(ruta))
+        except FileNotFoundError:
+            pass
+
+    def mover(self, origen, destino):
+        final = self.ruta_local(destino)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(self.ruta_local(origen), final)
+
+    def listar(self, prefijo):
+        """Genera (ruta, tamaño, mtime timestamp) bajo el prefijo, en una sola pasada con os.scandir"""
+        pendientes = [self.ruta_local(prefijo.rstrip('/'))]
+        while pendientes:
+            carpeta = pendientes.pop()
+            try:
+                with os.scandir(carpeta) as entradas:
+                    for entrada in entradas:
+                        if entrada.is_dir(follow_symlinks=False):
+                            pendientes.append(entrada.path)
+                        elif entrada.is_file(follow_symlinks=False):
+                            info = entrada.stat(follow_symlinks=False)
+                            ruta = os.path.relpath(entrada.path, self.raiz).replace(os.sep, '/')
+                            yield ruta, info.st_size, info.st_mtime
+            except FileNotFoundError:
+                continue
+
+    def cuarentena(self, ruta, lote):
+        """Mueve el archivo fuera de /static, a <CUARENTENA_FOLDER>/<lote>/<ruta>"""
+        destino = os.path.join(self.carpeta_cuarentena, lote, *ruta.split('/'))
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        shutil.move(self.ruta_local(ruta), destino)
+        return destino
+
+    def url_descarga(self, ruta, expira=300, nombre=None):
+        """Los archivos locales se entregan por /archivos (send_file / X-Accel-Redirect)"""
+        return None
+
+    # ---------- Subidas por partes ----------
+
+    def _carpeta_partes(self, ruta, upload_id):
+        return self.ruta_local(f'{ruta}.partes/{upload_id}')
+
+    def iniciar_multipart(self, ruta):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._carpeta_partes(ruta, upload_id), exist_ok=True)
+        return upload_id
+
+    def subir_parte(self, ruta, upload_id, numero, origen, longitud, sha256):
+        """Escribe una parte calculando su SHA-256; si no coincide se descarta. Retorna su etag"""
+        carpeta = self._carpeta_partes(ruta, upload_id)
+        if not os.path.isdir(carpeta):
+            raise ValueError('La subida expiró, inicie una nueva')
+
+        digest = hashlib.sha256()
+        escritos = 0
+        temporal = os.path.join(carpeta, f'{numero:05d}.{uuid.uuid4().hex}.tmp')
+        with open(temporal, 'wb') as destino:
+            while escritos < longitud:
+                bloque = origen.read(min(TAMANO_BLOQUE, longitud - escritos))
+                if not bloque:
+                    break
+                digest.update(bloque)
+                destino.write(bloque)
+                escritos += len(bloque)
+            destino.flush()
+            os.fsync(destino.fileno())
+
+        if escritos != longitud or digest.hexdigest() != sha256.lower():
+            os.remove(temporal)
+            raise ChecksumInvalido('Bloque incompleto o checksum inválido, reenvíe el bloque')
+
+        os.replace(temporal, os.path.join(carpeta, f'{numero:05d}'))
+        return digest.hexdigest()
+
+    def completar_multipart(self, ruta, upload_id, partes):
+        """Une las partes (lista de (numero, etag, sha256)) en la ruta final"""
+        carpeta = self._carpeta_partes(ruta, upload_id)
+        destino = self.ruta_local(ruta)
+        # Se une aparte y se renombra: la ruta final existe solo si quedó completa
+        with open(f'{destino}.parcial', 'wb') as salida:
+            for numero, _, _ in sorted(partes):
+                with open(os.path.join(carpeta, f'{numero:05d}'), 'rb') as parte:
+                    shutil.copyfileobj(parte, salida, 1024 * 1024)
+        os.replace(f'{destino}.parcial', destino)
+        shutil.rmtree(os.path.dirname(carpeta), ignore_errors=True)
+
+    def abortar_multipart(self, ruta, upload_id):
+        shutil.rmtree(os.path.dirname(self._carpeta_partes(ruta, upload_id)), ignore_errors=True)
+
+
+class AlmacenamientoS3:
+    """Objetos en un bucket S3 o compatible (MinIO en desarrollo)"""
+
+    nombre = 's3'
+
+    def __init__(self, bucket, prefijo='', cliente=None, tamano_parte=8 * 1024 * 1024):
+        if boto3 is None and cliente is None:
+            raise RuntimeError('ALMACENAMIENTO = "s3" requiere boto3 (pip install boto3)')
+        self.bucket = bucket
+        self.prefijo = prefijo.strip('/') + '/' if prefijo else ''
+        self.cliente = cliente
+        self.transferencia = TransferConfig(
+            multipart_threshold=tamano_parte,
+            multipart_chunksize=tamano_parte
+        ) if boto3 is not None else None
+
+    def _clave(self, ruta):
+        return f'{self.prefijo}{ruta}'
+
+    def ruta_local(self, ruta):
+        return None
+
+    def carpeta_temporal(self):
+        return tempfile.gettempdir()
+
+    # ---------- Objetos ----------
+
+    def guardar(self, ruta, origen):
+        # upload_fileobj usa multipart automáticamente para objetos grandes
+        self.cliente.upload_fileobj(origen, self.bucket, self._clave(ruta), Config=self.transferencia)
+
+    def guardar_desde_archivo(self, ruta, temporal):
+        try:
+            self.cliente.upload_file(temporal, self.bucket, self._clave(ruta), Config=self.transferencia)
+        finally:
+            os.remove(temporal)
+
+    def abrir(self, ruta):
+        return self.cliente.get_object(Bucket=self.bucket, Key=self._clave(ruta))['Body']
+
+    def estado(self, ruta):
+        try:
+            respuesta = self.cliente.head_object(Bucket=self.bucket, Key=self._clave(ruta))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return respuesta['ContentLength'], respuesta['LastModified']
+
+    def existe(self, ruta):
+        return self.estado(ruta) is not None
+
+    def eliminar(self, ruta):
+        self.cliente.delete_object(Bucket=self.bucket, Key=self._clave(ruta))
+
+    def mover(self, origen, destino):
+        # copy() gestionado: usa copia por partes para objetos de más de 5 GB
+        self.cliente.copy(
+            {'Bucket': self.bucket, 'Key': self._clave(origen)},
+            self.bucket, self._clave(destino),
+            Config=self.transferencia
+        )
+        self.eliminar(origen)
+
+    def listar(self, prefijo):
+        paginador = self.cliente.get_paginator('list_objects_v2')
+        for pagina in paginador.paginate(Bucket=self.bucket, Prefix=self._clave(prefijo)):
+            for objeto in pagina.get('Contents', []):
+                yield (
+                    objeto['Key'][len(self.prefijo):],
+                    objeto['Size'],
+                    objeto['LastModified'].timestamp()
+                )
+
+    def cuarentena(self, ruta, lote):
+        destino = f'cuarentena/{lote}/{ruta}'
+        self.mover(ruta, destino)
+        return destino
+
+    def url_descarga(self, ruta, expira=300, nombre=None):
+        """URL prefirmada de descarga directa desde el bucket"""
+        parametros = {'Bucket': self.bucket, 'Key': self._clave(ruta)}
+        if nombre:
+            parametros['ResponseContentDisposition'] = f'attachment; filename="{nombre}"'
+        return self.cliente.generate_presigned_url('get_object', Params=parametros, ExpiresIn=expira)
+
+    # ---------- Subidas por partes ----------
+    # Las partes abandonadas se limpian con la regla de ciclo de vida
+    # AbortIncompleteMultipartUpload del bucket.
+
+    def iniciar_multipart(self, ruta):
+        respuesta = self.cliente.create_multipart_upload(
+            Bucket=self.bucket, Key=self._clave(ruta), ChecksumAlgorithm='SHA256'
+        )
+        return respuesta['UploadId']
+
+    def subir_parte(self, ruta, upload_id, numero, origen, longitud, sha256):
+        """El bucket verifica el SHA-256 de la parte y la rechaza si no coincide"""
+        try:
+            respuesta = self.cliente.upload_part(
+                Bucket=self.bucket,
+                Key=self._clave(ruta),
+                UploadId=upload_id,
+                PartNumber=numero,
+                Body=origen,
+                ContentLength=longitud,
+                ChecksumSHA256=base64.b64encode(bytes.fromhex(sha256)).decode()
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('BadDigest', 'InvalidDigest', 'IncompleteBody'):
+                raise ChecksumInvalido('Bloque incompleto o checksum inválido, reenvíe el bloque')
+            if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+                raise ValueError('La subida expiró, inicie una nueva')
+            raise
+        return respuesta['ETag']
+
+    def completar_multipart(self, ruta, upload_id, partes):
+        self.cliente.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self._clave(ruta),
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {
+                    'PartNumber': numero,
+                    'ETag': etag,
+                    'ChecksumSHA256': base64.b64encode(bytes.fromhex(sha256)).decode()
+                }
+                for numero, etag, sha256 in sorted(partes)
+            ]}
+        )
+
+    def abortar_multipart(self, ruta, upload_id):
+        try:
+            self.cliente.abort_multipart_upload(Bucket=self.bucket, Key=self._clave(ruta), UploadId=upload_id)
+        except ClientError:
+            pass
+
+
+def crear_almacenamiento(config, static_folder):
+    """Crea el backend según la configuración"""
+    tipo = config.get('ALMACENAMIENTO', 'local')
+    if tipo == 'local':
+        return AlmacenamientoLocal(
+            static_folder,
+            config.get('CUARENTENA_FOLDER') or os.path.join(os.path.dirname(static_folder), 'cuarentena')
+        )
+    if tipo == 's3':
+        if boto3 is None:
+            raise RuntimeError('ALMACENAMIENTO = "s3" requiere boto3 (pip install boto3)')
+        cliente = boto3.client(
+            's3',
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region_name=config.get('S3_REGION'),
+            aws_access_key_id=config.get('S3_ACCESS_KEY'),
+            aws_secret_access_key=config.get('S3_SECRET_KEY')
+        )
+        return AlmacenamientoS3(
+            config['S3_BUCKET'],
+            prefijo=config.get('S3_PREFIJO', ''),
+            cliente=cliente,
+            tamano_parte=config.get('SUBIDA_TAMANO_BLOQUE', 8 * 1024 * 1024)
+        )
+    raise ValueError(f'ALMACENAMIENTO desconocido: {tipo}')
+
+
+def almacenamiento():
+    """Backend de la aplicación actual (creado una vez por app)"""
+    backend = current_app.extensions.get('almacenamiento')
+    if backend is None:
+        backend = crear_almacenamiento(current_app.config, current_app.static_folder)
+        current_app.extensions['almacenamiento'] = backend
+    return backend
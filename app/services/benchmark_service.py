@@ -0,0 +1,258 @@
+"""
+Benchmark Service - Mediciones de rendimiento del cifrado y de las consultas
+
+Cada función mide un escenario concreto y retorna un dict con los resultados,
+para comparar antes/después de un cambio. `suite_cifrado` agrupa los
+micro-benchmarks de la capa de cifrado en un JSON estable (`flask benchmark-cripto`).
+"""
+import contextlib
+import json
+import os
+import platform
+import time
+
+import cryptography
+from cryptography.fernet import Fernet, MultiFernet
+from sqlalchemy.orm import undefer_group
+from app import db
+from app.models import (
+    EncryptedText, claves_fernet, get_cipher, decrypt_data, encrypt_data,
+    Propietario, Vehiculo
+)
+from app.services.descifrado_service import descifrar_muchos
+
+
+def _mejor(funcion, repeticiones):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def medir_columnas(filas=1000, campos=7, repeticiones=3):
+    """
+    Costo por fila de leer un listado de `filas` registros con `campos` columnas
+    cifradas (un listado de vehículos o inquilinos):
+
+    - propiedades: como las antiguas propiedades @property, un Fernet nuevo
+      (get_cipher) y un descifrado por cada acceso
+    - tipo: EncryptedText, leyendo todas las columnas
+    - tipo_sin_leer: EncryptedText sin leer los atributos (se descifran al accederlos)
+
+    Retorna {'filas', 'campos', '<escenario>_us_fila', ...} en microsegundos por fila.
+    """
+    cipher = get_cipher()
+    key = claves_fernet()[0]
+    tokens = [
+        [cipher.encrypt(f'valor {fila}-{campo}'.encode()).decode() for campo in range(campos)]
+        for fila in range(filas)
+    ]
+    tipo = EncryptedText()
+
+    def propiedades():
+        for fila in tokens:
+            for token in fila:
+                Fernet(key).decrypt(token.encode()).decode()
+
+    def tipo_leido():
+        for fila in tokens:
+            for token in fila:
+                tipo.process_result_value(token, None).descifrar()
+
+    def tipo_sin_leer():
+        for fila in tokens:
+            for token in fila:
+                tipo.process_result_value(token, None)
+
+    resultado = {'filas': filas, 'campos': campos}
+    for nombre, funcion in (('propiedades', propiedades), ('tipo', tipo_leido),
+                            ('tipo_sin_leer', tipo_sin_leer)):
+        resultado[f'{nombre}_us_fila'] = round(_mejor(funcion, repeticiones) / filas * 1e6, 1)
+    return resultado
+
+
+def _bytes_transferidos(consulta):
+    """
+    Filas y bytes que devuelve MySQL para una consulta ORM: se ejecuta el SQL
+    compilado directo en el driver, sin descifrar, y se suma el tamaño de cada valor
+    """
+    sql = str(consulta.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    filas = total = 0
+    for fila in db.session.connection().exec_driver_sql(sql):
+        filas += 1
+        total += sum(len(valor) if isinstance(valor, (str, bytes)) else 8 for valor in fila if valor is not None)
+    return filas, total
+
+
+def medir_transferencia():
+    """
+    Bytes movidos desde la base por los listados, cargando la entidad completa
+    (antes) y con su proyección (proyeccion_service). Retorna
+    {listado: {'filas', 'antes', 'despues', 'ahorro_pct'}}
+    """
+    from app.services.proyeccion_service import (
+        propietario_busqueda, propietario_resumen, vehiculo_resumen, vehiculo_selector
+    )
+    escenarios = (
+        ('api_vehiculos', Vehiculo, vehiculo_resumen()),
+        ('crear_trabajo', Vehiculo, vehiculo_selector()),
+        ('api_propietarios', Propietario, propietario_resumen()),
+        ('buscar_propietarios', Propietario, propietario_busqueda()),
+    )
+
+    resultado = {}
+    for nombre, modelo, opciones in escenarios:
+        # Antes: todas las columnas, incluidas las que ahora son diferidas
+        filas, antes = _bytes_transferidos(modelo.query.options(undefer_group('detalle')))
+        _, despues = _bytes_transferidos(modelo.query.options(*opciones))
+        resultado[nombre] = {
+            'filas': filas,
+            'antes': antes,
+            'despues': despues,
+            'ahorro_pct': round((1 - despues / antes) * 100, 1) if antes else 0.0
+        }
+    return resultado
+
+
+# ==================== SUITE DE CIFRADO (JSON) ====================
+
+FORMATO_SUITE = 1
+
+# Tamaños típicos (caracteres) de las columnas cifradas
+CAMPOS_MUESTRA = {
+    'cedula': 11, 'telefono': 12, 'email': 30, 'nombre': 40,
+    'ruta': 90, 'direccion': 120, 'descripcion': 1000,
+}
+
+
+def _us_op(funcion, ops, repeticiones):
+    return {'us_op': round(_mejor(funcion, repeticiones) / ops * 1e6, 2), 'ops': ops}
+
+
+def _texto(largo, semilla=0):
+    return (f'{semilla} Ab1 ñ ' * largo)[:largo]
+
+
+def suite_cifrado(lote=1000, filas=1000, repeticiones=5):
+    """
+    Micro-benchmarks de la capa de cifrado en memoria (sin base de datos):
+
+    - cifrar/descifrar.<campo>.unitario: encrypt_data / decrypt_data de un valor
+    - cifrar/descifrar.<campo>.lote: `lote` valores por EncryptedText / descifrar_muchos
+    - cipher.*: costo de construir Fernet / MultiFernet y de get_cipher (memo)
+    - multifernet.<n>_claves: descifrar con la clave más vieja de n (peor caso)
+    - error.*: token inválido, decrypt_data (con su print) vs cipher directo
+    - listado_inquilinos.*: `filas` inquilinos de 6 columnas a JSON, por tipo y en lote
+
+    Retorna un dict estable para guardar como JSON y comparar con `comparar_suite`:
+    {'formato', 'suite', 'entorno', 'parametros', 'resultados': {nombre: {'us_op', 'ops'}}}
+    """
+    cipher = get_cipher()
+    key = claves_fernet()[0]
+    tipo = EncryptedText()
+    resultados = {}
+
+    def medir(nombre, funcion, ops=1):
+        resultados[nombre] = _us_op(funcion, ops, repeticiones)
+
+    # Cifrado y descifrado por tamaño de campo
+    for campo, largo in CAMPOS_MUESTRA.items():
+        valor = _texto(largo)
+        token = encrypt_data(valor)
+        valores = [_texto(largo, i) for i in range(lote)]
+        tokens = [cipher.encrypt(v.encode()).decode() for v in valores]
+
+        medir(f'cifrar.{campo}.unitario', lambda valor=valor: encrypt_data(valor))
+        medir(f'descifrar.{campo}.unitario', lambda token=token: decrypt_data(token))
+        medir(f'cifrar.{campo}.lote', lambda valores=valores: [tipo.process_bind_param(v, None) for v in valores], lote)
+        medir(f'descifrar.{campo}.lote', lambda tokens=tokens: descifrar_muchos(tokens), lote)
+
+    # Construcción de ciphers
+    extra = [Fernet.generate_key() for _ in range(3)]
+    medir('cipher.fernet', lambda: Fernet(key))
+    medir('cipher.multifernet_1', lambda: MultiFernet([Fernet(key)]))
+    medir('cipher.multifernet_4', lambda: MultiFernet([Fernet(k) for k in [key, *extra]]))
+    medir('cipher.get_cipher', get_cipher)
+
+    # Lista de claves: el token de la clave más vieja obliga a probar todas
+    for n in (1, 2, 4):
+        claves = [*extra[:n - 1], key]
+        multi = MultiFernet([Fernet(k) for k in claves])
+        token = Fernet(claves[-1]).encrypt(_texto(40).encode())
+        medir(f'multifernet.{n}_claves', lambda multi=multi, token=token: multi.decrypt(token))
+
+    # Camino de error: token inválido
+    invalido = Fernet(Fernet.generate_key()).encrypt(b'x').decode()
+
+    def con_print():
+        with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+            try:
+                decrypt_data(invalido)
+            except Exception:
+                pass
+
+    def sin_print():
+        try:
+            cipher.decrypt(invalido.encode())
+        except Exception:
+            pass
+
+    medir('error.decrypt_data', con_print)
+    medir('error.cipher_directo', sin_print)
+
+    # Listado de inquilinos de punta a punta (sin la consulta)
+    columnas = ['nombre_apellido', 'cedula', 'licencia', 'telefono', 'email', 'direccion']
+    largos = [CAMPOS_MUESTRA[c] for c in ('nombre', 'cedula', 'cedula', 'telefono', 'email', 'direccion')]
+    tokens_filas = [
+        [cipher.encrypt(_texto(largo, fila).encode()).decode() for largo in largos]
+        for fila in range(filas)
+    ]
+
+    def listado_tipo():
+        json.dumps([
+            {'id': i, **{c: tipo.process_result_value(t, None).descifrar() for c, t in zip(columnas, fila)}}
+            for i, fila in enumerate(tokens_filas)
+        ])
+
+    def listado_lote():
+        textos = iter(descifrar_muchos([t for fila in tokens_filas for t in fila]))
+        json.dumps([
+            {'id': i, **{c: next(textos) for c in columnas}}
+            for i in range(filas)
+        ])
+
+    medir('listado_inquilinos.tipo', listado_tipo)
+    medir('listado_inquilinos.lote', listado_lote)
+
+    return {
+        'formato': FORMATO_SUITE,
+        'suite': 'cifrado',
+        'entorno': {
+            'python': platform.python_version(),
+            'cryptography': cryptography.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'parametros': {'lote': lote, 'filas': filas, 'repeticiones': repeticiones},
+        'resultados': dict(sorted(resultados.items())),
+    }
+
+
+def comparar_suite(actual, base, tolerancia=0.25):
+    """
+    Mediciones de `actual` más lentas que en `base` por encima de `tolerancia`
+    (0.25 = 25%). Retorna [(nombre, us_base, us_actual, cambio_pct)]
+    """
+    if actual.get('formato') != base.get('formato'):
+        raise ValueError(f"Formatos distintos: {actual.get('formato')} vs {base.get('formato')}")
+    regresiones = []
+    for nombre, medicion in actual['resultados'].items():
+        anterior = base['resultados'].get(nombre)
+        if not anterior or not anterior['us_op']:
+            continue
+        cambio = medicion['us_op'] / anterior['us_op'] - 1
+        if cambio > tolerancia:
+            regresiones.append((nombre, anterior['us_op'], medicion['us_op'], round(cambio * 100, 1)))
+    return regresiones
@@ -0,0 +1,347 @@
+"""
+Cifrado Service - Cifrado autenticado por bloques de los documentos guardados
+
+Las cédulas, licencias y cartas de buena conducta se guardan cifradas en el
+almacén (AES-256-GCM), no solo sus rutas en la base de datos. El archivo se
+cifra mientras se recibe y se descifra al vuelo al servirlo, un bloque a la
+vez: la memoria usada no depende del tamaño del documento.
+
+Formato del archivo (.enc):
+
+    cabecera  b'ADOC' | versión (1 byte) | tamaño de bloque (4 bytes) | prefijo de nonce (7 bytes)
+    bloques   AES-GCM de TAMANO_BLOQUE bytes (el último puede ser menor o vacío) + etiqueta de 16 bytes
+
+Nonce de cada bloque = prefijo | número de bloque (4 bytes) | 1 si es el último, 0 si no.
+La cabecera va como dato asociado. Así un bloque no puede cambiarse de lugar,
+repetirse ni quitarse del final sin que falle la verificación.
+
+La clave se deriva (HKDF-SHA256) de FERNET_KEY, la misma de get_cipher. Tras
+una rotación los documentos existentes se siguen leyendo con las claves
+derivadas de FERNET_KEYS_ANTERIORES hasta que `flask rotate-keys` los recifra
+con la actual. La huella con que se deduplican se deriva de INDICES_KEY, que no
+rota.
+"""
+import base64
+import hashlib
+import hmac
+import io
+import os
+import struct
+import time
+from functools import lru_cache
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from flask import current_app
+
+
+SUFIJO = '.enc'
+MAGICO = b'ADOC'
+VERSION = 1
+TAMANO_BLOQUE = 64 * 1024
+TAMANO_ETIQUETA = 16
+_CABECERA = struct.Struct('>4sBI7s')
+
+
+class DocumentoCorrupto(ValueError):
+    """El archivo cifrado fue alterado, truncado o se cifró con otra clave"""
+
+
+def es_cifrado(ruta):
+    return bool(ruta) and ruta.endswith(SUFIJO)
+
+
+@lru_cache(maxsize=8)
+def _derivar(key, uso):
+    """Clave de 32 bytes para `uso`, derivada de la FERNET_KEY"""
+    try:
+        material = base64.urlsafe_b64decode(key)
+    except Exception as e:
+        raise ValueError(f"FERNET_KEY inválida: {str(e)}")
+    if len(material) != 32:
+        raise ValueError("FERNET_KEY inválida: debe tener 32 bytes en base64 URL-safe")
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=uso).derive(material)
+
+
+def _key_configurada():
+    key = current_app.config.get('FERNET_KEY')
+    if not key:
+        raise ValueError("FERNET_KEY no está configurada en la aplicación")
+    return key.encode() if isinstance(key, str) else key
+
+
+def _key_indices():
+    """INDICES_KEY: no cambia al rotar FERNET_KEY (si no está configurada se usa esta)"""
+    key = current_app.config.get('INDICES_KEY')
+    if not key:
+        return _key_configurada()
+    return key.encode() if isinstance(key, str) else key
+
+
+def clave_documentos():
+    """Clave AES-256 para cifrar el contenido de los documentos"""
+    return _derivar(_key_configurada(), b'documentos/aes-gcm/v1')
+
+
+def claves_documentos():
+    """Claves con las que se puede descifrar un documento: la actual y las anteriores"""
+    anteriores = current_app.config.get('FERNET_KEYS_ANTERIORES') or []
+    return [clave_documentos()] + [
+        _derivar(k.encode() if isinstance(k, str) else k, b'documentos/aes-gcm/v1') for k in anteriores
+    ]
+
+
+def huella_documento():
+    """
+    HMAC-SHA256 para deduplicar documentos cifrados en el almacén. A diferencia
+    de un SHA-256 simple, no permite confirmar desde fuera si alguien tiene un
+    documento conocido. Su clave no rota: archivos.sha256 sigue sirviendo para
+    deduplicar después de `flask rotate-keys`.
+    """
+    return hmac.new(_derivar(_key_indices(), b'documentos/huella/v1'), digestmod=hashlib.sha256)
+
+
+def clave_indices():
+    """Clave HMAC para las columnas sombra indexables (sombra_service)"""
+    return _derivar(_key_indices(), b'indices/hmac/v1')
+
+
+def _nonce(prefijo, indice, ultimo):
+    return prefijo + struct.pack('>IB', indice, 1 if ultimo else 0)
+
+
+class EscritorCifrado:
+    """
+    Cifra lo que se le escribe hacia `destino` (archivo binario). Retiene un
+    bloque completo hasta saber si es el último; `close()` escribe el bloque
+    final (puede ir vacío) y es obligatorio.
+    """
+
+    def __init__(self, destino, clave=None, tamano_bloque=TAMANO_BLOQUE):
+        self._destino = destino
+        self._aead = AESGCM(clave or clave_documentos())
+        self._tamano_bloque = tamano_bloque
+        self._prefijo = os.urandom(7)
+        self._cabecera = _CABECERA.pack(MAGICO, VERSION, tamano_bloque, self._prefijo)
+        self._pendiente = bytearray()
+        self._indice = 0
+        self._cerrado = False
+        destino.write(self._cabecera)
+
+    def _emitir(self, datos, ultimo):
+        if self._indice >= 0xFFFFFFFF:
+            raise ValueError('Documento demasiado grande para el cifrado por bloques')
+        self._destino.write(self._aead.encrypt(
+            _nonce(self._prefijo, self._indice, ultimo), bytes(datos), self._cabecera
+        ))
+        self._indice += 1
+
+    def write(self, datos):
+        if self._cerrado:
+            raise ValueError('Escritor cifrado cerrado')
+        self._pendiente += datos
+        # Solo se emite un bloque cuando hay algo después: el último se marca al cerrar
+        while len(self._pendiente) > self._tamano_bloque:
+            self._emitir(self._pendiente[:self._tamano_bloque], False)
+            del self._pendiente[:self._tamano_bloque]
+        return len(datos)
+
+    def close(self):
+        if not self._cerrado:
+            self._emitir(self._pendiente, True)
+            self._pendiente = bytearray()
+            self._cerrado = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is None:
+            self.close()
+
+
+def _leer_exacto(origen, cantidad):
+    """Lee hasta `cantidad` bytes (menos solo al final del stream)"""
+    partes, faltan = [], cantidad
+    while faltan > 0:
+        parte = origen.read(faltan)
+        if not parte:
+            break
+        partes.append(parte)
+        faltan -= len(parte)
+    return b''.join(partes)
+
+
+class LectorCifrado(io.RawIOBase):
+    """
+    Stream de lectura que descifra un documento .enc bloque a bloque.
+
+    Si el origen admite seek (disco local) o se conoce el tamaño cifrado
+    (`tamano_cifrado`), expone `tamano` del texto plano; con seek además
+    admite saltos, que es lo que usan las respuestas con Range.
+    """
+
+    def __init__(self, origen, clave=None, tamano_cifrado=None):
+        self._origen = origen
+        cabecera = _leer_exacto(origen, _CABECERA.size)
+        if len(cabecera) != _CABECERA.size:
+            raise DocumentoCorrupto('Cabecera incompleta')
+        magico, version, tamano_bloque, prefijo = _CABECERA.unpack(cabecera)
+        if magico != MAGICO or version != VERSION or not tamano_bloque:
+            raise DocumentoCorrupto('No es un documento cifrado reconocido')
+
+        # Sin clave explícita se prueban la actual y las anteriores en el primer bloque
+        self._candidatas = [AESGCM(c) for c in ([clave] if clave else claves_documentos())]
+        self._cabecera = cabecera
+        self._prefijo = prefijo
+        self._tamano_bloque = tamano_bloque
+        self._buscable = bool(getattr(origen, 'seekable', lambda: False)())
+
+        if tamano_cifrado is None and self._buscable:
+            tamano_cifrado = origen.seek(0, io.SEEK_END)
+            origen.seek(_CABECERA.size)
+
+        self.tamano = None
+        self._bloques = None
+        if tamano_cifrado is not None:
+            cuerpo = tamano_cifrado - _CABECERA.size
+            self._bloques = -(-cuerpo // (tamano_bloque + TAMANO_ETIQUETA))
+            self.tamano = cuerpo - self._bloques * TAMANO_ETIQUETA
+            if cuerpo < TAMANO_ETIQUETA or self.tamano < 0:
+                raise DocumentoCorrupto('Documento cifrado truncado')
+
+        self._posicion = 0
+        self._indice = -1          # Bloque descifrado en memoria
+        self._bloque = b''
+        self._siguiente = None     # Lectura adelantada (origen sin seek ni tamaño)
+        self._fin = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self._buscable and self._bloques is not None
+
+    def tell(self):
+        return self._posicion
+
+    def seek(self, desplazamiento, desde=io.SEEK_SET):
+        if not self.seekable():
+            raise io.UnsupportedOperation('El origen no admite seek')
+        if desde == io.SEEK_CUR:
+            desplazamiento += self._posicion
+        elif desde == io.SEEK_END:
+            desplazamiento += self.tamano
+        if desplazamiento < 0:
+            raise ValueError('Posición negativa')
+        self._posicion = desplazamiento
+        return self._posicion
+
+    def _descifrar(self, crudo, indice, ultimo):
+        nonce = _nonce(self._prefijo, indice, ultimo)
+        for aead in self._candidatas:
+            try:
+                datos = aead.decrypt(nonce, crudo, self._cabecera)
+            except InvalidTag:
+                continue
+            self._candidatas = [aead]
+            return datos
+        raise DocumentoCorrupto(f'El bloque {indice} no pasó la verificación')
+
+    def _cargar(self, indice):
+        """Deja en memoria el bloque `indice` descifrado; False si está más allá del final"""
+        tamano_crudo = self._tamano_bloque + TAMANO_ETIQUETA
+
+        if self.seekable():
+            if indice >= self._bloques:
+                return False
+            self._origen.seek(_CABECERA.size + indice * tamano_crudo)
+            crudo = _leer_exacto(self._origen, tamano_crudo)
+            ultimo = indice == self._bloques - 1
+        else:
+            if self._fin:
+                return False
+            if indice != self._indice + 1:
+                raise io.UnsupportedOperation('El origen solo admite lectura secuencial')
+            crudo = self._siguiente if self._siguiente is not None else _leer_exacto(self._origen, tamano_crudo)
+            if not crudo:
+                raise DocumentoCorrupto('Documento cifrado truncado')
+            if self._bloques is not None:
+                ultimo = indice == self._bloques - 1
+            else:
+                # Sin tamaño conocido, el último bloque es el que no tiene nada después
+                self._siguiente = _leer_exacto(self._origen, tamano_crudo)
+                ultimo = not self._siguiente
+            self._fin = ultimo
+
+        self._bloque = self._descifrar(crudo, indice, ultimo)
+        self._indice = indice
+        return True
+
+    def readinto(self, destino):
+        if not len(destino):
+            return 0
+        indice, inicio = divmod(self._posicion, self._tamano_bloque)
+        if indice != self._indice and not self._cargar(indice):
+            return 0
+        datos = self._bloque[inicio:inicio + len(destino)]
+        destino[:len(datos)] = datos
+        self._posicion += len(datos)
+        return len(datos)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._origen.close()
+            finally:
+                super().close()
+
+
+def cifrar_stream(origen, destino, clave=None):
+    """Cifra todo `origen` hacia `destino`. Retorna los bytes de texto plano leídos"""
+    total = 0
+    escritor = EscritorCifrado(destino, clave)
+    for bloque in iter(lambda: origen.read(TAMANO_BLOQUE), b''):
+        escritor.write(bloque)
+        total += len(bloque)
+    escritor.close()
+    return total
+
+
+def abrir_documento(backend, ruta, tamano_cifrado=None):
+    """LectorCifrado sobre un documento .enc del backend de almacenamiento"""
+    return LectorCifrado(backend.abrir(ruta), tamano_cifrado=tamano_cifrado)
+
+
+def medir_rendimiento(tamano=10 * 1024 * 1024, repeticiones=5):
+    """
+    Tiempo de cifrar y descifrar `tamano` bytes en memoria (mejor de `repeticiones`).
+    Retorna {'tamano', 'cifrar_ms', 'descifrar_ms', 'cifrar_mb_s', 'descifrar_mb_s'}
+    """
+    clave = clave_documentos()
+    datos = os.urandom(tamano)
+    mejor_cifrar = mejor_descifrar = float('inf')
+
+    for _ in range(repeticiones):
+        cifrado = io.BytesIO()
+        inicio = time.perf_counter()
+        cifrar_stream(io.BytesIO(datos), cifrado, clave)
+        mejor_cifrar = min(mejor_cifrar, time.perf_counter() - inicio)
+
+        cifrado.seek(0)
+        inicio = time.perf_counter()
+        lector = LectorCifrado(cifrado, clave)
+        for _bloque in iter(lambda: lector.read(TAMANO_BLOQUE), b''):
+            pass
+        mejor_descifrar = min(mejor_descifrar, time.perf_counter() - inicio)
+
+    megas = tamano / (1024 * 1024)
+    return {
+        'tamano': tamano,
+        'cifrar_ms': round(mejor_cifrar * 1000, 2),
+        'descifrar_ms': round(mejor_descifrar * 1000, 2),
+        'cifrar_mb_s': round(megas / mejor_cifrar, 1) if mejor_cifrar else None,
+        'descifrar_mb_s': round(megas / mejor_descifrar, 1) if mejor_descifrar else None
+    }
@@ -0,0 +1,133 @@
+"""
+Pruebas de cifrado_service: ida y vuelta de EscritorCifrado/LectorCifrado,
+bloques truncados, reordenados o duplicados, y seek dentro de un bloque
+"""
+import io
+import os
+
+import pytest
+
+from app.services.cifrado_service import (
+    _CABECERA, TAMANO_ETIQUETA, DocumentoCorrupto, EscritorCifrado, LectorCifrado
+)
+
+
+BLOQUE = 16
+CLAVE = os.urandom(32)
+
+
+class Secuencial(io.RawIOBase):
+    """Origen sin seek, como el stream de un backend remoto"""
+
+    def __init__(self, datos):
+        self._datos = io.BytesIO(datos)
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        return self._datos.readinto(destino)
+
+
+def cifrar(datos, tamano_bloque=BLOQUE):
+    destino = io.BytesIO()
+    with EscritorCifrado(destino, CLAVE, tamano_bloque) as escritor:
+        # Escrituras de tamaño irregular para no alinear con los bloques
+        for inicio in range(0, len(datos), 7):
+            escritor.write(datos[inicio:inicio + 7])
+    return destino.getvalue()
+
+
+def bloques(cifrado):
+    """Separa la cabecera de los bloques cifrados"""
+    cuerpo = cifrado[_CABECERA.size:]
+    tamano = BLOQUE + TAMANO_ETIQUETA
+    return cifrado[:_CABECERA.size], [cuerpo[i:i + tamano] for i in range(0, len(cuerpo), tamano)]
+
+
+def lectores(cifrado):
+    """El mismo documento sobre un origen con seek y uno secuencial"""
+    return [
+        lambda: LectorCifrado(io.BytesIO(cifrado), CLAVE),
+        lambda: LectorCifrado(Secuencial(cifrado), CLAVE),
+    ]
+
+
+def leer(lector, cantidad):
+    """read() de un RawIOBase puede quedarse corto al final de cada bloque"""
+    partes = []
+    while cantidad > 0:
+        parte = lector.read(cantidad)
+        if not parte:
+            break
+        partes.append(parte)
+        cantidad -= len(parte)
+    return b''.join(partes)
+
+
+@pytest.mark.parametrize('tamano', [0, 1, BLOQUE - 1, BLOQUE, BLOQUE + 1, 3 * BLOQUE, 3 * BLOQUE + 5])
+def test_ida_y_vuelta(tamano):
+    datos = os.urandom(tamano)
+    cifrado = cifrar(datos)
+    for abrir in lectores(cifrado):
+        lector = abrir()
+        assert lector.read() == datos
+    assert LectorCifrado(io.BytesIO(cifrado), CLAVE).tamano == tamano
+
+
+def test_clave_distinta():
+    cifrado = cifrar(b'contenido del documento')
+    with pytest.raises(DocumentoCorrupto):
+        LectorCifrado(io.BytesIO(cifrado), os.urandom(32)).read()
+
+
+@pytest.mark.parametrize('alterar', [
+    pytest.param(lambda bs: bs[:-1], id='sin_ultimo_bloque'),
+    pytest.param(lambda bs: bs[:-1] + [bs[-1][:-1]], id='ultimo_bloque_recortado'),
+    pytest.param(lambda bs: bs[:-2] + [bs[-2][:5]], id='cortado_a_mitad'),
+    pytest.param(lambda bs: [bs[1], bs[0]] + bs[2:], id='reordenado'),
+    pytest.param(lambda bs: [bs[0]] + bs, id='duplicado'),
+    pytest.param(lambda bs: bs + [bs[-1]], id='final_duplicado'),
+])
+def test_bloques_alterados(alterar):
+    cabecera, originales = bloques(cifrar(os.urandom(3 * BLOQUE + 5)))
+    cifrado = cabecera + b''.join(alterar(originales))
+    for abrir in lectores(cifrado):
+        with pytest.raises(DocumentoCorrupto):
+            abrir().read()
+
+
+def test_solo_cabecera():
+    cabecera, _ = bloques(cifrar(b''))
+    for abrir in lectores(cabecera):
+        with pytest.raises(DocumentoCorrupto):
+            abrir().read()
+
+
+def test_seek_a_mitad_de_bloque():
+    datos = os.urandom(4 * BLOQUE + 3)
+    lector = LectorCifrado(io.BytesIO(cifrar(datos)), CLAVE)
+    assert lector.seekable()
+
+    lector.seek(5)
+    assert leer(lector, BLOQUE) == datos[5:5 + BLOQUE]
+    assert lector.tell() == 5 + BLOQUE
+
+    lector.seek(BLOQUE + BLOQUE // 2)
+    assert lector.read() == datos[BLOQUE + BLOQUE // 2:]
+
+    # Relativo al final y hacia atrás, cruzando al bloque anterior
+    lector.seek(-2, io.SEEK_END)
+    assert lector.read() == datos[-2:]
+    lector.seek(-BLOQUE - 1, io.SEEK_CUR)
+    assert leer(lector, 3) == datos[-BLOQUE - 1:-BLOQUE + 2]
+
+    lector.seek(len(datos) + 10)
+    assert lector.read() == b''
+
+
+def test_seek_sin_origen_buscable():
+    lector = LectorCifrado(Secuencial(cifrar(os.urandom(2 * BLOQUE))), CLAVE)
+    assert not lector.seekable()
+    with pytest.raises(io.UnsupportedOperation):
+        lector.seek(BLOQUE // 2)
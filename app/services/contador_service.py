@@ -0,0 +1,135 @@
+"""
+Contador Service - Contadores cacheados en Propietario
+
+Propietario guarda vehiculos_count, referencias_count y alquileres_activos_count
+para que los listados no hagan un COUNT por propietario (las relaciones son
+lazy='dynamic'). Al final de cada flush se recalculan, con un solo UPDATE, los
+contadores de los propietarios afectados por los Vehiculo, ReferenciaPropietario
+y Alquiler que cambiaron. Se recalculan desde las tablas (no se suma +1/-1),
+así que un flush nunca acumula error.
+
+Lo que no pasa por el ORM (DELETE masivos, cambios en la base a mano, cascadas
+ON DELETE) puede desfasarlos: `flask reparar-contadores` los corrige.
+"""
+from itertools import chain
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+from app import db
+from app.models import ESTADOS_ALQUILER_ACTIVOS, Alquiler, Propietario, ReferenciaPropietario, Vehiculo
+
+
+def _valores(obj, atributo, solo_cambios):
+    """Valores (actual y anterior) de `atributo`; con solo_cambios, nada si no cambió"""
+    historia = inspect(obj).attrs[atributo].history
+    if solo_cambios and not historia.has_changes():
+        return set()
+    return {v for v in chain(historia.added, historia.unchanged, historia.deleted) if v is not None}
+
+
+def _conteos():
+    """Subconsultas correlacionadas con propietarios.id de cada contador"""
+    tabla = Propietario.__table__
+    return {
+        'vehiculos_count': select(func.count(Vehiculo.id))
+        .where(Vehiculo.propietario_id == tabla.c.id).scalar_subquery(),
+        'referencias_count': select(func.count(ReferenciaPropietario.id))
+        .where(ReferenciaPropietario.propietario_id == tabla.c.id).scalar_subquery(),
+        'alquileres_activos_count': select(func.count(Alquiler.id))
+        .join(Vehiculo, Alquiler.vehiculo_id == Vehiculo.id)
+        .where(Vehiculo.propietario_id == tabla.c.id, Alquiler.estado_id.in_(ESTADOS_ALQUILER_ACTIVOS))
+        .scalar_subquery(),
+    }
+
+
+def recalcular(ids, conexion=None):
+    """Recalcula los contadores de los propietarios `ids` en un UPDATE (sin tocar fecha_hora_actualizo)"""
+    if not ids:
+        return
+    tabla = Propietario.__table__
+    # Asignar la columna a sí misma evita el onupdate de fecha_hora_actualizo
+    stmt = update(tabla).where(tabla.c.id.in_(list(ids))).values(
+        fecha_hora_actualizo=tabla.c.fecha_hora_actualizo, **_conteos()
+    )
+    (conexion or db.session).execute(stmt)
+
+
+# ==================== EVENTOS ====================
+
+@event.listens_for(Session, 'after_flush')
+def _marcar_propietarios(session, contexto):
+    """Anota los propietarios y vehículos afectados por el flush (se recalculan al terminar)"""
+    propietarios = set()
+    vehiculos = set()
+    for obj in chain(session.new, session.deleted, session.dirty):
+        solo_cambios = obj in session.dirty
+        if isinstance(obj, (Vehiculo, ReferenciaPropietario)):
+            propietarios |= _valores(obj, 'propietario_id', solo_cambios)
+        elif isinstance(obj, Alquiler):
+            if solo_cambios and not (_valores(obj, 'estado_id', True) or _valores(obj, 'vehiculo_id', True)):
+                continue
+            vehiculos |= _valores(obj, 'vehiculo_id', False)
+
+    if propietarios or vehiculos:
+        pendientes = session.info.setdefault('contadores_pendientes', (set(), set()))
+        pendientes[0].update(propietarios)
+        pendientes[1].update(vehiculos)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _recalcular_contadores(session, contexto):
+    pendientes = session.info.pop('contadores_pendientes', None)
+    if not pendientes:
+        return
+
+    propietarios, vehiculos = pendientes
+    if vehiculos:
+        conexion = session.connection()
+        propietarios |= set(conexion.execute(
+            select(Vehiculo.propietario_id).where(Vehiculo.id.in_(list(vehiculos)))
+        ).scalars())
+    recalcular(propietarios, session.connection())
+
+    # Las instancias cargadas vuelven a leer sus contadores al usarlos
+    for obj in session.identity_map.values():
+        if isinstance(obj, Propietario) and obj.id in propietarios:
+            session.expire(obj, list(_conteos()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_contadores(session):
+    session.info.pop('contadores_pendientes', None)
+
+
+# ==================== REPARACIÓN ====================
+
+def reparar_contadores(tamano_lote=1000):
+    """
+    Compara los contadores guardados con los reales por tramos de id y corrige
+    los desfasados. Retorna {'revisados', 'corregidos'}
+    """
+    conteos = _conteos()
+    tabla = Propietario.__table__
+    desfasado = (
+        (tabla.c.vehiculos_count != conteos['vehiculos_count'])
+        | (tabla.c.referencias_count != conteos['referencias_count'])
+        | (tabla.c.alquileres_activos_count != conteos['alquileres_activos_count'])
+    )
+    resumen = {'revisados': 0, 'corregidos': 0}
+    ultimo_id = 0
+    while True:
+        ids = db.session.execute(
+            select(tabla.c.id).where(tabla.c.id > ultimo_id).order_by(tabla.c.id).limit(tamano_lote)
+        ).scalars().all()
+        if not ids:
+            return resumen
+
+        corregir = db.session.execute(
+            select(tabla.c.id).where(tabla.c.id.in_(ids), desfasado)
+        ).scalars().all()
+        recalcular(corregir)
+        db.session.commit()
+
+        resumen['revisados'] += len(ids)
+        resumen['corregidos'] += len(corregir)
+        ultimo_id = ids[-1]
@@ -0,0 +1,147 @@
+"""
+Descifrado Service - Descifrado en paralelo de resultados grandes
+
+Fernet (AES-CBC + HMAC) es CPU: un listado o exportación de miles de filas
+descifradas una a una en EncryptedText queda limitado a un núcleo. Para esos
+casos las columnas cifradas se leen como token y se descifran en lote:
+
+    filas = leer_descifrado([Inquilino.id, Inquilino.nombre_apellido, Inquilino.telefono])
+
+- Por debajo de DESCIFRADO_UMBRAL tokens se descifra en el proceso actual
+  (cada token distinto una vez), porque repartir cuesta más que descifrar.
+- Por encima, los tokens distintos se reparten en tramos entre un pool de
+  procesos, en ventanas de a lo sumo DESCIFRADO_MEMORIA bytes de texto cifrado
+  por petición. El orden de los resultados se conserva.
+- Si un proceso del pool muere, el pool queda roto: se descarta (el siguiente
+  lote crea uno nuevo) y esa petición se descifra en el proceso actual.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+from cryptography.fernet import Fernet, MultiFernet
+from flask import current_app
+from sqlalchemy import Text, select, type_coerce
+from app import db
+from app.models import EncryptedText, claves_fernet, descifrar_token
+
+
+# ==================== TRABAJO EN LOS PROCESOS DEL POOL ====================
+
+_cipher = None
+
+
+def _iniciar_proceso(claves):
+    """Inicializador de cada proceso del pool: construye el cipher una sola vez"""
+    global _cipher
+    _cipher = MultiFernet([Fernet(k) for k in claves])
+
+
+def _descifrar_tramo(tokens):
+    return [_cipher.decrypt(token.encode()).decode() for token in tokens]
+
+
+# ==================== POOL ====================
+
+_pool = None
+_pool_claves = None
+_pool_procesos = 1
+_pool_lock = threading.Lock()
+
+
+def _obtener_pool(claves):
+    """Pool compartido por el proceso (y su cantidad de procesos); se recrea si cambian las claves"""
+    global _pool, _pool_claves, _pool_procesos
+    with _pool_lock:
+        if _pool is None or _pool_claves != claves:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool_procesos = current_app.config.get('DESCIFRADO_PROCESOS') or os.cpu_count() or 1
+            _pool = ProcessPoolExecutor(max_workers=_pool_procesos, initializer=_iniciar_proceso, initargs=(claves,))
+            _pool_claves = claves
+        return _pool, _pool_procesos
+
+
+def _descartar_pool(pool):
+    """Quita `pool` (roto) para que la próxima llamada cree uno nuevo"""
+    global _pool, _pool_claves
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            _pool_claves = None
+    pool.shutdown(wait=False)
+
+
+def _ventanas(tokens, memoria):
+    """Parte `tokens` en ventanas de a lo sumo `memoria` bytes"""
+    ventana, tamano = [], 0
+    for token in tokens:
+        if ventana and tamano + len(token) > memoria:
+            yield ventana
+            ventana, tamano = [], 0
+        ventana.append(token)
+        tamano += len(token)
+    if ventana:
+        yield ventana
+
+
+def descifrar_muchos(tokens):
+    """
+    Descifra una lista de tokens Fernet (None o '' dan None) y retorna los
+    textos en el mismo orden, en paralelo si son DESCIFRADO_UMBRAL o más
+    """
+    config = current_app.config
+    distintos = list(dict.fromkeys(t for t in tokens if t))
+    if len(distintos) < config.get('DESCIFRADO_UMBRAL', 5000):
+        textos = {t: descifrar_token(t) for t in distintos}
+        return [textos[t] if t else None for t in tokens]
+
+    claves = tuple(claves_fernet())
+    pool, partes = _obtener_pool(claves)
+    textos = {}
+    try:
+        for ventana in _ventanas(distintos, config.get('DESCIFRADO_MEMORIA', 32 * 1024 * 1024)):
+            tramo = -(-len(ventana) // partes)
+            tramos = [ventana[i:i + tramo] for i in range(0, len(ventana), tramo)]
+            for parcial, resultado in zip(tramos, pool.map(_descifrar_tramo, tramos)):
+                textos.update(zip(parcial, resultado))
+    except BrokenProcessPool:
+        current_app.logger.error('Pool de descifrado roto: se recrea y este lote se descifra en el proceso')
+        _descartar_pool(pool)
+        return [(textos[t] if t in textos else descifrar_token(t)) if t else None for t in tokens]
+    return [textos[t] if t else None for t in tokens]
+
+
+# ==================== CONSULTAS ====================
+
+def leer_descifrado(columnas, consulta=None):
+    """
+    Ejecuta un SELECT de `columnas` (atributos de modelo) y retorna una lista de
+    SimpleNamespace con los valores en claro, nombrados por su atributo. Las
+    columnas cifradas se traen como token y se descifran con descifrar_muchos.
+    `consulta(select)` permite agregar joins, where y order_by.
+    """
+    tipos = [col.type if isinstance(col.type, EncryptedText) else None for col in columnas]
+    stmt = select(*[
+        type_coerce(col, Text).label(col.key) if tipo is not None else col.label(col.key)
+        for col, tipo in zip(columnas, tipos)
+    ])
+    if consulta is not None:
+        stmt = consulta(stmt)
+    filas = db.session.execute(stmt).all()
+
+    # Todos los tokens de todas las columnas cifradas en un solo lote
+    cifradas = [i for i, tipo in enumerate(tipos) if tipo is not None]
+    textos = iter(descifrar_muchos([fila[i] for fila in filas for i in cifradas]))
+    valores = []
+    for fila in filas:
+        fila = list(fila)
+        for i in cifradas:
+            texto = next(textos)
+            fila[i] = tipos[i].process_result_value(None, None) if texto is None else tipos[i].desde_texto(texto)
+        valores.append(fila)
+
+    nombres = [col.key for col in columnas]
+    return [SimpleNamespace(**dict(zip(nombres, fila))) for fila in valores]
@@ -0,0 +1,206 @@
+"""
+Huella Service - Detección de documentos duplicados por hash perceptual
+
+Cada imagen de documento (cédulas, licencias...) recibe en segundo plano un
+dHash de 64 bits: la misma foto reenviada por WhatsApp, recortada o
+recomprimida da un hash a pocos bits de distancia (Hamming).
+
+Búsqueda multi-índice: el hash se guarda partido en 4 segmentos de 16 bits,
+cada uno indexado. Si dos hashes difieren en `umbral` bits o menos, al menos
+un segmento difiere en `umbral // 4` bits o menos (principio del palomar), así
+que basta consultar por índice los valores vecinos de cada segmento y verificar
+la distancia exacta solo en esos candidatos, sin recorrer la tabla.
+
+Pillow es opcional: sin él no se calculan huellas.
+"""
+from functools import lru_cache
+from io import BytesIO
+from itertools import combinations
+
+from flask import current_app
+from sqlalchemy import or_, select
+from app import db
+from app.models import Archivo, HuellaImagen
+from app.services.almacenamiento_service import almacenamiento
+from app.services.cifrado_service import SUFIJO, abrir_documento, es_cifrado
+from app.services.media_service import EXTENSIONES_IMAGEN
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow es opcional
+    Image = None
+
+
+SEGMENTOS = 4
+BITS_SEGMENTO = 16
+UMBRAL_MAXIMO = 16  # Con más bits las listas IN por segmento crecen combinatoriamente
+_MASCARA_64 = (1 << 64) - 1
+
+
+def admite_huella(ruta):
+    """True si la ruta es una imagen (cifrada o no) a la que se le calcula huella"""
+    if not ruta:
+        return False
+    if es_cifrado(ruta):
+        ruta = ruta[:-len(SUFIJO)]
+    return '.' in ruta and ruta.rsplit('.', 1)[1].lower() in EXTENSIONES_IMAGEN
+
+
+def calcular_huella(contenido):
+    """dHash de 64 bits (int sin signo) de una imagen en bytes, o None sin Pillow"""
+    if Image is None:
+        return None
+    with Image.open(BytesIO(contenido)) as original:
+        # JPEG: decodificar directo a escala reducida, mucho más rápido que a resolución completa
+        original.draft('L', (160, 160))
+        imagen = ImageOps.exif_transpose(original).convert('L').resize((9, 8), Image.LANCZOS)
+        pixeles = imagen.tobytes()
+
+    huella = 0
+    for fila in range(8):
+        for columna in range(8):
+            izquierda = pixeles[fila * 9 + columna]
+            derecha = pixeles[fila * 9 + columna + 1]
+            huella = (huella << 1) | (1 if izquierda > derecha else 0)
+    return huella
+
+
+def distancia(a, b):
+    return bin((a ^ b) & _MASCARA_64).count('1')
+
+
+def _segmentos(huella):
+    mascara = (1 << BITS_SEGMENTO) - 1
+    return [(huella >> (BITS_SEGMENTO * i)) & mascara for i in range(SEGMENTOS)]
+
+
+def _con_signo(huella):
+    """Los 64 bits en un BIGINT con signo"""
+    return huella - (1 << 64) if huella >= (1 << 63) else huella
+
+
+@lru_cache(maxsize=8)
+def _mascaras(radio):
+    """Todas las máscaras de 16 bits con hasta `radio` bits encendidos"""
+    mascaras = [0]
+    for bits in range(1, radio + 1):
+        for posiciones in combinations(range(BITS_SEGMENTO), bits):
+            mascaras.append(sum(1 << p for p in posiciones))
+    return tuple(mascaras)
+
+
+def leer_contenido(ruta):
+    """Bytes de un archivo del almacén, descifrado si es un documento .enc"""
+    backend = almacenamiento()
+    if es_cifrado(ruta):
+        with abrir_documento(backend, ruta) as lector:
+            return lector.read()
+    with backend.abrir(ruta) as origen:
+        return origen.read()
+
+
+def registrar_huella(archivo):
+    """Calcula y guarda la huella de un Archivo (la reemplaza si existía). No hace commit"""
+    huella = calcular_huella(leer_contenido(archivo.ruta))
+    if huella is None:
+        return None
+
+    registro = archivo.huella or HuellaImagen(archivo=archivo)
+    registro.hash = _con_signo(huella)
+    for i, valor in enumerate(_segmentos(huella)):
+        setattr(registro, f'segmento_{i}', valor)
+    db.session.add(registro)
+    return registro
+
+
+def buscar_similares(huella, umbral=None, excluir_archivo_id=None, limite=20):
+    """
+    Archivos cuya huella está a `umbral` bits o menos (HUELLA_UMBRAL por defecto).
+    Retorna una lista de dicts ordenada por distancia.
+    """
+    if umbral is None:
+        umbral = current_app.config.get('HUELLA_UMBRAL', 8)
+    if not 0 <= umbral <= UMBRAL_MAXIMO:
+        raise ValueError(f'El umbral debe estar entre 0 y {UMBRAL_MAXIMO}')
+    mascaras = _mascaras(umbral // SEGMENTOS)
+
+    condiciones = []
+    for i, valor in enumerate(_segmentos(huella)):
+        columna = getattr(HuellaImagen, f'segmento_{i}')
+        condiciones.append(columna.in_(sorted({valor ^ mascara for mascara in mascaras})))
+
+    consulta = (
+        select(Archivo.id, Archivo.ruta, Archivo.nombre_original, Archivo.referencias,
+               Archivo.fecha_hora_registro, HuellaImagen.hash)
+        .join(HuellaImagen, HuellaImagen.archivo_id == Archivo.id)
+        .where(or_(*condiciones))
+    )
+    if excluir_archivo_id is not None:
+        consulta = consulta.where(Archivo.id != excluir_archivo_id)
+
+    similares = []
+    for fila in db.session.execute(consulta):
+        bits = distancia(huella, fila.hash)
+        if bits <= umbral:
+            similares.append({
+                'archivo_id': fila.id,
+                'ruta': fila.ruta,
+                'nombre': fila.nombre_original,
+                'referencias': fila.referencias,
+                'fecha': fila.fecha_hora_registro.strftime('%Y-%m-%d %H:%M') if fila.fecha_hora_registro else None,
+                'distancia': bits
+            })
+    similares.sort(key=lambda s: (s['distancia'], s['archivo_id']))
+    return similares[:limite]
+
+
+def duplicados_de(ruta, umbral=None, limite=20):
+    """Posibles duplicados de un archivo ya guardado. None si aún no tiene huella"""
+    archivo = Archivo.query.filter_by(ruta=ruta).first()
+    if archivo is None or archivo.huella is None:
+        return None
+    return buscar_similares(
+        archivo.huella.hash & _MASCARA_64, umbral, excluir_archivo_id=archivo.id, limite=limite
+    )
+
+
+def encolar_huella(ruta, usuario_id=None):
+    """Encola el cálculo de la huella sin confirmar la sesión (igual que encolar_variantes)"""
+    from app.services.tarea_service import encolar
+    if not admite_huella(ruta):
+        return None
+    return encolar('huella_imagen', {'ruta': ruta}, usuario_id=usuario_id, confirmar=False)
+
+
+def calcular_pendientes(tamano_lote=100, avance=None):
+    """
+    Calcula las huellas de las imágenes de documentos que aún no la tienen.
+    Retorna {'calculadas': n, 'errores': n}
+    """
+    resumen = {'calculadas': 0, 'errores': 0}
+    ultimo_id = 0
+    while True:
+        archivos = (
+            Archivo.query
+            .outerjoin(HuellaImagen)
+            .filter(Archivo.cifrado.is_(True), HuellaImagen.id.is_(None), Archivo.id > ultimo_id)
+            .order_by(Archivo.id)
+            .limit(tamano_lote)
+            .all()
+        )
+        if not archivos:
+            return resumen
+
+        for archivo in archivos:
+            if not admite_huella(archivo.ruta):
+                continue
+            try:
+                if registrar_huella(archivo) is not None:
+                    resumen['calculadas'] += 1
+            except Exception as e:
+                resumen['errores'] += 1
+                current_app.logger.warning(f"Huella de {archivo.ruta}: {e}")
+        ultimo_id = archivos[-1].id
+        db.session.commit()
+        if avance:
+            avance(resumen)
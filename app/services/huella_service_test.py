@@ -0,0 +1,83 @@
+"""
+Pruebas de huella_service: búsqueda multi-índice en los límites del umbral
+"""
+from math import comb
+
+import pytest
+
+from app import create_app, db
+from app.config import TestingConfig
+from app.models import Archivo, HuellaImagen
+from app.services.huella_service import (
+    BITS_SEGMENTO, SEGMENTOS, UMBRAL_MAXIMO, _con_signo, _mascaras, _segmentos, buscar_similares, distancia
+)
+
+
+BASE = 0xF00D_CAFE_1234_8001  # Bit 63 encendido: se guarda como BIGINT negativo
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path / "pruebas.db"}')
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_ENGINE_OPTIONS', {})
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def voltear(huella, bits):
+    """
+    Cambia `bits` bits repartidos por igual entre los segmentos: el peor caso
+    para la búsqueda, ningún segmento queda con menos de bits // 4 diferencias
+    """
+    for k in range(bits):
+        huella ^= 1 << ((k % SEGMENTOS) * BITS_SEGMENTO + k // SEGMENTOS)
+    return huella
+
+
+def guardar(huella):
+    """Archivo con su huella, igual que registrar_huella"""
+    numero = Archivo.query.count() + 1
+    archivo = Archivo(sha256=f'{numero:064x}', ruta=f'documentos/{numero}.jpg.enc', tamano=1,
+                      extension='jpg', referencias=1, cifrado=True)
+    registro = HuellaImagen(archivo=archivo, hash=_con_signo(huella))
+    for i, valor in enumerate(_segmentos(huella)):
+        setattr(registro, f'segmento_{i}', valor)
+    db.session.add(archivo)
+    db.session.commit()
+    return archivo
+
+
+def test_mascaras():
+    for radio in range(UMBRAL_MAXIMO // SEGMENTOS + 1):
+        mascaras = _mascaras(radio)
+        assert len(set(mascaras)) == sum(comb(BITS_SEGMENTO, k) for k in range(radio + 1))
+        assert all(bin(m).count('1') <= radio for m in mascaras)
+
+
+@pytest.mark.parametrize('umbral', range(UMBRAL_MAXIMO + 1))
+def test_limite_del_umbral(app, umbral):
+    en_limite = guardar(voltear(BASE, umbral))
+    guardar(voltear(BASE, umbral + 1))
+    assert distancia(BASE, voltear(BASE, umbral + 1)) == umbral + 1
+
+    similares = buscar_similares(BASE, umbral)
+
+    assert [(s['archivo_id'], s['distancia']) for s in similares] == [(en_limite.id, umbral)]
+
+
+def test_ordena_por_distancia_y_excluye(app):
+    lejos = guardar(voltear(BASE, 6))
+    igual = guardar(BASE)
+    cerca = guardar(voltear(BASE, 1))
+
+    assert [s['archivo_id'] for s in buscar_similares(BASE, 8)] == [igual.id, cerca.id, lejos.id]
+    assert [s['archivo_id'] for s in buscar_similares(BASE, 8, excluir_archivo_id=igual.id)] == [cerca.id, lejos.id]
+
+
+@pytest.mark.parametrize('umbral', [-1, UMBRAL_MAXIMO + 1])
+def test_umbral_fuera_de_rango(app, umbral):
+    with pytest.raises(ValueError):
+        buscar_similares(BASE, umbral)
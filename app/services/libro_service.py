@@ -0,0 +1,300 @@
+"""
+Libro Service - Libro de rentabilidad por vehículo y semana
+
+LibroVehiculoSemana resume, por vehículo y semana (lunes a domingo), lo que el
+vehículo generó (detalles semanales) y lo que se gastó en él (trabajos y piezas
+usadas). Los reportes de rentabilidad y los estados de cuenta de propietarios
+leen solo del libro, así que un rango de fechas es una consulta indexada.
+
+Se mantiene solo: al final de cada flush se recalculan las semanas de los
+vehículos afectados por cambios en DetalleAlquilerSemanal, SemanaAlquiler,
+TrabajoVehiculo y PiezaUsada. Cada semana se recalcula desde las tablas de
+origen (no se suman diferencias), así que repetirlo no acumula error. Lo que
+no pasa por el ORM (UPDATE masivos, cambios a mano) se corrige con
+recalcular_semanas_alquiler o `flask reconstruir-libro`.
+"""
+from datetime import timedelta
+from decimal import Decimal
+from itertools import chain
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+from app import db
+from app.models import (
+    DetalleAlquilerSemanal, LibroVehiculoSemana, PiezaUsada, SemanaAlquiler, TrabajoVehiculo, Vehiculo
+)
+
+
+CERO = Decimal('0.00')
+MONTOS = ('ingreso', 'nomina_empresa', 'descuentos', 'inversion_mecanica', 'costo_trabajos', 'costo_piezas')
+
+# Atributos que, al cambiar, afectan al libro
+_ATRIBUTOS = {
+    DetalleAlquilerSemanal: ('vehiculo_id', 'semana_alquiler_id', 'propietario_id', 'ingreso_calculado',
+                             'nomina_empresa', 'monto_descuento', 'inversion_mecanica'),
+    TrabajoVehiculo: ('vehiculo_id', 'fecha_inicio', 'costo', 'estado'),
+    PiezaUsada: ('trabajo_id', 'cantidad', 'costo_unitario'),
+    SemanaAlquiler: ('fecha_inicio',),
+}
+
+
+def inicio_semana(fecha):
+    """Lunes de la semana de `fecha`"""
+    return fecha - timedelta(days=fecha.weekday())
+
+
+# ==================== RECÁLCULO ====================
+
+def _sumas(stmt, conexion):
+    return {fila[0]: fila[1:] for fila in conexion.execute(stmt)}
+
+
+def recalcular_semana(semana, vehiculos=None, conexion=None):
+    """
+    Recalcula las filas del libro de la semana que empieza el lunes `semana`,
+    para los `vehiculos` indicados o para todos
+    """
+    conexion = conexion or db.session.connection()
+    fin = semana + timedelta(days=7)
+    D, T = DetalleAlquilerSemanal, TrabajoVehiculo
+
+    def filtrar(stmt, columna_vehiculo):
+        return stmt.where(columna_vehiculo.in_(list(vehiculos))) if vehiculos is not None else stmt
+
+    detalles = _sumas(filtrar(
+        select(
+            D.vehiculo_id, func.max(D.propietario_id), func.sum(D.ingreso_calculado), func.sum(D.nomina_empresa),
+            func.sum(D.monto_descuento), func.sum(D.inversion_mecanica)
+        )
+        .join(SemanaAlquiler, D.semana_alquiler_id == SemanaAlquiler.id)
+        .where(SemanaAlquiler.fecha_inicio >= semana, SemanaAlquiler.fecha_inicio < fin)
+        .group_by(D.vehiculo_id), D.vehiculo_id
+    ), conexion)
+
+    en_semana = (T.fecha_inicio >= semana, T.fecha_inicio < fin, T.estado != 'cancelado')
+    trabajos = _sumas(filtrar(
+        select(T.vehiculo_id, func.sum(T.costo)).where(*en_semana).group_by(T.vehiculo_id), T.vehiculo_id
+    ), conexion)
+    piezas = _sumas(filtrar(
+        select(T.vehiculo_id, func.sum(PiezaUsada.cantidad * PiezaUsada.costo_unitario))
+        .join(PiezaUsada, PiezaUsada.trabajo_id == T.id)
+        .where(*en_semana).group_by(T.vehiculo_id), T.vehiculo_id
+    ), conexion)
+
+    ids = set(detalles) | set(trabajos) | set(piezas)
+    # El propietario del detalle de esa semana; si solo hubo gastos, el actual del vehículo
+    propietarios = dict(conexion.execute(
+        select(Vehiculo.id, Vehiculo.propietario_id).where(Vehiculo.id.in_(list(ids - set(detalles))))
+    ).all()) if ids - set(detalles) else {}
+
+    filas = []
+    for vehiculo_id in ids:
+        propietario_id, ingreso, nomina, descuentos, inversion = detalles.get(vehiculo_id, (None,) + (CERO,) * 4)
+        filas.append({
+            'vehiculo_id': vehiculo_id,
+            'propietario_id': propietario_id or propietarios.get(vehiculo_id),
+            'semana_inicio': semana,
+            'ingreso': ingreso or CERO,
+            'nomina_empresa': nomina or CERO,
+            'descuentos': descuentos or CERO,
+            'inversion_mecanica': inversion or CERO,
+            'costo_trabajos': (trabajos.get(vehiculo_id) or (CERO,))[0] or CERO,
+            'costo_piezas': (piezas.get(vehiculo_id) or (CERO,))[0] or CERO,
+        })
+
+    tabla = LibroVehiculoSemana.__table__
+    conexion.execute(filtrar(delete(tabla).where(tabla.c.semana_inicio == semana), tabla.c.vehiculo_id))
+    filas = [f for f in filas if f['propietario_id'] is not None]
+    if filas:
+        conexion.execute(insert(tabla), filas)
+    return len(filas)
+
+
+def recalcular_semanas_alquiler(semana_ids):
+    """Recalcula el libro de las semanas de alquiler indicadas (tras un UPDATE masivo de detalles)"""
+    fechas = db.session.execute(
+        select(SemanaAlquiler.fecha_inicio).where(SemanaAlquiler.id.in_(list(semana_ids)))
+    ).scalars().all() if semana_ids else []
+    for semana in {inicio_semana(f) for f in fechas}:
+        recalcular_semana(semana)
+
+
+def reconstruir_libro(desde=None, hasta=None, avance=None):
+    """
+    Recalcula el libro semana por semana entre `desde` y `hasta` (por defecto,
+    todo el historial), con un commit por semana. Retorna las semanas recalculadas
+    """
+    if desde is None or hasta is None:
+        fechas = [
+            db.session.scalar(select(agregado(columna)))
+            for agregado in (func.min, func.max)
+            for columna in (SemanaAlquiler.fecha_inicio, TrabajoVehiculo.fecha_inicio)
+        ]
+        minimos = [f for f in fechas[:2] if f]
+        maximos = [f for f in fechas[2:] if f]
+        if not minimos:
+            return 0
+        desde = desde or min(minimos)
+        hasta = hasta or max(maximos)
+
+    semana = inicio_semana(desde)
+    semanas = 0
+    while semana <= hasta:
+        filas = recalcular_semana(semana)
+        db.session.commit()
+        semanas += 1
+        if avance:
+            avance(semana, filas)
+        semana += timedelta(days=7)
+    return semanas
+
+
+# ==================== EVENTOS ====================
+
+def _valores(obj, atributo, solo_cambios):
+    historia = inspect(obj).attrs[atributo].history
+    if solo_cambios and not historia.has_changes():
+        return set()
+    return {v for v in chain(historia.added, historia.unchanged, historia.deleted) if v is not None}
+
+
+def _cambio(obj, session):
+    """True si el objeto es nuevo, se borra o cambió algún atributo que afecta al libro"""
+    if obj not in session.dirty:
+        return True
+    return any(_valores(obj, atributo, True) for atributo in _ATRIBUTOS[type(obj)])
+
+
+@event.listens_for(Session, 'after_flush')
+def _marcar_semanas(session, contexto):
+    """Anota qué semanas de qué vehículos recalcular al terminar el flush"""
+    claves = set()  # (vehiculo_id, fecha)
+    semanas = set()  # (vehiculo_id, semana_alquiler_id)
+    trabajos = set()  # trabajo_id de piezas
+    completas = set()  # fechas de semanas de alquiler borradas o movidas
+
+    for obj in chain(session.new, session.deleted, session.dirty):
+        tipo = type(obj)
+        if tipo not in _ATRIBUTOS or not _cambio(obj, session):
+            continue
+        if tipo is DetalleAlquilerSemanal:
+            for vehiculo_id in _valores(obj, 'vehiculo_id', False):
+                semanas.update((vehiculo_id, s) for s in _valores(obj, 'semana_alquiler_id', False))
+        elif tipo is TrabajoVehiculo:
+            for vehiculo_id in _valores(obj, 'vehiculo_id', False):
+                claves.update((vehiculo_id, f) for f in _valores(obj, 'fecha_inicio', False))
+        elif tipo is PiezaUsada:
+            trabajos |= _valores(obj, 'trabajo_id', False)
+        elif obj in session.deleted or obj in session.dirty:
+            completas |= _valores(obj, 'fecha_inicio', False)
+
+    if claves or semanas or trabajos or completas:
+        pendientes = session.info.setdefault('libro_pendiente', {
+            'claves': set(), 'semanas': set(), 'trabajos': set(), 'completas': set()
+        })
+        pendientes['claves'] |= claves
+        pendientes['semanas'] |= semanas
+        pendientes['trabajos'] |= trabajos
+        pendientes['completas'] |= completas
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _recalcular_libro(session, contexto):
+    pendientes = session.info.pop('libro_pendiente', None)
+    if not pendientes:
+        return
+
+    conexion = session.connection()
+    claves = set(pendientes['claves'])
+    if pendientes['semanas']:
+        fechas = dict(conexion.execute(
+            select(SemanaAlquiler.id, SemanaAlquiler.fecha_inicio)
+            .where(SemanaAlquiler.id.in_(list({s for _, s in pendientes['semanas']})))
+        ).all())
+        claves |= {(v, fechas[s]) for v, s in pendientes['semanas'] if s in fechas}
+    if pendientes['trabajos']:
+        claves |= {tuple(fila) for fila in conexion.execute(
+            select(TrabajoVehiculo.vehiculo_id, TrabajoVehiculo.fecha_inicio)
+            .where(TrabajoVehiculo.id.in_(list(pendientes['trabajos'])))
+        )}
+
+    completas = {inicio_semana(f) for f in pendientes['completas']}
+    por_semana = {}
+    for vehiculo_id, fecha in claves:
+        semana = inicio_semana(fecha)
+        if semana not in completas:
+            por_semana.setdefault(semana, set()).add(vehiculo_id)
+
+    for semana in completas:
+        recalcular_semana(semana, conexion=conexion)
+    for semana, vehiculos in por_semana.items():
+        recalcular_semana(semana, vehiculos, conexion)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_libro(session):
+    session.info.pop('libro_pendiente', None)
+
+
+# ==================== REPORTES ====================
+
+def _totales(filas):
+    totales = {campo: sum((f[campo] for f in filas), CERO) for campo in MONTOS}
+    totales['ingreso_propietario'] = totales['ingreso'] - totales['nomina_empresa']
+    totales['gastos'] = totales['costo_trabajos'] + totales['costo_piezas']
+    totales['balance'] = totales['ingreso_propietario'] - totales['gastos']
+    return totales
+
+
+def rentabilidad(desde, hasta, propietario_id=None, vehiculo_id=None):
+    """
+    Rentabilidad por vehículo entre dos fechas (semanas que empiezan en el rango).
+    Retorna [{'vehiculo_id', 'propietario_id', 'semanas', <montos>, 'ingreso_propietario',
+    'gastos', 'balance'}] ordenado por balance, de mayor a menor.
+    """
+    L = LibroVehiculoSemana
+    stmt = (
+        select(L.vehiculo_id, func.max(L.propietario_id), func.count(L.id), *[func.sum(getattr(L, m)) for m in MONTOS])
+        .where(L.semana_inicio >= inicio_semana(desde), L.semana_inicio <= hasta)
+        .group_by(L.vehiculo_id)
+    )
+    if propietario_id:
+        stmt = stmt.where(L.propietario_id == propietario_id)
+    if vehiculo_id:
+        stmt = stmt.where(L.vehiculo_id == vehiculo_id)
+
+    resultado = []
+    for fila in db.session.execute(stmt):
+        datos = {'vehiculo_id': fila[0], 'propietario_id': fila[1], 'semanas': fila[2]}
+        montos = dict(zip(MONTOS, (v or CERO for v in fila[3:])))
+        datos.update(montos)
+        datos.update({k: v for k, v in _totales([montos]).items() if k not in MONTOS})
+        resultado.append(datos)
+    resultado.sort(key=lambda d: d['balance'], reverse=True)
+    return resultado
+
+
+def estado_cuenta_propietario(propietario_id, desde, hasta):
+    """
+    Estado de cuenta de un propietario: sus filas del libro (vehículo y semana)
+    entre dos fechas y los totales. Retorna {'movimientos': [...], 'totales': {...}}
+    """
+    L = LibroVehiculoSemana
+    filas = db.session.execute(
+        select(L.vehiculo_id, L.semana_inicio, *[getattr(L, m) for m in MONTOS])
+        .where(L.propietario_id == propietario_id,
+               L.semana_inicio >= inicio_semana(desde), L.semana_inicio <= hasta)
+        .order_by(L.semana_inicio, L.vehiculo_id)
+    ).all()
+
+    movimientos = []
+    for fila in filas:
+        montos = dict(zip(MONTOS, fila[2:]))
+        movimientos.append({
+            'vehiculo_id': fila.vehiculo_id,
+            'semana_inicio': fila.semana_inicio,
+            **montos,
+            'ingreso_propietario': montos['ingreso'] - montos['nomina_empresa'],
+            'gastos': montos['costo_trabajos'] + montos['costo_piezas'],
+        })
+    return {'movimientos': movimientos, 'totales': _totales([dict(zip(MONTOS, f[2:])) for f in filas])}
@@ -0,0 +1,223 @@
+"""
+Limpieza Service - Recolección de archivos huérfanos en /static/uploads
+
+Un archivo queda huérfano cuando la transacción falla después de `file.save()`
+o cuando una eliminación no llegó a borrar el archivo. El proceso:
+
+1. Arma el conjunto de rutas referenciadas leyendo solo las columnas de rutas
+   (las cifradas se descifran con en_claro).
+2. Recorre el árbol de uploads en una sola pasada, sin cargar el listado
+   completo en memoria (os.scandir en disco local, listado paginado en S3).
+3. Mueve a cuarentena (o elimina) los archivos no referenciados con más
+   antigüedad que el período de gracia, para no tocar subidas en curso.
+
+Pensado para ejecutarse con `flask limpiar-archivos` (cron) o como tarea
+`limpiar_archivos` en la cola.
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update, delete
+from app import db
+from app.models import (
+    Propietario, Inquilino, GaranteInquilino, ReferenciaInquilino,
+    VehiculoImagen, VehiculoMarcaModelo, Banco, Archivo, Subida, en_claro
+)
+from app.services.almacenamiento_service import almacenamiento
+from app.services.media_service import VARIANTES
+
+
+MODOS = ('simular', 'cuarentena', 'eliminar')
+TAMANO_LOTE = 1000
+
+COLUMNAS_PLANAS = (
+    (VehiculoImagen, ('ruta', 'ruta_miniatura', 'ruta_display')),
+    (VehiculoMarcaModelo, ('logo_path',)),
+    (Banco, ('logo_path',)),
+)
+
+COLUMNAS_CIFRADAS = (
+    (Propietario, ('cedula_path', 'licencia_path', 'documento_buena_conducta_path')),
+    (Inquilino, ('cedula_path', 'licencia_path', 'documento_buena_conducta_path')),
+    (GaranteInquilino, ('cedula_path', 'documento_referencia_laboral_path')),
+    (ReferenciaInquilino, ('cedula_path',)),
+)
+
+
+def _valores(modelo, atributos):
+    """Itera los valores no nulos de las columnas indicadas, en lotes"""
+    columnas = [getattr(modelo, atributo) for atributo in atributos]
+    filas = db.session.execute(
+        select(*columnas).execution_options(yield_per=TAMANO_LOTE)
+    )
+    for fila in filas:
+        for valor in fila:
+            if valor:
+                yield en_claro(valor)
+
+
+def rutas_referenciadas():
+    """
+    Counter {ruta: campos que la usan} con todas las columnas de rutas.
+    Un dato cifrado ilegible detiene el proceso: sin él no se sabe qué archivo es seguro borrar.
+    """
+    referencias = Counter()
+
+    for modelo, atributos in COLUMNAS_PLANAS:
+        referencias.update(_valores(modelo, atributos))
+
+    # Temporales de subidas por bloques aún activas
+    activa_desde = datetime.utcnow() - timedelta(hours=current_app.config.get('SUBIDA_EXPIRACION_HORAS', 48))
+    referencias.update(db.session.execute(
+        select(Subida.ruta_temporal)
+        .where(Subida.estado == 'en_curso', Subida.ruta_temporal.isnot(None),
+               Subida.fecha_hora_actualizo >= activa_desde)
+    ).scalars())
+
+    for modelo, atributos in COLUMNAS_CIFRADAS:
+        referencias.update(_valores(modelo, atributos))
+
+    return referencias
+
+
+def _base(ruta):
+    return ruta.rsplit('.', 1)[0]
+
+
+def _es_variante_de(ruta, bases):
+    """True si la ruta es una variante (__miniatura / __display) de una ruta referenciada"""
+    nombre, separador, resto = ruta.rpartition('__')
+    return bool(separador) and resto.split('.', 1)[0] in VARIANTES and nombre in bases
+
+
+def _ruta_de_subida(ruta):
+    """Partes de una subida por partes (disco local): <ruta_temporal>.partes/<id>/<n>"""
+    return ruta.split('.partes/', 1)[0] if '.partes/' in ruta else None
+
+
+def corregir_referencias(referencias, corte):
+    """
+    Ajusta `archivos.referencias` al conteo real de campos. Los registros sin
+    ningún campo se eliminan (su archivo queda huérfano y se recoge en la misma
+    pasada). Se ignoran los registros modificados después de `corte`.
+    """
+    corregidos = 0
+    eliminados = []
+    filas = db.session.execute(
+        select(Archivo.id, Archivo.ruta, Archivo.referencias)
+        .where(Archivo.fecha_hora_actualizo < corte)
+    ).all()
+
+    for archivo_id, ruta, actuales in filas:
+        reales = referencias.get(ruta, 0)
+        if reales == actuales:
+            continue
+        if reales == 0:
+            eliminados.append(archivo_id)
+        else:
+            db.session.execute(
+                update(Archivo)
+                .where(Archivo.id == archivo_id)
+                .values(referencias=reales)
+                .execution_options(synchronize_session=False)
+            )
+        corregidos += 1
+
+    for inicio in range(0, len(eliminados), TAMANO_LOTE):
+        db.session.execute(
+            delete(Archivo)
+            .where(Archivo.id.in_(eliminados[inicio:inicio + TAMANO_LOTE]))
+            .execution_options(synchronize_session=False)
+        )
+    return corregidos
+
+
+def _en_uso_reciente(ruta, corte):
+    """Un archivo del almacén reutilizado después de armar las referencias no se toca"""
+    return db.session.execute(
+        select(Archivo.id).where(Archivo.ruta == ruta, Archivo.fecha_hora_actualizo >= corte)
+    ).first() is not None
+
+
+def limpiar_archivos(modo='cuarentena', gracia_horas=None, avance=None):
+    """
+    Recoge los archivos huérfanos de /static/uploads.
+    modo: 'simular' (solo reporta), 'cuarentena' (los mueve) o 'eliminar'.
+    Retorna un resumen con archivos revisados, huérfanos y bytes recuperados.
+    """
+    if modo not in MODOS:
+        raise ValueError(f'Modo inválido: {modo}')
+
+    gracia_horas = gracia_horas if gracia_horas is not None else current_app.config.get('LIMPIEZA_GRACIA_HORAS', 24)
+    inicio = datetime.utcnow()
+    corte = inicio - timedelta(hours=gracia_horas)
+    corte_mtime = datetime.now().timestamp() - gracia_horas * 3600
+
+    backend = almacenamiento()
+    lote = inicio.strftime('%Y%m%d_%H%M%S')
+
+    if avance:
+        avance(5, 'Leyendo referencias')
+    referencias = rutas_referenciadas()
+    bases = {_base(ruta) for ruta in referencias}
+
+    resumen = {
+        'modo': modo,
+        'referencias': len(referencias),
+        'archivos_revisados': 0,
+        'huerfanos': 0,
+        'bytes_recuperados': 0,
+        'referencias_corregidas': 0,
+        'faltantes': 0,
+        'errores': 0,
+        'cuarentena': lote if modo == 'cuarentena' else None
+    }
+
+    try:
+        if modo != 'simular':
+            resumen['referencias_corregidas'] = corregir_referencias(referencias, corte)
+            db.session.commit()
+
+        if avance:
+            avance(20, 'Recorriendo uploads')
+        encontrados = set()
+        for ruta, tamano, mtime in backend.listar('uploads/'):
+            resumen['archivos_revisados'] += 1
+
+            if ruta in referencias:
+                encontrados.add(ruta)
+                continue
+            if _es_variante_de(ruta, bases) or _ruta_de_subida(ruta) in referencias:
+                continue
+            if mtime >= corte_mtime or _en_uso_reciente(ruta, corte):
+                continue
+
+            resumen['huerfanos'] += 1
+            resumen['bytes_recuperados'] += tamano
+            if modo == 'simular':
+                continue
+            try:
+                if modo == 'eliminar':
+                    backend.eliminar(ruta)
+                else:
+                    backend.cuarentena(ruta, lote)
+            except Exception as e:
+                resumen['errores'] += 1
+                resumen['bytes_recuperados'] -= tamano
+                current_app.logger.error(f"Error al limpiar {ruta}: {e}")
+
+        # Referencias a archivos que ya no existen (solo se reportan)
+        faltantes = [ruta for ruta in referencias if ruta.startswith('uploads/') and ruta not in encontrados]
+        resumen['faltantes'] = len(faltantes)
+        if faltantes:
+            current_app.logger.warning(
+                f"{len(faltantes)} rutas referenciadas sin archivo, p. ej.: {', '.join(faltantes[:5])}"
+            )
+
+        resumen['duracion_segundos'] = round((datetime.utcnow() - inicio).total_seconds(), 1)
+        return resumen
+
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,143 @@
+"""
+Media Service - Variantes redimensionadas de imágenes subidas
+
+Las fotos llegan del teléfono a resolución completa. Al subirlas se encola una
+tarea `variantes_imagen` que genera, junto al original:
+
+    <nombre>__miniatura.webp   (máx. 480 px, listas y tarjetas)
+    <nombre>__display.webp     (máx. 1600 px, galerías y visor)
+
+y guarda sus rutas en VehiculoImagen.ruta_miniatura / ruta_display: las vistas
+leen esas columnas en vez de consultar el almacenamiento.
+
+Se usa WebP cuando Pillow lo soporta y JPEG progresivo si no.
+Pillow es opcional: sin él no se generan variantes y se sirve el original.
+"""
+import os
+from io import BytesIO
+
+from flask import current_app
+from app.services.almacenamiento_service import almacenamiento
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow es opcional
+    Image = None
+
+
+VARIANTES = {
+    'miniatura': 480,
+    'display': 1600
+}
+EXTENSIONES_IMAGEN = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+CALIDAD = 80
+
+
+def tipo_por_contenido(cabecera):
+    """
+    ('imagen' | 'video', extensión) según los primeros bytes del archivo,
+    o (None, None) si no es un formato de media reconocido
+    """
+    if cabecera.startswith(b'\xff\xd8\xff'):
+        return 'imagen', 'jpg'
+    if cabecera.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'imagen', 'png'
+    if cabecera[:6] in (b'GIF87a', b'GIF89a'):
+        return 'imagen', 'gif'
+    if cabecera[:4] == b'RIFF' and cabecera[8:12] == b'WEBP':
+        return 'imagen', 'webp'
+    if cabecera[4:8] == b'ftyp':
+        return 'video', 'mp4'
+    return None, None
+
+
+def es_imagen(ruta):
+    """True si la ruta corresponde a una imagen que admite variantes"""
+    return bool(ruta) and '.' in ruta and ruta.rsplit('.', 1)[1].lower() in EXTENSIONES_IMAGEN
+
+
+def _formato_salida():
+    """('WEBP', 'webp') si Pillow tiene soporte WebP, si no ('JPEG', 'jpg')"""
+    if features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+
+def ruta_variante(ruta, variante, extension):
+    """Ruta relativa (a /static) de una variante del archivo"""
+    base, _ = os.path.splitext(ruta)
+    return f'{base}__{variante}.{extension}'
+
+
+def generar_variantes(ruta):
+    """
+    Genera las variantes de una imagen guardada en /static/<ruta>.
+    Retorna {'miniatura': ruta, 'display': ruta} o {} si no aplica.
+    """
+    if Image is None or not es_imagen(ruta):
+        return {}
+
+    formato, extension = _formato_salida()
+    rutas = {variante: ruta_variante(ruta, variante, extension) for variante in VARIANTES}
+
+    backend = almacenamiento()
+
+    # Contenido deduplicado: las variantes pueden existir ya por otra subida idéntica
+    if all(backend.existe(destino) for destino in rutas.values()):
+        return rutas
+
+    with backend.abrir(ruta) as origen:
+        contenido = BytesIO(origen.read())
+
+    with Image.open(contenido) as original:
+        # Respetar la orientación EXIF de las fotos del teléfono
+        imagen = ImageOps.exif_transpose(original)
+        if formato == 'JPEG' or imagen.mode not in ('RGB', 'RGBA'):
+            imagen = imagen.convert('RGB' if formato == 'JPEG' else 'RGBA')
+
+        for variante, lado_maximo in VARIANTES.items():
+            copia = imagen.copy()
+            copia.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+
+            destino = rutas[variante]
+            opciones = {'quality': CALIDAD}
+            if formato == 'WEBP':
+                opciones['method'] = 4
+            else:
+                opciones.update(optimize=True, progressive=True)
+            salida = BytesIO()
+            copia.save(salida, formato, **opciones)
+            salida.seek(0)
+            backend.guardar(destino, salida)
+
+    return rutas
+
+
+def eliminar_variantes(ruta):
+    """Elimina las variantes existentes de un archivo (en cualquier formato)"""
+    if not ruta:
+        return
+    backend = almacenamiento()
+    for variante in VARIANTES:
+        for extension in ('webp', 'jpg'):
+            destino = ruta_variante(ruta, variante, extension)
+            try:
+                backend.eliminar(destino)
+            except Exception as e:
+                current_app.logger.error(f"Error al eliminar variante {destino}: {e}")
+
+
+def encolar_variantes(ruta=None, imagen_id=None, usuario_id=None):
+    """
+    Encola la generación de variantes sin confirmar la sesión:
+    la tarea se guarda en el mismo commit que el registro que la originó
+    """
+    from app.services.tarea_service import encolar
+    if imagen_id is None and not es_imagen(ruta):
+        return None
+    return encolar(
+        'variantes_imagen',
+        {'ruta': ruta, 'imagen_id': imagen_id},
+        usuario_id=usuario_id,
+        confirmar=False
+    )
@@ -0,0 +1,156 @@
+"""
+Migración Service - Paso de las carpetas planas de uploads al almacén repartido
+
+Antes los archivos se guardaban en carpetas planas (uploads/vehiculos,
+uploads/propietarios, uploads/logos...) que crecen a decenas de miles de
+entradas. Las subidas nuevas ya van al almacén por hash (uploads/archivos/ab/cd/);
+`flask migrar-uploads` mueve las existentes y reescribe sus rutas, incluidas
+las columnas cifradas.
+
+Se procesa por lotes con un punto de control por tabla: si se interrumpe,
+al volver a ejecutarlo continúa desde el último lote confirmado. Las filas
+que ya apuntan al almacén se saltan, así que repetirlo no hace daño.
+Los archivos originales quedan como huérfanos para `flask limpiar-archivos`.
+
+`flask cifrar-documentos` usa el mismo recorrido para cifrar los documentos
+de identidad que se guardaron en claro.
+"""
+from flask import current_app
+from sqlalchemy import select, update
+from app import db
+from app.models import PuntoControl, en_claro
+from app.services.almacen_service import CARPETA, cifrar_existente, importar_archivo, retener_archivo
+from app.services.cifrado_service import es_cifrado
+from app.services.limpieza_service import COLUMNAS_PLANAS, COLUMNAS_CIFRADAS
+
+
+PROCESO = 'migrar_uploads'
+
+
+def punto_control(clave, reiniciar=False):
+    """PuntoControl de `clave` (lo crea o lo reinicia), confirmado"""
+    punto = PuntoControl.query.filter_by(clave=clave).first()
+    if punto is None:
+        punto = PuntoControl(clave=clave, ultimo_id=0, procesados=0, completado=False)
+        db.session.add(punto)
+    elif reiniciar:
+        punto.ultimo_id = 0
+        punto.procesados = 0
+        punto.completado = False
+    db.session.commit()
+    return punto
+
+
+def migrar_tabla(modelo, atributos, convertir, resumen, proceso=PROCESO, tamano_lote=200, reiniciar=False):
+    """
+    Reescribe las rutas de una tabla en lotes confirmados, reanudando desde su
+    punto de control. `convertir(ruta)` retorna la nueva ruta, la misma si no
+    hay nada que hacer o None si el archivo no existe.
+    """
+    punto = punto_control(f'{proceso}:{modelo.__tablename__}', reiniciar)
+    if punto.completado:
+        return
+
+    columnas = [getattr(modelo, atributo) for atributo in atributos]
+    while True:
+        filas = db.session.execute(
+            select(modelo.id, *columnas)
+            .where(modelo.id > punto.ultimo_id)
+            .order_by(modelo.id)
+            .limit(tamano_lote)
+        ).all()
+        if not filas:
+            punto.completado = True
+            db.session.commit()
+            return
+
+        cambios = []
+        for fila in filas:
+            valores = {}
+            for atributo, ruta in zip(atributos, fila[1:]):
+                if not ruta:
+                    continue
+                ruta = en_claro(ruta)
+                nueva = convertir(ruta)
+                if nueva == ruta:
+                    continue
+                if nueva is None:
+                    resumen['faltantes'] += 1
+                    current_app.logger.warning(f"{modelo.__tablename__} {fila[0]}: no existe {ruta}")
+                    continue
+                valores[atributo] = nueva
+
+            if valores:
+                valores['id'] = fila[0]
+                cambios.append(valores)
+
+        if cambios:
+            # Agrupar por columnas presentes: el UPDATE masivo por PK requiere filas homogéneas
+            grupos = {}
+            for valores in cambios:
+                grupos.setdefault(tuple(sorted(valores)), []).append(valores)
+            for grupo in grupos.values():
+                db.session.execute(update(modelo), grupo)
+
+        punto.ultimo_id = filas[-1][0]
+        punto.procesados += len(filas)
+        resumen['rutas'] += sum(len(valores) - 1 for valores in cambios)
+        db.session.commit()
+
+
+def migrar_uploads(tamano_lote=200, reiniciar=False):
+    """
+    Migra todas las columnas de rutas al almacén repartido.
+    Retorna {'archivos': importados, 'rutas': reescritas, 'faltantes': sin archivo}
+    """
+    importados = {}
+    resumen = {'archivos': 0, 'rutas': 0, 'faltantes': 0}
+
+    def importar(ruta):
+        if ruta.startswith(f'{CARPETA}/'):
+            return ruta
+        # El mismo archivo antiguo en varios campos se importa una sola vez
+        nueva = importados.get(ruta)
+        if nueva is not None:
+            retener_archivo(nueva)
+            return nueva
+        nueva = importar_archivo(ruta)
+        if nueva is not None:
+            importados[ruta] = nueva
+            resumen['archivos'] += 1
+        return nueva
+
+    try:
+        # Las columnas cifradas se leen con en_claro y se escriben en claro: las cifra su tipo (EncryptedText)
+        for modelo, atributos in COLUMNAS_PLANAS + COLUMNAS_CIFRADAS:
+            migrar_tabla(modelo, atributos, importar, resumen, tamano_lote=tamano_lote, reiniciar=reiniciar)
+        return resumen
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def cifrar_documentos(tamano_lote=200, reiniciar=False):
+    """
+    Cifra los documentos de identidad guardados en claro (cifrado_service) y
+    reescribe sus rutas. Retorna {'archivos': cifrados, 'rutas': reescritas, 'faltantes': sin archivo}
+    """
+    resumen = {'archivos': 0, 'rutas': 0, 'faltantes': 0}
+
+    def cifrar(ruta):
+        if es_cifrado(ruta):
+            return ruta
+        # Cada referencia libera su copia en claro: no se reutiliza entre campos
+        nueva = cifrar_existente(ruta)
+        if nueva is not None:
+            resumen['archivos'] += 1
+        return nueva
+
+    try:
+        for modelo, atributos in COLUMNAS_CIFRADAS:
+            migrar_tabla(modelo, atributos, cifrar, resumen, proceso='cifrar_documentos',
+                         tamano_lote=tamano_lote, reiniciar=reiniciar)
+        return resumen
+    except Exception:
+        db.session.rollback()
+        raise
@@ -0,0 +1,159 @@
+"""
+Mora Service - Proceso por lotes de mora y penalizaciones
+
+Recalcula en SQL (sin cargar objetos ORM) el estado de mora de los detalles
+semanales no pagados y los días de retraso / penalización de las deudas pendientes.
+Pensado para ejecutarse cada noche con `flask actualizar-mora` (cron).
+
+Los UPDATE se agrupan por fecha límite: todas las filas con la misma fecha
+tienen los mismos días de atraso, así que basta un UPDATE por fecha distinta
+(pocas, una por semana) y el cálculo funciona igual en MySQL y SQLite.
+
+Las semanas cerradas se sirven desde su snapshot, que incluye la mora de cada
+detalle: antes de cada UPDATE se anotan las semanas cerradas con detalles cuyos
+valores de mora van a cambiar, y al terminar se regeneran solo sus snapshots.
+"""
+from datetime import date
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import func, select, update, or_
+from app import db
+from app.models import DetalleAlquilerSemanal, Deuda, SemanaAlquiler
+from app.services.semana_service import regenerar_snapshots
+
+
+def _ejecutar(sentencia):
+    """Ejecuta un UPDATE masivo sin sincronizar la sesión y retorna filas afectadas"""
+    return db.session.execute(
+        sentencia.execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _semanas_cerradas(*condiciones):
+    """Ids de las semanas cerradas con detalles que cumplen `condiciones`"""
+    return set(db.session.execute(
+        select(DetalleAlquilerSemanal.semana_alquiler_id)
+        .join(SemanaAlquiler, SemanaAlquiler.id == DetalleAlquilerSemanal.semana_alquiler_id)
+        .where(SemanaAlquiler.estado == 'cerrada', *condiciones)
+        .distinct()
+    ).scalars())
+
+
+def actualizar_mora_detalles(hoy, penalizacion_diaria, semanas=None):
+    """
+    Actualiza tiene_deuda, en_mora, dias_mora y penalizacion_mora de los detalles semanales.
+    Si se pasa el set `semanas`, agrega los ids de las semanas cerradas con detalles que cambian
+    """
+    D = DetalleAlquilerSemanal
+    semanas = set() if semanas is None else semanas
+
+    # Detalles que ya no están en mora (pagados o aún dentro del plazo): todos cambian
+    condiciones = (
+        or_(D.en_mora.is_(True), D.dias_mora != 0, D.tiene_deuda.is_(True)),
+        or_(D.pago_confirmado.is_(True), D.fecha_limite_pago.is_(None), D.fecha_limite_pago >= hoy)
+    )
+    semanas |= _semanas_cerradas(*condiciones)
+    limpiados = _ejecutar(
+        update(D)
+        .where(*condiciones)
+        .values(tiene_deuda=False, en_mora=False, dias_mora=0, penalizacion_mora=0, fecha_calculo_mora=hoy)
+    )
+
+    vencidos = or_(D.pago_confirmado.is_(False), D.pago_confirmado.is_(None))
+    fechas = db.session.execute(
+        select(D.fecha_limite_pago)
+        .where(vencidos, D.fecha_limite_pago < hoy)
+        .distinct()
+    ).scalars().all()
+
+    en_mora = 0
+    for fecha_limite in fechas:
+        dias = (hoy - fecha_limite).days
+        penalizacion = penalizacion_diaria * dias
+        semanas |= _semanas_cerradas(
+            vencidos, D.fecha_limite_pago == fecha_limite,
+            or_(
+                D.en_mora.isnot(True),
+                D.tiene_deuda.isnot(True),
+                func.coalesce(D.dias_mora, -1) != dias,
+                func.coalesce(D.penalizacion_mora, -1) != penalizacion
+            )
+        )
+        en_mora += _ejecutar(
+            update(D)
+            .where(vencidos, D.fecha_limite_pago == fecha_limite)
+            .values(
+                en_mora=True,
+                tiene_deuda=True,
+                dias_mora=dias,
+                penalizacion_mora=penalizacion,
+                fecha_calculo_mora=hoy
+            )
+        )
+
+    return {'detalles_en_mora': en_mora, 'detalles_limpiados': limpiados}
+
+
+def actualizar_mora_deudas(hoy):
+    """Actualiza dias_retraso y penalizacion_acumulada de las deudas pendientes"""
+    # Pendientes que aún no vencen
+    al_dia = _ejecutar(
+        update(Deuda)
+        .where(Deuda.estado == 'pendiente', Deuda.fecha_vencimiento >= hoy)
+        .values(dias_retraso=0, penalizacion_acumulada=0, fecha_calculo_mora=hoy)
+    )
+
+    fechas = db.session.execute(
+        select(Deuda.fecha_vencimiento)
+        .where(Deuda.estado == 'pendiente', Deuda.fecha_vencimiento < hoy)
+        .distinct()
+    ).scalars().all()
+
+    vencidas = 0
+    for fecha_vencimiento in fechas:
+        dias = (hoy - fecha_vencimiento).days
+        vencidas += _ejecutar(
+            update(Deuda)
+            .where(Deuda.estado == 'pendiente', Deuda.fecha_vencimiento == fecha_vencimiento)
+            .values(
+                dias_retraso=dias,
+                penalizacion_acumulada=Deuda.penalizacion_diaria * dias,
+                fecha_calculo_mora=hoy
+            )
+        )
+
+    return {'deudas_vencidas': vencidas, 'deudas_al_dia': al_dia}
+
+
+def actualizar_moras(hoy=None):
+    """
+    Ejecuta el proceso completo de mora en una sola transacción.
+    Retorna un resumen con las filas afectadas.
+    """
+    hoy = hoy or date.today()
+    penalizacion_diaria = Decimal(str(current_app.config.get('PENALIZACION_DIARIA_MORA', '0.00')))
+
+    try:
+        resumen = {'fecha': hoy.isoformat()}
+        semanas = set()
+        resumen.update(actualizar_mora_detalles(hoy, penalizacion_diaria, semanas))
+        resumen.update(actualizar_mora_deudas(hoy))
+
+        # Los UPDATE masivos no sincronizan la sesión: leer los detalles de nuevo
+        db.session.expire_all()
+        resumen['snapshots_regenerados'] = regenerar_snapshots(semanas)
+        db.session.commit()
+        return resumen
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def limpiar_mora(detalle):
+    """Quita la mora de un detalle al confirmar su pago (sin esperar al proceso nocturno)"""
+    if detalle.pago_confirmado:
+        detalle.tiene_deuda = False
+        detalle.en_mora = False
+        detalle.dias_mora = 0
+        detalle.penalizacion_mora = 0
@@ -0,0 +1,340 @@
+"""
+Nómina Service - Cálculo de nómina en centavos enteros (punto fijo)
+
+Reglas para cada DetalleAlquilerSemanal:
+    ingreso_calculado = precio_semanal / 7 * dias_trabajo
+    nomina_empresa    = ingreso_calculado * porcentaje_empresa / 100
+    nomina_final      = ingreso_calculado + monto_deuda - monto_descuento
+
+Todos los montos se manejan en centavos (int) y los porcentajes en centésimas
+(15.50% -> 1550). Cada división redondea la mitad hacia afuera de cero, igual
+que ROUND_HALF_UP de Decimal, así el resultado es reproducible al centavo.
+Si NumPy está instalado los lotes se calculan con arreglos int64.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import select, update, func
+from app import db
+from app.models import DetalleAlquilerSemanal, SemanaAlquiler
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional
+    np = None
+
+
+DIAS_SEMANA = 7
+CENTESIMAS = 100 * 100  # porcentaje (x100) sobre 100%
+
+
+# ==================== CONVERSIONES ====================
+
+def a_centavos(valor):
+    """Convierte Decimal/str/float/int (o None) a centavos enteros"""
+    if valor is None or valor == '':
+        return 0
+    return int((Decimal(str(valor)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def porcentaje_a_centesimas(valor):
+    """Convierte un porcentaje (15.50) a centésimas enteras (1550)"""
+    return a_centavos(valor)
+
+
+def a_decimal(centavos):
+    """Convierte centavos enteros a Decimal con 2 decimales para columnas Numeric(10, 2)"""
+    return (Decimal(int(centavos)) / 100).quantize(Decimal('0.01'))
+
+
+# ==================== KERNEL ====================
+
+def _dividir(numerador, divisor):
+    """División entera redondeando la mitad hacia afuera de cero (int)"""
+    cociente = (abs(numerador) * 2 + divisor) // (divisor * 2)
+    return -cociente if numerador < 0 else cociente
+
+
+def _dividir_np(numerador, divisor):
+    """Versión vectorizada de _dividir sobre arreglos int64"""
+    cociente = (np.abs(numerador) * 2 + divisor) // (divisor * 2)
+    return np.where(numerador < 0, -cociente, cociente)
+
+
+def calcular_lote(precios, dias, porcentajes, deudas=None, descuentos=None):
+    """
+    Calcula la nómina de muchos detalles en una sola pasada.
+
+    Recibe secuencias paralelas: precios semanales en centavos, días trabajados,
+    porcentajes en centésimas y opcionalmente deudas y descuentos en centavos.
+    Retorna un dict con listas de centavos: ingreso_calculado, nomina_empresa y nomina_final.
+    """
+    total = len(precios)
+    if deudas is None:
+        deudas = [0] * total
+    if descuentos is None:
+        descuentos = [0] * total
+
+    if np is not None:
+        precios = np.asarray(precios, dtype=np.int64)
+        dias = np.asarray(dias, dtype=np.int64)
+        porcentajes = np.asarray(porcentajes, dtype=np.int64)
+        ingresos = _dividir_np(precios * dias, DIAS_SEMANA)
+        nominas = _dividir_np(ingresos * porcentajes, CENTESIMAS)
+        finales = ingresos + np.asarray(deudas, dtype=np.int64) - np.asarray(descuentos, dtype=np.int64)
+        return {
+            'ingreso_calculado': ingresos.tolist(),
+            'nomina_empresa': nominas.tolist(),
+            'nomina_final': finales.tolist()
+        }
+
+    ingresos = [_dividir(p * d, DIAS_SEMANA) for p, d in zip(precios, dias)]
+    return {
+        'ingreso_calculado': ingresos,
+        'nomina_empresa': [_dividir(i * pct, CENTESIMAS) for i, pct in zip(ingresos, porcentajes)],
+        'nomina_final': [i + deuda - desc for i, deuda, desc in zip(ingresos, deudas, descuentos)]
+    }
+
+
+def calcular_nomina(precio_semanal, dias_trabajo, porcentaje, monto_deuda=0, monto_descuento=0):
+    """Calcula la nómina de un solo detalle y retorna los montos como Decimal"""
+    resultado = calcular_lote(
+        [a_centavos(precio_semanal)],
+        [int(dias_trabajo or 0)],
+        [porcentaje_a_centesimas(porcentaje)],
+        [a_centavos(monto_deuda)],
+        [a_centavos(monto_descuento)]
+    )
+    return {campo: a_decimal(valores[0]) for campo, valores in resultado.items()}
+
+
+def aplicar_nomina(detalles):
+    """Recalcula en lote los campos de nómina de objetos DetalleAlquilerSemanal"""
+    if not detalles:
+        return
+    resultado = calcular_lote(
+        [a_centavos(d.precio_semanal) for d in detalles],
+        [int(d.dias_trabajo or 0) for d in detalles],
+        [porcentaje_a_centesimas(d.porcentaje_empresa) for d in detalles],
+        [a_centavos(d.monto_deuda) for d in detalles],
+        [a_centavos(d.monto_descuento) for d in detalles]
+    )
+    for i, detalle in enumerate(detalles):
+        detalle.ingreso_calculado = a_decimal(resultado['ingreso_calculado'][i])
+        detalle.nomina_empresa = a_decimal(resultado['nomina_empresa'][i])
+        detalle.nomina_final = a_decimal(resultado['nomina_final'][i])
+
+
+# ==================== TOTALES DE SEMANA ====================
+
+def totalizar_semana(semana):
+    """Recalcula los totales de una semana con agregados SQL exactos"""
+    db.session.flush()
+    total_vehiculos, total_socios, total_inquilinos, ingreso_total = db.session.query(
+        func.count(DetalleAlquilerSemanal.id),
+        func.count(func.distinct(DetalleAlquilerSemanal.propietario_id)),
+        func.count(func.distinct(DetalleAlquilerSemanal.inquilino_id)),
+        func.coalesce(func.sum(DetalleAlquilerSemanal.ingreso_calculado), 0)
+    ).filter(DetalleAlquilerSemanal.semana_alquiler_id == semana.id).one()
+
+    semana.total_vehiculos = total_vehiculos
+    semana.total_socios = total_socios
+    semana.total_inquilinos = total_inquilinos
+    semana.ingreso_total = ingreso_total
+
+
+def totalizar_semanas(semana_ids):
+    """Recalcula los totales de varias semanas con un solo UPDATE por subconsultas correlacionadas"""
+    if not semana_ids:
+        return 0
+
+    def _agregado(expresion):
+        return select(expresion).where(
+            DetalleAlquilerSemanal.semana_alquiler_id == SemanaAlquiler.id
+        ).scalar_subquery()
+
+    resultado = db.session.execute(
+        update(SemanaAlquiler)
+        .where(SemanaAlquiler.id.in_(list(semana_ids)))
+        .values(
+            total_vehiculos=_agregado(func.count(DetalleAlquilerSemanal.id)),
+            total_socios=_agregado(func.count(func.distinct(DetalleAlquilerSemanal.propietario_id))),
+            total_inquilinos=_agregado(func.count(func.distinct(DetalleAlquilerSemanal.inquilino_id))),
+            ingreso_total=_agregado(func.coalesce(func.sum(DetalleAlquilerSemanal.ingreso_calculado), 0))
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount
+
+
+# ==================== RECÁLCULO MASIVO ====================
+
+def recalcular_detalles(condiciones=(), aplicar=True, porcentaje=None, tamano_lote=2000):
+    """
+    Recalcula la nómina de todos los detalles que cumplen `condiciones`
+    sin cargar objetos ORM: lee columnas por lotes (keyset sobre id),
+    calcula cada lote con el kernel y escribe solo las filas que cambian.
+    Si se indica `porcentaje`, se aplica como nuevo porcentaje_empresa.
+
+    Retorna (cambios, semana_ids). Cada cambio es un dict con id, semana_alquiler_id
+    y los valores anteriores/nuevos en centavos. Con aplicar=False no escribe nada.
+    """
+    columnas = (
+        DetalleAlquilerSemanal.id,
+        DetalleAlquilerSemanal.semana_alquiler_id,
+        DetalleAlquilerSemanal.precio_semanal,
+        DetalleAlquilerSemanal.dias_trabajo,
+        DetalleAlquilerSemanal.porcentaje_empresa,
+        DetalleAlquilerSemanal.monto_deuda,
+        DetalleAlquilerSemanal.monto_descuento,
+        DetalleAlquilerSemanal.ingreso_calculado,
+        DetalleAlquilerSemanal.nomina_empresa,
+        DetalleAlquilerSemanal.nomina_final
+    )
+    campos = ('ingreso_calculado', 'nomina_empresa', 'nomina_final')
+    if porcentaje is not None:
+        campos += ('porcentaje_empresa',)
+        centesimas = porcentaje_a_centesimas(porcentaje)
+
+    cambios = []
+    semana_ids = set()
+    ultimo_id = 0
+    while True:
+        filas = db.session.execute(
+            select(*columnas)
+            .where(DetalleAlquilerSemanal.id > ultimo_id, *condiciones)
+            .order_by(DetalleAlquilerSemanal.id)
+            .limit(tamano_lote)
+        ).all()
+        if not filas:
+            break
+        ultimo_id = filas[-1].id
+
+        resultado = calcular_lote(
+            [a_centavos(f.precio_semanal) for f in filas],
+            [int(f.dias_trabajo or 0) for f in filas],
+            [porcentaje_a_centesimas(f.porcentaje_empresa) if porcentaje is None else centesimas
+             for f in filas],
+            [a_centavos(f.monto_deuda) for f in filas],
+            [a_centavos(f.monto_descuento) for f in filas]
+        )
+        if porcentaje is not None:
+            resultado['porcentaje_empresa'] = [centesimas] * len(filas)
+
+        actualizaciones = []
+        for i, fila in enumerate(filas):
+            anteriores = {campo: a_centavos(getattr(fila, campo)) for campo in campos}
+            nuevos = {campo: resultado[campo][i] for campo in campos}
+            if anteriores == nuevos:
+                continue
+            cambios.append({
+                'id': fila.id,
+                'semana_alquiler_id': fila.semana_alquiler_id,
+                'anterior': anteriores,
+                'nuevo': nuevos
+            })
+            semana_ids.add(fila.semana_alquiler_id)
+            actualizaciones.append(
+                {'id': fila.id, **{campo: a_decimal(valor) for campo, valor in nuevos.items()}}
+            )
+
+        if aplicar and actualizaciones:
+            # ORM bulk UPDATE por clave primaria (executemany, sin instanciar objetos)
+            db.session.execute(update(DetalleAlquilerSemanal), actualizaciones)
+
+    if aplicar:
+        from app.services.libro_service import recalcular_semanas_alquiler
+        totalizar_semanas(semana_ids)
+        # El UPDATE masivo no dispara los eventos del ORM que mantienen el libro
+        recalcular_semanas_alquiler(semana_ids)
+    return cambios, semana_ids
+
+
+def recalcular_semanas(anio=None, semana_ids=None):
+    """
+    Recalcula la nómina de las semanas indicadas (o de todas) y confirma en una transacción.
+    Los snapshots de semanas cerradas afectadas se regeneran para que sigan coincidiendo.
+    """
+    from app.services.semana_service import crear_snapshot_semana
+
+    condiciones = []
+    if semana_ids:
+        condiciones.append(DetalleAlquilerSemanal.semana_alquiler_id.in_(list(semana_ids)))
+    if anio:
+        condiciones.append(DetalleAlquilerSemanal.semana_alquiler_id.in_(
+            select(SemanaAlquiler.id).where(SemanaAlquiler.anio == anio)
+        ))
+
+    try:
+        cambios, afectadas = recalcular_detalles(condiciones)
+        if afectadas:
+            # Los UPDATE masivos no sincronizan objetos ya cargados en la sesión
+            db.session.expire_all()
+            for semana in SemanaAlquiler.query.filter(
+                SemanaAlquiler.id.in_(list(afectadas)),
+                SemanaAlquiler.estado == 'cerrada'
+            ).all():
+                crear_snapshot_semana(semana)
+        db.session.commit()
+        return len(cambios), len(afectadas)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+# ==================== RE-PRECIO POR PORCENTAJE ====================
+
+def condiciones_porcentaje(porcentaje_id, alcance='abiertas', desde=None, hasta=None):
+    """
+    Filtro de detalles de las semanas que usan un porcentaje de ganancia.
+    alcance='abiertas' toma solo semanas abiertas; alcance='rango' toma las semanas
+    no canceladas cuya fecha_inicio cae entre `desde` y `hasta`.
+    """
+    semanas = select(SemanaAlquiler.id).where(SemanaAlquiler.porcentaje_ganancia_id == porcentaje_id)
+    if alcance == 'rango':
+        semanas = semanas.where(SemanaAlquiler.estado != 'cancelada')
+        if desde:
+            semanas = semanas.where(SemanaAlquiler.fecha_inicio >= desde)
+        if hasta:
+            semanas = semanas.where(SemanaAlquiler.fecha_inicio <= hasta)
+    else:
+        semanas = semanas.where(SemanaAlquiler.estado == 'abierta')
+    return [DetalleAlquilerSemanal.semana_alquiler_id.in_(semanas)]
+
+
+def repreciar_porcentaje(porcentaje, alcance='abiertas', desde=None, hasta=None, aplicar=False, limite_vista=200):
+    """
+    Aplica el valor actual de un PorcentajeGanancia a los detalles de su alcance.
+    Con aplicar=False solo arma la vista previa (diff) sin escribir. No hace commit.
+    """
+    from app.services.semana_service import crear_snapshot_semana
+
+    cambios, semana_ids = recalcular_detalles(
+        condiciones_porcentaje(porcentaje.id, alcance, desde, hasta),
+        aplicar=aplicar,
+        porcentaje=porcentaje.porcentaje
+    )
+
+    if aplicar and semana_ids:
+        db.session.expire_all()
+        for semana in SemanaAlquiler.query.filter(
+            SemanaAlquiler.id.in_(list(semana_ids)),
+            SemanaAlquiler.estado == 'cerrada'
+        ).all():
+            crear_snapshot_semana(semana)
+
+    diferencia = sum(c['nuevo']['nomina_empresa'] - c['anterior']['nomina_empresa'] for c in cambios)
+    return {
+        'aplicado': aplicar,
+        'total_detalles': len(cambios),
+        'total_semanas': len(semana_ids),
+        'diferencia_nomina_empresa': float(a_decimal(diferencia)),
+        'cambios': [
+            {
+                'id': c['id'],
+                'semana_alquiler_id': c['semana_alquiler_id'],
+                'anterior': {campo: float(a_decimal(v)) for campo, v in c['anterior'].items()},
+                'nuevo': {campo: float(a_decimal(v)) for campo, v in c['nuevo'].items()}
+            }
+            for c in cambios[:limite_vista]
+        ]
+    }
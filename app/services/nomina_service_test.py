@@ -0,0 +1,81 @@
+"""
+Pruebas de nomina_service: redondeo de a_centavos y paridad del kernel
+entre NumPy y Python puro (ambos deben coincidir con ROUND_HALF_UP de Decimal)
+"""
+import random
+from decimal import Decimal, ROUND_HALF_UP
+
+import pytest
+
+from app.services import nomina_service
+from app.services.nomina_service import CENTESIMAS, DIAS_SEMANA, a_centavos, calcular_lote
+
+
+def redondear(numerador, divisor):
+    """Referencia: división con Decimal y ROUND_HALF_UP"""
+    return int((Decimal(numerador) / Decimal(divisor)).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def casos():
+    """Lotes con mitades exactas, negativos y valores al azar"""
+    precios, dias, porcentajes = [], [], []
+    # ingreso * porcentaje cae justo en .5 de centavo
+    for ingreso in (1, 3, -1, -3, 12345, -12345):
+        precios.append(ingreso * DIAS_SEMANA)
+        dias.append(1)
+        porcentajes.append(CENTESIMAS // 2)
+    azar = random.Random(27)
+    for _ in range(2000):
+        precios.append(azar.randint(-500000, 5000000))
+        dias.append(azar.randint(0, DIAS_SEMANA))
+        porcentajes.append(azar.randint(0, CENTESIMAS))
+    deudas = [azar.randint(0, 100000) for _ in precios]
+    descuentos = [azar.randint(0, 100000) for _ in precios]
+    return precios, dias, porcentajes, deudas, descuentos
+
+
+def esperado(precios, dias, porcentajes, deudas, descuentos):
+    ingresos = [redondear(p * d, DIAS_SEMANA) for p, d in zip(precios, dias)]
+    return {
+        'ingreso_calculado': ingresos,
+        'nomina_empresa': [redondear(i * pct, CENTESIMAS) for i, pct in zip(ingresos, porcentajes)],
+        'nomina_final': [i + deuda - desc for i, deuda, desc in zip(ingresos, deudas, descuentos)]
+    }
+
+
+@pytest.mark.parametrize('valor, centavos', [
+    (None, 0),
+    ('', 0),
+    ('0.005', 1),
+    ('-0.005', -1),
+    ('1.005', 101),
+    ('0.004', 0),
+    (2.675, 268),  # el float se convierte vía str, no por su valor binario
+    (Decimal('10.50'), 1050),
+    (7, 700),
+])
+def test_a_centavos_redondea_mitad_hacia_afuera(valor, centavos):
+    assert a_centavos(valor) == centavos
+
+
+def test_calcular_lote_python_puro(monkeypatch):
+    monkeypatch.setattr(nomina_service, 'np', None)
+    lote = casos()
+    assert calcular_lote(*lote) == esperado(*lote)
+
+
+def test_calcular_lote_numpy():
+    pytest.importorskip('numpy')
+    assert nomina_service.np is not None
+    lote = casos()
+    assert calcular_lote(*lote) == esperado(*lote)
+
+
+def test_mitades_exactas_en_ambos_caminos(monkeypatch):
+    precios, dias, porcentajes = [7, 21, -7, -21], [1] * 4, [CENTESIMAS // 2] * 4
+    con_numpy = calcular_lote(precios, dias, porcentajes)
+    monkeypatch.setattr(nomina_service, 'np', None)
+    sin_numpy = calcular_lote(precios, dias, porcentajes)
+
+    assert sin_numpy['nomina_empresa'] == [1, 2, -1, -2]
+    assert con_numpy == sin_numpy
@@ -0,0 +1,198 @@
+"""
+Proyección Service - Columnas que carga cada listado
+
+Cada columna cifrada que se trae de MySQL cuesta transferencia y un descifrado
+Fernet por fila. Las voluminosas de Vehiculo (descripcion, condiciones) están
+diferidas en el modelo; estas opciones indican a cada listado exactamente qué
+columnas traer, para no mover ni descifrar lo que no se muestra:
+
+    Vehiculo.query.options(*vehiculo_selector()).all()
+
+Son funciones (no constantes) porque las relaciones por backref solo existen
+después de configurar los mappers.
+
+Las APIs JSON aceptan además `?fields=id,nombre_apellido` (campos a pedido):
+solo se cargan, descifran y devuelven las columnas de los campos pedidos.
+"""
+from flask import request
+from sqlalchemy.orm import joinedload, load_only, undefer_group
+from app.services.descifrado_service import leer_descifrado
+from app.models import (
+    decrypt_data, Inquilino, Propietario, Vehiculo, VehiculoMarcaModelo
+)
+
+
+def _con_marca():
+    return joinedload(Vehiculo.marca_modelo).load_only(VehiculoMarcaModelo.marca, VehiculoMarcaModelo.modelo)
+
+
+def vehiculo_selector():
+    """Selects de formularios (crear trabajo, alquiler): id, placa y marca/modelo"""
+    return (
+        load_only(Vehiculo.id, Vehiculo.placa, Vehiculo.marca_modelo_vehiculo_id),
+        _con_marca(),
+    )
+
+
+def vehiculo_resumen():
+    """APIs de listado y búsqueda: sin descripción, condiciones ni disponibilidad"""
+    return (
+        load_only(Vehiculo.id, Vehiculo.placa, Vehiculo.ano, Vehiculo.color,
+                  Vehiculo.precio_semanal, Vehiculo.marca_modelo_vehiculo_id),
+        _con_marca(),
+    )
+
+
+def vehiculo_completo():
+    """Listados que muestran la descripción: el grupo diferido en la misma consulta"""
+    return (undefer_group('detalle'),)
+
+
+def propietario_selector():
+    """Selects de formularios: id y nombre"""
+    return (load_only(Propietario.id, Propietario.nombre_apellido),)
+
+
+def propietario_busqueda():
+    """Búsqueda de propietarios: nombre, cédula, teléfono y cantidad de vehículos"""
+    return (load_only(Propietario.id, Propietario.nombre_apellido, Propietario.cedula, Propietario.telefono,
+                      Propietario.vehiculos_count),)
+
+
+def propietario_resumen():
+    """API de propietarios: todo salvo la dirección"""
+    return (load_only(
+        Propietario.id, Propietario.nombre_apellido, Propietario.cedula, Propietario.licencia,
+        Propietario.telefono, Propietario.email, Propietario.cedula_path, Propietario.licencia_path,
+        Propietario.documento_buena_conducta_path, Propietario.vehiculos_count, Propietario.referencias_count
+    ),)
+
+
+# ==================== CAMPOS A PEDIDO (?fields=) ====================
+
+class CamposInvalidos(ValueError):
+    """?fields= con campos que el endpoint no ofrece (se responde 400)"""
+
+
+def campo(*columnas, valor=None, opciones=()):
+    """
+    Campo de una API: columnas que necesita, función que lo calcula a partir de
+    la fila y opciones extra de carga. Sin `valor`, es el atributo de la columna.
+    """
+    if valor is None:
+        nombre = columnas[0].key
+        valor = lambda obj: getattr(obj, nombre)
+    return columnas, valor, opciones
+
+
+def campos_pedidos(disponibles, por_defecto):
+    """
+    Nombres de campos de `?fields=` (en orden, sin repetir) o `por_defecto` si no viene.
+    Lanza CamposInvalidos si alguno no está en `disponibles`.
+    """
+    parametro = request.args.get('fields', '').strip()
+    if not parametro:
+        return list(por_defecto)
+    campos = list(dict.fromkeys(c.strip() for c in parametro.split(',') if c.strip()))
+    invalidos = [c for c in campos if c not in disponibles]
+    if invalidos:
+        raise CamposInvalidos(
+            f"Campos no válidos: {', '.join(invalidos)}. Disponibles: {', '.join(disponibles)}"
+        )
+    return campos
+
+
+def opciones_campos(modelo, disponibles, campos):
+    """load_only con las columnas de los campos pedidos (siempre el id) y sus opciones extra"""
+    columnas = {'id': modelo.id}
+    extra = []
+    for nombre in campos:
+        cols, _, opciones = disponibles[nombre]
+        columnas.update((col.key, col) for col in cols)
+        extra.extend(opciones)
+    return (load_only(*columnas.values()), *extra)
+
+
+def leer_campos(modelo, disponibles, campos, consulta=None):
+    """
+    Como Modelo.query.options(*opciones_campos(...)), pero sin instancias ORM y
+    con el descifrado en lote (descifrado_service): para listados grandes. Solo
+    sirve para campos sin opciones de carga (sin relaciones)
+    """
+    columnas = {'id': modelo.id}
+    for nombre in campos:
+        columnas.update((col.key, col) for col in disponibles[nombre][0])
+    return leer_descifrado(list(columnas.values()), consulta)
+
+
+def serializar(obj, disponibles, campos):
+    return {nombre: disponibles[nombre][1](obj) for nombre in campos}
+
+
+def placa_legible(vehiculo):
+    """La placa se guarda cifrada dos veces (encrypt_data + EncryptedText)"""
+    if not vehiculo.placa:
+        return None
+    try:
+        return decrypt_data(vehiculo.placa)
+    except Exception:
+        return vehiculo.placa  # Si falla, usar texto plano
+
+
+def _documento(columna):
+    nombre = columna.key
+    return campo(columna, valor=lambda obj: bool(getattr(obj, nombre)))
+
+
+def campos_inquilino():
+    return {
+        'id': campo(Inquilino.id),
+        'nombre_apellido': campo(Inquilino.nombre_apellido),
+        'cedula': campo(Inquilino.cedula),
+        'licencia': campo(Inquilino.licencia),
+        'telefono': campo(Inquilino.telefono),
+        'email': campo(Inquilino.email),
+        'direccion': campo(Inquilino.direccion),
+        'cedula_path': campo(Inquilino.cedula_path),
+        'licencia_path': campo(Inquilino.licencia_path),
+        'documento_buena_conducta_path': campo(Inquilino.documento_buena_conducta_path),
+    }
+
+
+def campos_propietario():
+    return {
+        'id': campo(Propietario.id),
+        'nombre_apellido': campo(Propietario.nombre_apellido),
+        'cedula': campo(Propietario.cedula),
+        'licencia': campo(Propietario.licencia),
+        'telefono': campo(Propietario.telefono),
+        'email': campo(Propietario.email),
+        'direccion': campo(Propietario.direccion),
+        'tiene_cedula_doc': _documento(Propietario.cedula_path),
+        'tiene_licencia_doc': _documento(Propietario.licencia_path),
+        'tiene_buena_conducta_doc': _documento(Propietario.documento_buena_conducta_path),
+        'vehiculos_count': campo(Propietario.vehiculos_count),
+        'referencias_count': campo(Propietario.referencias_count),
+        'alquileres_activos_count': campo(Propietario.alquileres_activos_count),
+    }
+
+
+def campos_vehiculo():
+    marca = (Vehiculo.marca_modelo_vehiculo_id,)
+    return {
+        'id': campo(Vehiculo.id),
+        'placa': campo(Vehiculo.placa, valor=placa_legible),
+        'marca': campo(*marca, valor=lambda v: v.marca_modelo.marca, opciones=(_con_marca(),)),
+        'modelo': campo(*marca, valor=lambda v: v.marca_modelo.modelo, opciones=(_con_marca(),)),
+        'marca_modelo_vehiculo_id': campo(Vehiculo.marca_modelo_vehiculo_id),
+        'propietario_id': campo(Vehiculo.propietario_id),
+        'ano': campo(Vehiculo.ano),
+        'color': campo(Vehiculo.color),
+        'descripcion': campo(Vehiculo.descripcion),
+        'precio_semanal': campo(
+            Vehiculo.precio_semanal,
+            valor=lambda v: float(v.precio_semanal) if v.precio_semanal is not None else None
+        ),
+        'condiciones': campo(Vehiculo.condiciones),
+        'disponible': campo(Vehiculo.disponible),
+    }
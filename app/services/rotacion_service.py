@@ -0,0 +1,270 @@
+"""
+Rotación Service - Recifrado en línea de las columnas cifradas con una clave nueva
+
+Procedimiento para cambiar la clave:
+
+    1. Generar una clave nueva (python app/generate_key.py)
+    2. Configurar FERNET_KEY=<nueva> y FERNET_KEYS_ANTERIORES=<anterior> y desplegar:
+       la aplicación cifra con la nueva y sigue leyendo lo cifrado con la anterior.
+       Si INDICES_KEY no está configurada, fijarla con la clave anterior: los HMAC
+       consultables se calcularon con ella y no se recalculan al rotar
+    3. Ejecutar `flask rotate-keys` (se puede interrumpir y volver a ejecutar)
+    4. Cuando termine sin valores ilegibles, quitar la clave anterior de FERNET_KEYS_ANTERIORES
+
+El recifrado recorre cada tabla por id en lotes, con un punto de control por
+tabla. Después recifra los documentos .enc del almacén (su clave AES-GCM se
+deriva de FERNET_KEY, ver cifrado_service): cada uno se descifra con la clave
+que lo abra y se vuelve a cifrar con la actual en un temporal que reemplaza
+al original en la misma ruta. El descifrado/cifrado corre en un pool de procesos y la escritura es un
+UPDATE por columna y lote (executemany) condicionado al valor leído: si un
+usuario modificó la fila mientras tanto, su valor ya va con la clave nueva y
+no se pisa. Cada lote es una transacción corta y entre lotes se hace una pausa,
+así que puede correr con la aplicación en uso.
+"""
+import hashlib
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from flask import current_app
+from sqlalchemy import Text, and_, bindparam, select, type_coerce, update
+from app import db
+from app.models import (
+    claves_fernet, Archivo, Propietario, ReferenciaPropietario, Inquilino, GaranteInquilino,
+    ReferenciaInquilino, Vehiculo
+)
+from app.services.almacenamiento_service import almacenamiento
+from app.services.cifrado_service import DocumentoCorrupto, LectorCifrado, cifrar_stream, clave_documentos
+from app.services.migracion_service import punto_control
+
+
+PROCESO = 'rotate_keys'
+
+# (modelo, columnas cifradas con Fernet). Se leen y escriben como Text para
+# trabajar sobre el token y no sobre el valor que descifra EncryptedText
+COLUMNAS_ROTACION = [
+    (Propietario, ['nombre_apellido', 'documento_buena_conducta_path', 'cedula', 'cedula_path',
+                   'licencia', 'licencia_path', 'direccion', 'telefono', 'email']),
+    (ReferenciaPropietario, ['nombre_apellido', 'telefono']),
+    (Inquilino, ['nombre_apellido', 'direccion', 'telefono', 'email', 'documento_buena_conducta_path',
+                 'cedula', 'cedula_path', 'licencia', 'licencia_path']),
+    (GaranteInquilino, ['nombre_apellido', 'direccion', 'telefono', 'email', 'cedula',
+                        'cedula_path', 'documento_referencia_laboral_path']),
+    (ReferenciaInquilino, ['nombre_apellido', 'telefono', 'cedula', 'cedula_path']),
+    (Vehiculo, ['placa', 'ano', 'color', 'descripcion', 'precio_semanal', 'condiciones', 'disponible']),
+]
+
+
+# ==================== TRABAJO EN LOS PROCESOS DEL POOL ====================
+
+_primaria = None
+_multi = None
+
+
+def _iniciar_proceso(claves):
+    """Inicializador de cada proceso del pool: construye los ciphers una sola vez"""
+    global _primaria, _multi
+    _primaria = Fernet(claves[0])
+    _multi = MultiFernet([Fernet(k) for k in claves])
+
+
+def recifrar_filas(filas):
+    """
+    Recibe [(id, valor, valor, ...)] y retorna [(id, {indice: (viejo, nuevo)})]
+    solo con los valores que no estaban cifrados con la clave actual.
+    Un valor ilegible con todas las claves se reporta con nuevo=None.
+    """
+    resultado = []
+    for fila in filas:
+        cambios = {}
+        for indice, valor in enumerate(fila[1:]):
+            if not valor:
+                continue
+            token = valor.encode()
+            try:
+                _primaria.decrypt(token)
+                continue  # Ya está con la clave actual
+            except InvalidToken:
+                pass
+            try:
+                cambios[indice] = (valor, _multi.rotate(token).decode())
+            except InvalidToken:
+                cambios[indice] = (valor, None)
+        if cambios:
+            resultado.append((fila[0], cambios))
+    return resultado
+
+
+# ==================== PROCESO PRINCIPAL ====================
+
+def _escribir(modelo, atributos, recifradas):
+    """UPDATE por columna (executemany), solo donde el valor sigue siendo el leído"""
+    tabla = modelo.__table__
+    escritas = 0
+    for indice, atributo in enumerate(atributos):
+        columna = getattr(modelo, atributo).property.columns[0]
+        crudo = type_coerce(columna, Text)
+        parametros = [
+            {'b_id': fila_id, 'b_viejo': cambios[indice][0], 'b_nuevo': cambios[indice][1]}
+            for fila_id, cambios in recifradas
+            if indice in cambios and cambios[indice][1] is not None
+        ]
+        if not parametros:
+            continue
+        db.session.execute(
+            update(tabla)
+            .where(and_(tabla.c.id == bindparam('b_id'), crudo == bindparam('b_viejo', type_=Text)))
+            .values({columna.name: bindparam('b_nuevo', type_=Text)}),
+            parametros
+        )
+        escritas += len(parametros)
+    return escritas
+
+
+def rotar_tabla(modelo, atributos, version, pool, partes, resumen, tamano_lote, pausa,
+                reiniciar=False, avance=None):
+    """
+    Recifra una tabla en lotes confirmados, reanudando desde su punto de control.
+    Cada lote se reparte en `partes` tramos entre los procesos del pool
+    """
+    punto = punto_control(f'{PROCESO}:{version}:{modelo.__tablename__}', reiniciar)
+    if punto.completado:
+        return
+
+    columnas = [type_coerce(getattr(modelo, atributo), Text) for atributo in atributos]
+    while True:
+        filas = [tuple(fila) for fila in db.session.execute(
+            select(modelo.id, *columnas)
+            .where(modelo.id > punto.ultimo_id)
+            .order_by(modelo.id)
+            .limit(tamano_lote)
+        )]
+        if not filas:
+            punto.completado = True
+            db.session.commit()
+            return
+
+        if pool is None:
+            recifradas = recifrar_filas(filas)
+        else:
+            tramo = -(-len(filas) // partes)
+            recifradas = []
+            for parcial in pool.map(recifrar_filas, [filas[i:i + tramo] for i in range(0, len(filas), tramo)]):
+                recifradas.extend(parcial)
+
+        for fila_id, cambios in recifradas:
+            for indice, (_, nuevo) in cambios.items():
+                if nuevo is None:
+                    resumen['ilegibles'] += 1
+                    current_app.logger.error(
+                        f"{modelo.__tablename__} {fila_id}: {atributos[indice]} no se pudo descifrar con ninguna clave"
+                    )
+
+        resumen['valores'] += _escribir(modelo, atributos, recifradas)
+        punto.ultimo_id = filas[-1][0]
+        punto.procesados += len(filas)
+        resumen['filas'] += len(filas)
+        db.session.commit()
+
+        if avance:
+            avance(modelo.__tablename__, resumen)
+        if pausa:
+            time.sleep(pausa)
+
+
+def recifrar_documento(backend, ruta, clave):
+    """Recifra un documento .enc con `clave` si usa una anterior. True si lo reescribió"""
+    try:
+        with LectorCifrado(backend.abrir(ruta), clave=clave) as lector:
+            lector.read(1)
+        return False  # Ya está con la clave actual
+    except DocumentoCorrupto:
+        pass
+
+    temporal = os.path.join(backend.carpeta_temporal(), f'rotacion_{uuid.uuid4().hex}.tmp')
+    try:
+        with LectorCifrado(backend.abrir(ruta)) as lector, open(temporal, 'wb') as salida:
+            cifrar_stream(lector, salida, clave)
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    backend.guardar_desde_archivo(ruta, temporal)
+    return True
+
+
+def rotar_documentos(version, resumen, tamano_lote, pausa, reiniciar=False, avance=None):
+    """Recifra los documentos cifrados del almacén en lotes, reanudando desde su punto de control"""
+    punto = punto_control(f'{PROCESO}:{version}:documentos', reiniciar)
+    if punto.completado:
+        return
+
+    backend = almacenamiento()
+    clave = clave_documentos()
+    while True:
+        filas = db.session.execute(
+            select(Archivo.id, Archivo.ruta)
+            .where(Archivo.cifrado.is_(True), Archivo.id > punto.ultimo_id)
+            .order_by(Archivo.id)
+            .limit(tamano_lote)
+        ).all()
+        if not filas:
+            punto.completado = True
+            db.session.commit()
+            return
+
+        for archivo_id, ruta in filas:
+            try:
+                if recifrar_documento(backend, ruta, clave):
+                    resumen['documentos'] += 1
+            except Exception as e:
+                # Sin ninguna clave válida o sin archivo: se reporta y se sigue con el resto
+                resumen['ilegibles'] += 1
+                current_app.logger.error(f"Documento {archivo_id} ({ruta}) no se pudo recifrar: {str(e)}")
+
+        punto.ultimo_id = filas[-1][0]
+        punto.procesados += len(filas)
+        db.session.commit()
+
+        if avance:
+            avance('documentos', resumen)
+        if pausa:
+            time.sleep(pausa)
+
+
+def rotar_claves(tamano_lote=None, procesos=None, pausa=None, reiniciar=False, avance=None):
+    """
+    Recifra con FERNET_KEY todas las columnas cifradas y los documentos .enc que
+    aún usan una clave anterior. procesos=0 hace el trabajo criptográfico de las
+    columnas en el proceso actual. Retorna {'filas': revisadas, 'valores':
+    recifrados, 'documentos': recifrados, 'ilegibles': sin clave válida}
+    """
+    config = current_app.config
+    tamano_lote = tamano_lote or config.get('ROTACION_LOTE', 500)
+    pausa = config.get('ROTACION_PAUSA', 0.2) if pausa is None else pausa
+    claves = claves_fernet()
+    resumen = {'filas': 0, 'valores': 0, 'documentos': 0, 'ilegibles': 0}
+
+    # Los puntos de control son por clave: una rotación posterior empieza de cero
+    version = hashlib.sha256(claves[0]).hexdigest()[:12]
+
+    _iniciar_proceso(claves)
+    pool = None
+    partes = procesos or os.cpu_count() or 1
+    if procesos != 0:
+        pool = ProcessPoolExecutor(max_workers=partes, initializer=_iniciar_proceso, initargs=(claves,))
+
+    try:
+        for modelo, atributos in COLUMNAS_ROTACION:
+            rotar_tabla(modelo, atributos, version, pool, partes, resumen, tamano_lote, pausa,
+                        reiniciar, avance)
+        rotar_documentos(version, resumen, tamano_lote, pausa, reiniciar, avance)
+        return resumen
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown()
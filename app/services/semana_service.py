@@ -0,0 +1,281 @@
+"""
+Semana Service - Serialización, exportación y snapshots de semanas de alquiler
+"""
+import gzip
+import hashlib
+import json
+from io import BytesIO
+
+from flask import current_app
+from sqlalchemy import func
+from app import db
+from app.models import (
+    SemanaAlquiler, DetalleAlquilerSemanal, SnapshotSemana,
+    Vehiculo, VehiculoMarcaModelo, Inquilino, Propietario, Banco, TrabajoVehiculo
+)
+from app.services.descifrado_service import leer_descifrado
+
+
+EXCEL_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _relacionados(detalles):
+    """
+    Vehículos (con marca y modelo), inquilinos y propietarios de los detalles como
+    {id: fila}: una consulta por tabla, con las columnas cifradas descifradas en lote
+    """
+    def por_id(modelo, columnas, atributo, unir=None):
+        ids = {getattr(d, atributo) for d in detalles if getattr(d, atributo)}
+        if not ids:
+            return {}
+
+        def consulta(q):
+            return (unir(q) if unir else q).where(modelo.id.in_(ids))
+        return {fila.id: fila for fila in leer_descifrado([modelo.id, *columnas], consulta)}
+
+    vehiculos = por_id(
+        Vehiculo, [Vehiculo.placa, VehiculoMarcaModelo.marca, VehiculoMarcaModelo.modelo], 'vehiculo_id',
+        lambda q: q.outerjoin(VehiculoMarcaModelo, Vehiculo.marca_modelo_vehiculo_id == VehiculoMarcaModelo.id)
+    )
+    inquilinos = por_id(Inquilino, [Inquilino.nombre_apellido, Inquilino.telefono], 'inquilino_id')
+    propietarios = por_id(Propietario, [Propietario.nombre_apellido], 'propietario_id')
+    return vehiculos, inquilinos, propietarios
+
+
+def _inversiones(semana):
+    """{detalle_id: costo de sus trabajos} de toda la semana en una sola consulta agrupada"""
+    return dict(
+        db.session.query(DetalleAlquilerSemanal.id, func.sum(TrabajoVehiculo.costo))
+        .join(TrabajoVehiculo, DetalleAlquilerSemanal.trabajo_vehiculo_id == TrabajoVehiculo.id)
+        .filter(DetalleAlquilerSemanal.semana_alquiler_id == semana.id)
+        .group_by(DetalleAlquilerSemanal.id)
+        .all()
+    )
+
+
+def serializar_semana(semana):
+    """Retorna los datos de la semana tal como los entrega ver_detalles_semana"""
+    detalles = DetalleAlquilerSemanal.query.filter_by(
+        semana_alquiler_id=semana.id
+    ).all()
+
+    vehiculos, inquilinos, propietarios = _relacionados(detalles)
+    inversiones = _inversiones(semana)
+
+    detalles_data = []
+    for detalle in detalles:
+        try:
+            vehiculo = vehiculos.get(detalle.vehiculo_id)
+            inquilino = inquilinos.get(detalle.inquilino_id)
+            propietario = propietarios.get(detalle.propietario_id)
+
+            # Get iniciales propietario
+            iniciales = '??'
+            propietario_nombre = ''
+            if propietario:
+                propietario_nombre = propietario.nombre_apellido or ''
+                nombre_parts = propietario_nombre.split() if propietario_nombre else ['?']
+                iniciales = ''.join([p[0].upper() for p in nombre_parts[:2]])
+
+            # Get datos del vehículo
+            vehiculo_marca = ''
+            vehiculo_modelo_str = ''
+            vehiculo_placa = ''
+            if vehiculo:
+                vehiculo_placa = vehiculo.placa or ''
+                vehiculo_marca = vehiculo.marca or ''
+                vehiculo_modelo_str = vehiculo.modelo or ''
+
+            # Get datos del inquilino
+            inquilino_nombre = ''
+            inquilino_telefono = ''
+            if inquilino:
+                inquilino_nombre = inquilino.nombre_apellido or ''
+                inquilino_telefono = inquilino.telefono or ''
+
+            inversiones_totales = inversiones.get(detalle.id) or 0
+
+            detalles_data.append({
+                'id': detalle.id,
+                'vehiculo_id': detalle.vehiculo_id,
+                'inquilino_id': detalle.inquilino_id,
+                'propietario_id': detalle.propietario_id,
+                'propietario_nombre': propietario_nombre,
+                'propietario_iniciales': iniciales,
+                'vehiculo_marca': vehiculo_marca,
+                'vehiculo_modelo': vehiculo_modelo_str,
+                'vehiculo_placa': vehiculo_placa,
+                'inquilino_nombre': inquilino_nombre,
+                'inquilino_telefono': inquilino_telefono,
+                'precio_semanal': float(detalle.precio_semanal),
+                'dias_trabajo': detalle.dias_trabajo,
+                'ingreso_calculado': float(detalle.ingreso_calculado),
+                'inversion_mecanica': float(detalle.inversion_mecanica or 0),
+                'inversiones_totales': float(inversiones_totales),
+                'concepto_inversion': detalle.concepto_inversion or '',
+                'monto_descuento': float(detalle.monto_descuento or 0),
+                'concepto_descuento': detalle.concepto_descuento or '',
+                'nomina_empresa': float(detalle.nomina_empresa),
+                'porcentaje_empresa': float(detalle.porcentaje_empresa),
+                'tiene_deuda': detalle.tiene_deuda,
+                'monto_deuda': float(detalle.monto_deuda or 0),
+                'en_mora': bool(detalle.en_mora),
+                'dias_mora': detalle.dias_mora or 0,
+                'penalizacion_mora': float(detalle.penalizacion_mora or 0),
+                'nomina_final': float(detalle.nomina_final),
+                'banco_id': detalle.banco_id,
+                'fecha_confirmacion_pago': detalle.fecha_confirmacion_pago.isoformat() if detalle.fecha_confirmacion_pago else '',
+                'pago_confirmado': detalle.pago_confirmado,
+                'notas': detalle.notas or ''
+            })
+        except Exception:
+            current_app.logger.exception(f"Error procesando detalle {detalle.id}")
+            continue
+
+    return {
+        'success': True,
+        'semana': {
+            'id': semana.id,
+            'fecha_inicio': semana.fecha_inicio.strftime('%d/%m/%Y'),
+            'fecha_fin': semana.fecha_fin.strftime('%d/%m/%Y'),
+            'total_vehiculos': semana.total_vehiculos,
+            'total_socios': semana.total_socios,
+            'total_inquilinos': semana.total_inquilinos,
+            'ingreso_total': float(semana.ingreso_total)
+        },
+        'detalles': detalles_data
+    }
+
+
+def nombre_excel_semana(semana):
+    """Nombre del archivo Excel exportado para una semana"""
+    return f"semana_{semana.fecha_inicio.strftime('%Y%m%d')}_{semana.fecha_fin.strftime('%Y%m%d')}.xlsx"
+
+
+def generar_excel_semana(semana):
+    """Genera el libro Excel de la semana y retorna sus bytes"""
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill, Alignment
+
+    detalles = DetalleAlquilerSemanal.query.filter_by(semana_alquiler_id=semana.id).all()
+
+    # Create workbook
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = f"Semana {semana.numero_semana}"
+
+    # Header
+    headers = [
+        'Propietario', 'Vehículo', 'Placa', 'Inquilino', 'Tel. Inquilino',
+        'Semanal', 'DT', 'Ingreso', 'Inversión', 'Concepto Desc.',
+        'Nómina', '% Empresa', 'Deuda', 'Nómina 2', 'Banco',
+        'Conf. Pago', 'DT2'
+    ]
+
+    ws.append(headers)
+
+    # Style header
+    for cell in ws[1]:
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+
+    # Add data
+    vehiculos, inquilinos, propietarios = _relacionados(detalles)
+    bancos_ids = {d.banco_id for d in detalles if d.banco_id}
+    bancos = {b.id: b for b in Banco.query.filter(Banco.id.in_(bancos_ids))} if bancos_ids else {}
+    for detalle in detalles:
+        vehiculo = vehiculos.get(detalle.vehiculo_id)
+        inquilino = inquilinos.get(detalle.inquilino_id)
+        propietario = propietarios.get(detalle.propietario_id)
+        banco = bancos.get(detalle.banco_id)
+
+        ws.append([
+            propietario.nombre_apellido if propietario else '',
+            f"{vehiculo.marca} {vehiculo.modelo}" if vehiculo and vehiculo.marca else '',
+            vehiculo.placa if vehiculo else '',
+            inquilino.nombre_apellido if inquilino else '',
+            inquilino.telefono if inquilino else '',
+            float(detalle.precio_semanal),
+            detalle.dias_trabajo,
+            float(detalle.ingreso_calculado),
+            float(detalle.inversion_mecanica or 0),
+            detalle.concepto_descuento or '',
+            float(detalle.nomina_empresa),
+            float(detalle.porcentaje_empresa),
+            float(detalle.monto_deuda or 0),
+            float(detalle.nomina_final),
+            banco.banco if banco else '',
+            detalle.fecha_confirmacion_pago.strftime('%d/%m/%Y') if detalle.fecha_confirmacion_pago else '',
+            detalle.dias_trabajo
+        ])
+
+    # Auto-adjust columns
+    for column in ws.columns:
+        max_length = 0
+        column_letter = column[0].column_letter
+        for cell in column:
+            if cell.value is not None:
+                max_length = max(max_length, len(str(cell.value)))
+        ws.column_dimensions[column_letter].width = min(max_length + 2, 50)
+
+    # Save to BytesIO
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+# ==================== SNAPSHOTS ====================
+
+def crear_snapshot_semana(semana, usuario_id=None):
+    """
+    Congela los datos de una semana cerrada: JSON comprimido con gzip y Excel.
+    No hace commit; el llamador confirma junto con el cambio de estado.
+    """
+    datos = json.dumps(
+        serializar_semana(semana), ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    ).encode('utf-8')
+    excel = generar_excel_semana(semana)
+
+    snapshot = SnapshotSemana.query.filter_by(semana_alquiler_id=semana.id).first()
+    if snapshot is None:
+        snapshot = SnapshotSemana(semana_alquiler_id=semana.id)
+        db.session.add(snapshot)
+
+    # mtime=0 para que el mismo contenido produzca siempre los mismos bytes
+    snapshot.datos_json_gz = gzip.compress(datos, mtime=0)
+    snapshot.excel = excel
+    snapshot.etag = hashlib.sha256(datos).hexdigest()
+    snapshot.etag_excel = hashlib.sha256(excel).hexdigest()
+    snapshot.usuario_registro_id = usuario_id
+    return snapshot
+
+
+def regenerar_snapshots(semana_ids):
+    """
+    Vuelve a generar los snapshots de las semanas cerradas `semana_ids` (cuando un
+    proceso por lotes cambia sus detalles). No hace commit. Retorna cuántos regeneró
+    """
+    if not semana_ids:
+        return 0
+    semanas = SemanaAlquiler.query.filter(
+        SemanaAlquiler.id.in_(list(semana_ids)), SemanaAlquiler.estado == 'cerrada'
+    ).all()
+    for semana in semanas:
+        anterior = SnapshotSemana.query.filter_by(semana_alquiler_id=semana.id).first()
+        crear_snapshot_semana(semana, usuario_id=anterior.usuario_registro_id if anterior else None)
+    return len(semanas)
+
+
+def obtener_snapshot_semana(semana):
+    """Retorna el snapshot de una semana cerrada, o None si no hay uno vigente"""
+    if semana.estado != 'cerrada':
+        return None
+    return SnapshotSemana.query.filter_by(semana_alquiler_id=semana.id).first()
+
+
+def invalidar_snapshot_semana(semana):
+    """Elimina el snapshot de la semana (al reabrirla). No hace commit."""
+    return SnapshotSemana.query.filter_by(
+        semana_alquiler_id=semana.id
+    ).delete(synchronize_session='fetch')
@@ -0,0 +1,157 @@
+"""
+Sombra Service - Copias consultables de precio y disponibilidad de Vehiculo
+
+precio_semanal y disponible se guardan cifrados con Fernet: no se pueden
+sumar, filtrar ni indexar en SQL. Cada vehículo guarda además una copia
+"sombra" indexada, según la política configurada:
+
+    SOMBRA_PRECIO       'claro'  precio exacto en precio_indice
+                        'tramo'  precio redondeado hacia abajo a PRECIO_TRAMO
+                                 (el filtro por rango se afina en Python)
+    SOMBRA_DISPONIBLE   'claro'  '1' / '0' en disponible_indice
+                        'hmac'   HMAC-SHA256 de '1' / '0' (clave derivada de INDICES_KEY)
+
+Un HMAC de dos valores posibles solo evita que el valor se lea a simple vista
+en la base; quien vea la tabla sigue pudiendo agrupar los vehículos en dos
+conjuntos. Las sombras se recalculan en cada INSERT/UPDATE de Vehiculo;
+`flask rellenar-sombras` las completa para las filas existentes.
+"""
+import hashlib
+import hmac
+from decimal import Decimal, InvalidOperation, ROUND_FLOOR
+
+from flask import current_app
+from sqlalchemy import event, func, select, update
+from app import db
+from app.models import Vehiculo, en_claro
+from app.services.cifrado_service import clave_indices
+from app.services.migracion_service import punto_control
+
+
+PROCESO = 'rellenar_sombras'
+
+
+def _politica():
+    config = current_app.config
+    return config.get('SOMBRA_PRECIO', 'claro'), config.get('SOMBRA_DISPONIBLE', 'claro')
+
+
+def _decimal(valor):
+    if valor is None or valor == '':
+        return None
+    try:
+        return Decimal(str(valor))
+    except InvalidOperation:
+        return None
+
+
+def sombra_precio(precio):
+    """Valor de precio_indice para un precio según SOMBRA_PRECIO"""
+    precio = _decimal(precio)
+    if precio is None:
+        return None
+    if _politica()[0] == 'tramo':
+        tramo = Decimal(str(current_app.config.get('PRECIO_TRAMO', 50)))
+        return (precio / tramo).to_integral_value(rounding=ROUND_FLOOR) * tramo
+    return precio
+
+
+def sombra_disponible(disponible):
+    """Valor de disponible_indice según SOMBRA_DISPONIBLE"""
+    valor = '1' if disponible else '0'
+    if _politica()[1] == 'hmac':
+        return hmac.new(clave_indices(), f'vehiculos.disponible:{valor}'.encode(), hashlib.sha256).hexdigest()
+    return valor
+
+
+def actualizar_sombras(vehiculo):
+    vehiculo.precio_indice = sombra_precio(vehiculo.precio_semanal)
+    vehiculo.disponible_indice = sombra_disponible(
+        True if vehiculo.disponible is None else vehiculo.disponible
+    )
+
+
+@event.listens_for(Vehiculo, 'before_insert')
+@event.listens_for(Vehiculo, 'before_update')
+def _sombras_al_guardar(mapper, connection, vehiculo):
+    actualizar_sombras(vehiculo)
+
+
+# ==================== CONSULTAS ====================
+
+def filtro_disponible(disponible=True):
+    """Condición SQL (indexada) sobre la disponibilidad"""
+    return Vehiculo.disponible_indice == sombra_disponible(disponible)
+
+
+def filtro_precio(minimo=None, maximo=None):
+    """
+    Condiciones SQL (indexadas) para un rango de precio. Con la política 'tramo'
+    son aproximadas (por tramo completo): afinar el resultado con refinar_precio
+    """
+    condiciones = []
+    if minimo is not None:
+        condiciones.append(Vehiculo.precio_indice >= sombra_precio(minimo))
+    if maximo is not None:
+        condiciones.append(Vehiculo.precio_indice <= sombra_precio(maximo))
+    return condiciones
+
+
+def refinar_precio(vehiculos, minimo=None, maximo=None):
+    """Filtro exacto sobre el precio descifrado; solo hace falta con la política 'tramo'"""
+    if _politica()[0] != 'tramo' or (minimo is None and maximo is None):
+        return vehiculos
+    minimo, maximo = _decimal(minimo), _decimal(maximo)
+    return [
+        v for v in vehiculos
+        if v.precio_semanal is not None
+        and (minimo is None or v.precio_semanal >= minimo)
+        and (maximo is None or v.precio_semanal <= maximo)
+    ]
+
+
+def contar_disponibles():
+    return db.session.scalar(select(func.count(Vehiculo.id)).where(filtro_disponible(True)))
+
+
+# ==================== RELLENO ====================
+
+def rellenar_sombras(tamano_lote=500, reiniciar=False):
+    """
+    Calcula las sombras de los vehículos existentes en lotes confirmados, reanudando
+    desde el punto de control. El punto de control depende de la política y de la
+    clave del HMAC, así que al cambiar cualquiera empieza de cero.
+    Retorna la cantidad de filas actualizadas.
+    """
+    politica = ':'.join(_politica())
+    version = hashlib.sha256(clave_indices()).hexdigest()[:12]
+    punto = punto_control(f'{PROCESO}:{politica}:{version}', reiniciar)
+    if punto.completado:
+        return 0
+
+    actualizadas = 0
+    while True:
+        filas = db.session.execute(
+            select(Vehiculo.id, Vehiculo.precio_semanal, Vehiculo.disponible)
+            .where(Vehiculo.id > punto.ultimo_id)
+            .order_by(Vehiculo.id)
+            .limit(tamano_lote)
+        ).all()
+        if not filas:
+            punto.completado = True
+            db.session.commit()
+            return actualizadas
+
+        # UPDATE masivo por PK: no dispara los eventos de arriba ni descifra de nuevo
+        db.session.execute(update(Vehiculo), [
+            {
+                'id': fila_id,
+                'precio_indice': sombra_precio(precio),
+                'disponible_indice': sombra_disponible(True if disponible is None else disponible)
+            }
+            for fila_id, precio, disponible in ((f[0], en_claro(f[1]), en_claro(f[2])) for f in filas)
+        ])
+        punto.ultimo_id = filas[-1][0]
+        punto.procesados += len(filas)
+        actualizadas += len(filas)
+        db.session.commit()
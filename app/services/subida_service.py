@@ -0,0 +1,238 @@
+"""
+Subida Service - Subidas reanudables por bloques (videos de vehículos)
+
+Un video largo no cabe en MAX_CONTENT_LENGTH ni debe ocupar un worker en una
+sola petición. El cliente lo sube en bloques:
+
+    1. iniciar    -> crea la Subida y una subida multipart en el backend
+    2. agregar    -> sube un bloque como la siguiente parte, verificando su SHA-256
+    3. finalizar  -> une las partes, lo pasa al almacén y crea el VehiculoImagen
+
+Si la conexión se corta, el cliente consulta `recibido` y continúa desde ahí.
+Si finalizar falla por un error transitorio se puede reintentar: que el objeto
+ya se armó y verificó queda en un commit propio, así que no se vuelve a unir, y
+si ya pasó al almacén se recupera de ahí. Si el archivo no coincide con el
+declarado, la subida queda 'fallida' y sus datos se descartan.
+Cada bloque va directo del stream de la petición al backend (disco o S3), así
+que cualquier nodo detrás del balanceador puede recibir el siguiente bloque.
+"""
+import json
+import secrets
+
+from flask import current_app
+from sqlalchemy import update
+from app import db
+from app.models import Subida, VehiculoImagen
+from app.services.almacen_service import CARPETA, hash_objeto, recuperar_objeto, registrar_objeto
+from app.services.almacenamiento_service import almacenamiento
+from app.services.media_service import encolar_variantes
+
+
+EXTENSIONES_VIDEO = {'mp4'}
+TAMANO_MINIMO_PARTE = 5 * 1024 * 1024  # Mínimo de S3 para toda parte salvo la última
+
+
+class SubidaFallida(ValueError):
+    """El archivo armado no es el declarado: la subida no se puede completar"""
+
+
+class OffsetInvalido(Exception):
+    """El bloque no empieza donde termina lo recibido (bloque repetido o fuera de orden)"""
+    def __init__(self, recibido):
+        super().__init__(f'Offset inválido, se esperaba {recibido}')
+        self.recibido = recibido
+
+
+def subida_a_dict(subida):
+    return {
+        'id': subida.id,
+        'vehiculo_id': subida.vehiculo_id,
+        'nombre': subida.nombre_original,
+        'tamano_total': subida.tamano_total,
+        'recibido': subida.recibido,
+        'estado': subida.estado,
+        'tamano_bloque': current_app.config.get('SUBIDA_TAMANO_BLOQUE', 8 * 1024 * 1024),
+        'vehiculo_imagen_id': subida.vehiculo_imagen_id
+    }
+
+
+def iniciar_subida(vehiculo_id, nombre, tamano_total, sha256=None, usuario_id=None):
+    """Crea la subida y la subida multipart en el backend. No hace commit"""
+    maximo = current_app.config.get('SUBIDA_TAMANO_MAXIMO', 2 * 1024 * 1024 * 1024)
+    if not tamano_total or tamano_total <= 0:
+        raise ValueError('El tamaño del archivo es requerido')
+    if tamano_total > maximo:
+        raise ValueError(f'El archivo supera el máximo de {maximo // (1024 * 1024)} MB')
+    if sha256 and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256.lower())):
+        raise ValueError('sha256 inválido')
+
+    token = secrets.token_hex(16)
+    ruta = f'{CARPETA}/tmp/{token}'
+
+    subida = Subida(
+        id=token,
+        vehiculo_id=vehiculo_id,
+        nombre_original=nombre[:255],
+        extension=nombre.rsplit('.', 1)[1].lower(),
+        tamano_total=tamano_total,
+        recibido=0,
+        sha256=sha256.lower() if sha256 else None,
+        ruta_temporal=ruta,
+        upload_id=almacenamiento().iniciar_multipart(ruta),
+        partes='[]',
+        usuario_registro_id=usuario_id
+    )
+    db.session.add(subida)
+    return subida
+
+
+def agregar_bloque(subida, offset, stream, longitud, checksum):
+    """
+    Sube `longitud` bytes del stream como la siguiente parte. El backend verifica
+    el SHA-256 (`checksum`) y descarta la parte si no coincide. No hace commit.
+    Retorna el nuevo total recibido.
+    """
+    limite = current_app.config.get('SUBIDA_TAMANO_BLOQUE', 8 * 1024 * 1024)
+
+    if subida.estado != 'en_curso':
+        raise ValueError(f'La subida está {subida.estado}')
+    if offset != subida.recibido:
+        raise OffsetInvalido(subida.recibido)
+    if not longitud or longitud <= 0:
+        raise ValueError('Content-Length requerido')
+    if longitud > limite:
+        raise ValueError(f'El bloque supera el máximo de {limite} bytes')
+    if offset + longitud > subida.tamano_total:
+        raise ValueError('El bloque excede el tamaño declarado del archivo')
+    if offset + longitud < subida.tamano_total and longitud < TAMANO_MINIMO_PARTE:
+        raise ValueError(f'Todo bloque salvo el último debe tener al menos {TAMANO_MINIMO_PARTE} bytes')
+    if not checksum or len(checksum) != 64:
+        raise ValueError('Checksum SHA-256 del bloque requerido')
+
+    partes = json.loads(subida.partes or '[]')
+    numero = len(partes) + 1
+    etag = almacenamiento().subir_parte(
+        subida.ruta_temporal, subida.upload_id, numero, stream, longitud, checksum.lower()
+    )
+    partes.append([numero, etag, checksum.lower()])
+
+    # Condicionado por el offset: dos peticiones con el mismo bloque no avanzan dos veces
+    avanzado = db.session.execute(
+        update(Subida)
+        .where(Subida.id == subida.id, Subida.recibido == offset, Subida.estado == 'en_curso')
+        .values(recibido=offset + longitud, partes=json.dumps(partes))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.refresh(subida)
+    if not avanzado:
+        raise OffsetInvalido(subida.recibido)
+    return subida.recibido
+
+
+def _armar(subida):
+    """
+    Une las partes y verifica el archivo completo. El resultado se guarda en un
+    commit propio (upload_id=NULL, sha256 verificado): si el commit de finalizar
+    falla después, el reintento no vuelve a unir partes que ya no existen.
+    """
+    backend = almacenamiento()
+    if not backend.existe(subida.ruta_temporal):
+        backend.completar_multipart(
+            subida.ruta_temporal, subida.upload_id, [tuple(p) for p in json.loads(subida.partes)]
+        )
+
+    sha256, tamano = hash_objeto(subida.ruta_temporal)
+    if tamano != subida.tamano_total:
+        raise SubidaFallida(f'El archivo armado tiene {tamano} bytes, se esperaban {subida.tamano_total}')
+    if subida.sha256 and sha256 != subida.sha256:
+        raise SubidaFallida('El archivo recibido no coincide con el sha256 declarado')
+
+    with db.engine.begin() as conexion:
+        conexion.execute(
+            update(Subida)
+            .where(Subida.id == subida.id, Subida.upload_id == subida.upload_id)
+            .values(upload_id=None, sha256=sha256)
+        )
+
+
+def finalizar_subida(subida, usuario_id=None):
+    """
+    Une las partes, verifica el archivo completo, lo registra en el almacén y
+    crea el VehiculoImagen. No hace commit. Retorna el VehiculoImagen creado.
+    """
+    if subida.estado != 'en_curso':
+        raise ValueError(f'La subida está {subida.estado}')
+    if subida.recibido != subida.tamano_total:
+        raise ValueError(f'Faltan {subida.tamano_total - subida.recibido} bytes por subir')
+
+    # Sin upload_id: un intento anterior ya unió y verificó el archivo
+    if subida.upload_id:
+        _armar(subida)
+
+    tomada = db.session.execute(
+        update(Subida)
+        .where(Subida.id == subida.id, Subida.estado == 'en_curso', Subida.recibido == Subida.tamano_total)
+        .values(estado='completada')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.refresh(subida)
+    if not tomada:
+        raise ValueError(f'La subida está {subida.estado}')
+
+    if almacenamiento().existe(subida.ruta_temporal):
+        ruta, _ = registrar_objeto(
+            subida.ruta_temporal, subida.sha256, subida.tamano_total, subida.extension, subida.nombre_original
+        )
+    else:
+        # El intento anterior ya lo pasó al almacén y su commit falló
+        recuperado = recuperar_objeto(subida.sha256, subida.tamano_total, subida.extension, subida.nombre_original)
+        if recuperado is None:
+            raise SubidaFallida('El archivo de la subida ya no está disponible, súbalo de nuevo')
+        ruta, _ = recuperado
+
+    orden = VehiculoImagen.query.filter_by(vehiculo_id=subida.vehiculo_id).count()
+    imagen = VehiculoImagen(
+        vehiculo_id=subida.vehiculo_id,
+        tipo='video' if subida.extension in EXTENSIONES_VIDEO else 'imagen',
+        ruta=ruta,
+        nombre_archivo=subida.nombre_original,
+        orden=orden,
+        es_principal=(orden == 0),
+        usuario_registro_id=usuario_id
+    )
+    db.session.add(imagen)
+    db.session.flush()
+
+    if imagen.tipo == 'imagen':
+        encolar_variantes(imagen_id=imagen.id, usuario_id=usuario_id)
+
+    subida.ruta_temporal = None
+    subida.vehiculo_imagen_id = imagen.id
+    return imagen
+
+
+def marcar_fallida(subida):
+    """Descarta el objeto armado y las partes y marca la subida como fallida. No hace commit"""
+    backend = almacenamiento()
+    if subida.ruta_temporal:
+        backend.eliminar(subida.ruta_temporal)
+        if subida.upload_id:
+            backend.abortar_multipart(subida.ruta_temporal, subida.upload_id)
+    subida.estado = 'fallida'
+    subida.ruta_temporal = None
+    subida.upload_id = None
+
+
+def cancelar_subida(subida):
+    """Cancela la subida y descarta sus partes. No hace commit"""
+    if subida.estado != 'en_curso':
+        return False
+    backend = almacenamiento()
+    if subida.upload_id:
+        backend.abortar_multipart(subida.ruta_temporal, subida.upload_id)
+    else:
+        backend.eliminar(subida.ruta_temporal)
+    subida.estado = 'cancelada'
+    subida.ruta_temporal = None
+    subida.upload_id = None
+    return True
@@ -0,0 +1,106 @@
+"""
+Pruebas de subida_service: reintento de finalizar cuando el commit falla
+después de pasar el archivo al almacén
+"""
+import hashlib
+import io
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.config import TestingConfig
+from app.models import Archivo, Subida, VehiculoImagen
+from app.services.almacen_service import ruta_para
+from app.services.almacenamiento_service import AlmacenamientoLocal, almacenamiento
+from app.services.subida_service import agregar_bloque, finalizar_subida, iniciar_subida
+
+
+CONTENIDO = b'video de prueba ' * 1024
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Base en archivo: finalizar guarda el armado con una conexión propia
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path / "pruebas.db"}')
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_ENGINE_OPTIONS', {})
+    app = create_app('testing')
+    with app.app_context():
+        app.extensions['almacenamiento'] = AlmacenamientoLocal(str(tmp_path / 'static'), str(tmp_path / 'cuarentena'))
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def subida_completa():
+    subida = iniciar_subida(1, 'video.mp4', len(CONTENIDO))
+    db.session.commit()
+    agregar_bloque(subida, 0, io.BytesIO(CONTENIDO), len(CONTENIDO), hashlib.sha256(CONTENIDO).hexdigest())
+    db.session.commit()
+    return subida
+
+
+def finalizar_con_commit_fallido(subida):
+    """finalizar_subida seguido de un commit que falla, como lo maneja la ruta"""
+    def fallar(session):
+        if session.in_nested_transaction():
+            return
+        raise RuntimeError('commit fallido')
+
+    event.listen(db.session, 'before_commit', fallar)
+    try:
+        finalizar_subida(subida)
+        with pytest.raises(RuntimeError):
+            db.session.commit()
+    finally:
+        event.remove(db.session, 'before_commit', fallar)
+    db.session.rollback()
+
+
+def test_reintento_despues_de_commit_fallido(app):
+    subida = subida_completa()
+    finalizar_con_commit_fallido(subida)
+
+    db.session.refresh(subida)
+    assert subida.estado == 'en_curso'
+    assert subida.upload_id is None
+    assert not almacenamiento().existe(subida.ruta_temporal)
+    assert Archivo.query.count() == 0
+
+    imagen = finalizar_subida(subida)
+    db.session.commit()
+
+    sha256 = hashlib.sha256(CONTENIDO).hexdigest()
+    assert imagen.ruta == ruta_para(sha256, 'mp4')
+    assert almacenamiento().existe(imagen.ruta)
+    assert Archivo.query.filter_by(sha256=sha256).one().referencias == 1
+    assert VehiculoImagen.query.count() == 1
+    assert db.session.get(Subida, subida.id).estado == 'completada'
+
+
+def test_reintento_con_contenido_ya_registrado(app):
+    sha256 = hashlib.sha256(CONTENIDO).hexdigest()
+    ruta = ruta_para(sha256, 'mp4')
+    almacenamiento().guardar(ruta, io.BytesIO(CONTENIDO))
+    db.session.add(Archivo(sha256=sha256, ruta=ruta, tamano=len(CONTENIDO), extension='mp4',
+                           nombre_original='otro.mp4', referencias=1))
+    db.session.commit()
+
+    subida = subida_completa()
+    finalizar_con_commit_fallido(subida)
+    assert Archivo.query.one().referencias == 1
+
+    imagen = finalizar_subida(subida)
+    db.session.commit()
+
+    assert imagen.ruta == ruta
+    assert Archivo.query.one().referencias == 2
+
+
+def test_reintento_sin_objeto_disponible(app):
+    subida = subida_completa()
+    finalizar_con_commit_fallido(subida)
+    almacenamiento().eliminar(ruta_para(hashlib.sha256(CONTENIDO).hexdigest(), 'mp4'))
+
+    with pytest.raises(ValueError, match='ya no está disponible'):
+        finalizar_subida(subida)
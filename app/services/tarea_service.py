@@ -0,0 +1,391 @@
+"""
+Tarea Service - Cola de trabajos en segundo plano respaldada por la base de datos
+
+Los endpoints pesados encolan una Tarea y responden de inmediato; los procesos
+iniciados con `flask worker` la toman, la ejecutan y guardan el resultado.
+No requiere broker externo: la tabla `tareas` es la cola.
+
+Para agregar un tipo de tarea basta con registrar una función:
+
+    @tarea('mi_tipo')
+    def mi_tarea(avance, **parametros):
+        avance(50, 'Mitad')
+        return {'clave': 'valor'}
+
+`avance(progreso, mensaje)` publica el progreso (0-100) para los endpoints de estado.
+Si el resultado incluye 'archivo' (bytes), 'archivo_nombre' y 'archivo_mimetype',
+el archivo se guarda en la tarea para descargarlo después.
+
+Mientras ejecuta una tarea, el worker renueva su `latido` cada TAREAS_LATIDO
+segundos desde un hilo aparte, sin depender del progreso que reporte el
+manejador. Solo se reencolan las tareas cuyo latido tiene más de TAREAS_TIMEOUT
+segundos (el worker murió), así una tarea larga nunca la toma un segundo worker.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+from app import db
+from app.models import Tarea
+
+
+HANDLERS = {}
+
+
+def tarea(tipo):
+    """Decorador que registra una función como manejador de un tipo de tarea"""
+    def decorador(funcion):
+        HANDLERS[tipo] = funcion
+        return funcion
+    return decorador
+
+
+# ==================== ENCOLAR / CONSULTAR ====================
+
+def encolar(tipo, parametros=None, usuario_id=None, max_intentos=3, confirmar=True):
+    """
+    Crea una tarea pendiente y la confirma para que un worker la tome.
+    Con confirmar=False solo la agrega a la sesión: se guarda (o se descarta)
+    junto con el resto de la transacción del llamador
+    """
+    if tipo not in HANDLERS:
+        raise ValueError(f'Tipo de tarea desconocido: {tipo}')
+
+    nueva = Tarea(
+        tipo=tipo,
+        parametros=json.dumps(parametros or {}, default=str),
+        max_intentos=max_intentos,
+        ejecutar_despues=datetime.utcnow(),
+        usuario_registro_id=usuario_id
+    )
+    db.session.add(nueva)
+    if confirmar:
+        db.session.commit()
+    return nueva
+
+
+def tarea_a_dict(t):
+    """Estado de una tarea para los endpoints de consulta"""
+    return {
+        'id': t.id,
+        'tipo': t.tipo,
+        'estado': t.estado,
+        'progreso': t.progreso or 0,
+        'mensaje': t.mensaje,
+        'intentos': t.intentos,
+        'max_intentos': t.max_intentos,
+        'resultado': json.loads(t.resultado) if t.resultado else None,
+        'error': t.error.strip().splitlines()[-1] if t.error else None,
+        'tiene_archivo': bool(t.archivo_nombre),
+        'fecha_hora_registro': t.fecha_hora_registro.isoformat() if t.fecha_hora_registro else None,
+        'fecha_inicio': t.fecha_inicio.isoformat() if t.fecha_inicio else None,
+        'fecha_fin': t.fecha_fin.isoformat() if t.fecha_fin else None
+    }
+
+
+def cancelar(t):
+    """Cancela una tarea que todavía no empezó. Retorna True si se canceló"""
+    cancelada = db.session.execute(
+        update(Tarea)
+        .where(Tarea.id == t.id, Tarea.estado == 'pendiente')
+        .values(estado='cancelada', fecha_fin=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    db.session.refresh(t)
+    return bool(cancelada)
+
+
+def reportar_progreso(tarea_id, progreso, mensaje=None):
+    """
+    Publica el progreso en una conexión aparte: queda visible de inmediato
+    sin confirmar el trabajo que la tarea tiene en curso en la sesión
+    """
+    valores = {'progreso': max(0, min(100, int(progreso))), 'fecha_hora_actualizo': datetime.utcnow()}
+    if mensaje is not None:
+        valores['mensaje'] = mensaje[:255]
+    with db.engine.begin() as conexion:
+        conexion.execute(
+            update(Tarea.__table__).where(Tarea.__table__.c.id == tarea_id).values(**valores)
+        )
+
+
+# ==================== WORKER ====================
+
+def reencolar_huerfanas(timeout):
+    """Devuelve a la cola las tareas en_proceso sin latido reciente (worker caído)"""
+    ahora = datetime.utcnow()
+    reencoladas = db.session.execute(
+        update(Tarea)
+        .where(Tarea.estado == 'en_proceso', Tarea.latido < ahora - timedelta(seconds=timeout))
+        .values(estado='pendiente', worker=None, ejecutar_despues=ahora)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return reencoladas
+
+
+def tomar_tarea(worker_id):
+    """
+    Reclama la siguiente tarea pendiente. El UPDATE condicionado por estado
+    garantiza que dos workers no tomen la misma tarea.
+    """
+    ahora = datetime.utcnow()
+    candidatas = db.session.execute(
+        select(Tarea.id)
+        .where(Tarea.estado == 'pendiente', Tarea.ejecutar_despues <= ahora)
+        .order_by(Tarea.ejecutar_despues, Tarea.id)
+        .limit(5)
+    ).scalars().all()
+
+    for tarea_id in candidatas:
+        tomada = db.session.execute(
+            update(Tarea)
+            .where(Tarea.id == tarea_id, Tarea.estado == 'pendiente')
+            .values(
+                estado='en_proceso',
+                worker=worker_id,
+                intentos=Tarea.intentos + 1,
+                progreso=0,
+                fecha_inicio=ahora,
+                latido=ahora
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if tomada:
+            return db.session.get(Tarea, tarea_id)
+
+    db.session.commit()
+    return None
+
+
+def _latir(engine, tarea_id, worker_id, intervalo, detener):
+    """Hilo del worker: renueva el latido de la tarea hasta que termine"""
+    tabla = Tarea.__table__
+    while not detener.wait(intervalo):
+        try:
+            with engine.begin() as conexion:
+                conexion.execute(
+                    update(tabla)
+                    .where(tabla.c.id == tarea_id, tabla.c.worker == worker_id, tabla.c.estado == 'en_proceso')
+                    .values(latido=datetime.utcnow())
+                )
+        except Exception:
+            pass  # Un fallo puntual de conexión se corrige en el siguiente latido
+
+
+def ejecutar_tarea(t):
+    """Ejecuta una tarea tomada y registra su resultado o programa el reintento"""
+    tarea_id = t.id
+    parametros = json.loads(t.parametros or '{}')
+
+    detener = threading.Event()
+    threading.Thread(
+        target=_latir,
+        args=(db.engine, tarea_id, t.worker, current_app.config.get('TAREAS_LATIDO', 30), detener),
+        daemon=True
+    ).start()
+    try:
+        return _ejecutar_con_reintento(t, tarea_id, parametros)
+    finally:
+        detener.set()
+
+
+def _ejecutar_con_reintento(t, tarea_id, parametros):
+    """Corre el manejador y guarda el resultado, o programa el reintento si falla"""
+    try:
+        manejador = HANDLERS.get(t.tipo)
+        if manejador is None:
+            raise ValueError(f'Tipo de tarea desconocido: {t.tipo}')
+
+        resultado = manejador(
+            lambda progreso, mensaje=None: reportar_progreso(tarea_id, progreso, mensaje),
+            **parametros
+        ) or {}
+
+        t = db.session.get(Tarea, tarea_id)
+        if 'archivo' in resultado:
+            t.archivo = resultado.pop('archivo')
+            t.archivo_nombre = resultado.pop('archivo_nombre', f'tarea_{tarea_id}')
+            t.archivo_mimetype = resultado.pop('archivo_mimetype', 'application/octet-stream')
+        t.resultado = json.dumps(resultado, default=str)
+        t.estado = 'completada'
+        t.progreso = 100
+        t.error = None
+        t.fecha_fin = datetime.utcnow()
+        db.session.commit()
+        return True
+
+    except Exception:
+        db.session.rollback()
+        t = db.session.get(Tarea, tarea_id)
+        t.error = traceback.format_exc()[-4000:]
+        if t.intentos < t.max_intentos:
+            # Backoff exponencial: 30s, 60s, 120s...
+            t.estado = 'pendiente'
+            t.ejecutar_despues = datetime.utcnow() + timedelta(seconds=30 * 2 ** (t.intentos - 1))
+        else:
+            t.estado = 'fallida'
+            t.fecha_fin = datetime.utcnow()
+        db.session.commit()
+        current_app.logger.error(f"Tarea {tarea_id} ({t.tipo}) falló en el intento {t.intentos}")
+        return False
+
+
+def trabajar(worker_id=None, una_vez=False):
+    """
+    Bucle del worker: toma y ejecuta tareas hasta ser detenido.
+    Con una_vez=True termina cuando la cola queda vacía. Retorna las tareas procesadas
+    """
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    intervalo = current_app.config.get('TAREAS_INTERVALO', 2)
+    timeout = current_app.config.get('TAREAS_TIMEOUT', 300)
+
+    procesadas = 0
+    while True:
+        reencolar_huerfanas(timeout)
+        t = tomar_tarea(worker_id)
+        if t is not None:
+            ejecutar_tarea(t)
+            procesadas += 1
+            continue
+        if una_vez:
+            return procesadas
+        time.sleep(intervalo)
+
+
+def _proceso_worker(una_vez):
+    """Punto de entrada de cada proceso hijo: crea su propia app y conexiones"""
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        trabajar(una_vez=una_vez)
+
+
+def iniciar_workers(procesos=1, una_vez=False):
+    """Inicia `procesos` workers; con uno solo corre en el proceso actual"""
+    if procesos <= 1:
+        return trabajar(una_vez=una_vez)
+
+    import multiprocessing
+    hijos = [
+        multiprocessing.Process(target=_proceso_worker, args=(una_vez,), name=f'worker-{n}')
+        for n in range(procesos)
+    ]
+    for hijo in hijos:
+        hijo.start()
+    try:
+        for hijo in hijos:
+            hijo.join()
+    except KeyboardInterrupt:
+        for hijo in hijos:
+            hijo.terminate()
+        for hijo in hijos:
+            hijo.join()
+
+
+# ==================== TIPOS DE TAREA ====================
+
+@tarea('exportar_excel_semana')
+def _exportar_excel_semana(avance, semana_id):
+    from app.models import SemanaAlquiler
+    from app.services.semana_service import (
+        generar_excel_semana, nombre_excel_semana, obtener_snapshot_semana, EXCEL_MIMETYPE
+    )
+    semana = db.session.get(SemanaAlquiler, semana_id)
+    if semana is None:
+        raise ValueError(f'Semana {semana_id} no existe')
+
+    avance(10, 'Generando Excel')
+    snapshot = obtener_snapshot_semana(semana)
+    return {
+        'semana_id': semana_id,
+        'archivo': snapshot.excel if snapshot else generar_excel_semana(semana),
+        'archivo_nombre': nombre_excel_semana(semana),
+        'archivo_mimetype': EXCEL_MIMETYPE
+    }
+
+
+@tarea('recalcular_nomina')
+def _recalcular_nomina(avance, anio=None, semana_ids=None):
+    from app.services.nomina_service import recalcular_semanas
+    avance(5, 'Recalculando nómina')
+    detalles, semanas = recalcular_semanas(anio=anio, semana_ids=semana_ids)
+    return {'detalles': detalles, 'semanas': semanas}
+
+
+@tarea('repreciar_porcentaje')
+def _repreciar_porcentaje(avance, porcentaje_id, alcance='abiertas', desde=None, hasta=None):
+    from app.models import PorcentajeGanancia
+    from app.services.nomina_service import repreciar_porcentaje
+    porcentaje = db.session.get(PorcentajeGanancia, porcentaje_id)
+    if porcentaje is None:
+        raise ValueError(f'Porcentaje {porcentaje_id} no existe')
+
+    avance(5, 'Recalculando detalles')
+    desde = datetime.strptime(desde, '%Y-%m-%d').date() if desde else None
+    hasta = datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else None
+    resumen = repreciar_porcentaje(porcentaje, alcance, desde, hasta, aplicar=True, limite_vista=0)
+    db.session.commit()
+    return {k: v for k, v in resumen.items() if k != 'cambios'}
+
+
+@tarea('actualizar_mora')
+def _actualizar_mora(avance, fecha=None):
+    from app.services.mora_service import actualizar_moras
+    avance(5, 'Actualizando mora')
+    return actualizar_moras(datetime.strptime(fecha, '%Y-%m-%d').date() if fecha else None)
+
+
+@tarea('variantes_imagen')
+def _variantes_imagen(avance, ruta=None, imagen_id=None):
+    from app.models import VehiculoImagen
+    from app.services.media_service import generar_variantes
+
+    imagen = None
+    if imagen_id:
+        imagen = db.session.get(VehiculoImagen, imagen_id)
+        if imagen is None:
+            return {'omitida': 'imagen eliminada'}
+        if imagen.tipo != 'imagen':
+            return {'omitida': 'no es imagen'}
+        ruta = imagen.ruta
+
+    avance(10, 'Generando variantes')
+    rutas = generar_variantes(ruta)
+
+    if imagen is not None and rutas:
+        imagen.ruta_miniatura = rutas.get('miniatura')
+        imagen.ruta_display = rutas.get('display')
+        db.session.commit()
+    return {'ruta': ruta, 'variantes': rutas}
+
+
+@tarea('limpiar_archivos')
+def _limpiar_archivos(avance, modo='cuarentena', gracia_horas=None):
+    from app.services.limpieza_service import limpiar_archivos
+    return limpiar_archivos(modo=modo, gracia_horas=gracia_horas, avance=avance)
+
+
+@tarea('huella_imagen')
+def _huella_imagen(avance, ruta):
+    from app.models import Archivo
+    from app.services.huella_service import registrar_huella
+
+    archivo = Archivo.query.filter_by(ruta=ruta).first()
+    if archivo is None:
+        return {'omitida': 'archivo eliminado'}
+
+    avance(10, 'Calculando huella')
+    registro = registrar_huella(archivo)
+    if registro is None:
+        return {'omitida': 'Pillow no disponible'}
+    db.session.commit()
+    return {'ruta': ruta, 'hash': f'{registro.hash & 0xFFFFFFFFFFFFFFFF:016x}'}
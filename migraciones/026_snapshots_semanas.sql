@@ -0,0 +1,26 @@
+-- ================================================================================
+-- MIGRACIÓN: Snapshots inmutables de semanas cerradas (semana_service)
+-- Tabla nueva snapshots_semanas
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/026_snapshots_semanas.sql
+
+USE alquiler_vehiculos;
+
+CREATE TABLE IF NOT EXISTS snapshots_semanas (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    semana_alquiler_id INT NOT NULL,
+    datos_json_gz MEDIUMBLOB NOT NULL,
+    excel MEDIUMBLOB NOT NULL,
+    etag VARCHAR(64) NOT NULL,
+    etag_excel VARCHAR(64) NOT NULL,
+    usuario_registro_id INT,
+    fecha_hora_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE INDEX ix_snapshots_semanas_semana_alquiler_id (semana_alquiler_id),
+    FOREIGN KEY (semana_alquiler_id) REFERENCES semanas_alquiler(id) ON DELETE CASCADE,
+    FOREIGN KEY (usuario_registro_id) REFERENCES usuarios(id) ON DELETE CASCADE
+);
+
+-- Las semanas cerradas antes de esta migración no tienen snapshot: se sirven
+-- en vivo hasta que se reabran y se vuelvan a cerrar
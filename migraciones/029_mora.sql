@@ -0,0 +1,27 @@
+-- ================================================================================
+-- MIGRACIÓN: Mora y penalizaciones (proceso nocturno `flask actualizar-mora`)
+-- Columnas e índices nuevos en detalles_alquiler_semanal y deudas
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/029_mora.sql
+
+USE alquiler_vehiculos;
+
+ALTER TABLE detalles_alquiler_semanal
+ADD COLUMN en_mora BOOLEAN NOT NULL DEFAULT FALSE AFTER fecha_limite_pago,
+ADD COLUMN dias_mora INT NOT NULL DEFAULT 0 AFTER en_mora,
+ADD COLUMN penalizacion_mora DECIMAL(10,2) DEFAULT 0.00 AFTER dias_mora,
+ADD COLUMN fecha_calculo_mora DATE AFTER penalizacion_mora,
+ADD INDEX ix_detalles_alquiler_semanal_fecha_limite_pago (fecha_limite_pago),
+ADD INDEX ix_detalles_alquiler_semanal_en_mora (en_mora),
+ADD INDEX ix_detalles_alquiler_semanal_dias_mora (dias_mora);
+
+ALTER TABLE deudas
+ADD COLUMN penalizacion_acumulada DECIMAL(10,2) DEFAULT 0.00 AFTER penalizacion_diaria,
+ADD COLUMN fecha_calculo_mora DATE AFTER penalizacion_acumulada,
+ADD INDEX ix_deudas_dias_retraso (dias_retraso),
+ADD INDEX ix_deudas_estado (estado);
+
+-- Después, calcular la mora actual:
+-- flask actualizar-mora
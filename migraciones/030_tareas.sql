@@ -0,0 +1,41 @@
+-- ================================================================================
+-- MIGRACIÓN: Cola de tareas en segundo plano (`flask worker`)
+-- Tabla nueva tareas
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/030_tareas.sql
+
+USE alquiler_vehiculos;
+
+CREATE TABLE IF NOT EXISTS tareas (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    tipo VARCHAR(100) NOT NULL,
+    parametros TEXT,
+    estado ENUM('pendiente', 'en_proceso', 'completada', 'fallida', 'cancelada') NOT NULL DEFAULT 'pendiente',
+    progreso INT DEFAULT 0,
+    mensaje VARCHAR(255),
+    intentos INT NOT NULL DEFAULT 0,
+    max_intentos INT NOT NULL DEFAULT 3,
+    ejecutar_despues DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    error TEXT,
+    resultado TEXT,
+    archivo MEDIUMBLOB,
+    archivo_nombre VARCHAR(255),
+    archivo_mimetype VARCHAR(150),
+    worker VARCHAR(100),
+    latido DATETIME,
+    fecha_inicio DATETIME,
+    fecha_fin DATETIME,
+    usuario_registro_id INT,
+    fecha_hora_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
+    fecha_hora_actualizo DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX ix_tareas_tipo (tipo),
+    INDEX ix_tareas_estado (estado),
+    INDEX ix_tareas_ejecutar_despues (ejecutar_despues),
+    INDEX ix_tareas_latido (latido),
+    FOREIGN KEY (usuario_registro_id) REFERENCES usuarios(id) ON DELETE SET NULL
+);
+
+-- Después, iniciar los workers:
+-- flask worker
@@ -0,0 +1,16 @@
+-- ================================================================================
+-- MIGRACIÓN: Variantes (miniatura / display) de las imágenes de vehículos
+-- Columnas nuevas en vehiculos_imagenes
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/031_variantes_imagenes.sql
+
+USE alquiler_vehiculos;
+
+ALTER TABLE vehiculos_imagenes
+ADD COLUMN ruta_miniatura VARCHAR(500) DEFAULT NULL AFTER ruta,
+ADD COLUMN ruta_display VARCHAR(500) DEFAULT NULL AFTER ruta_miniatura;
+
+-- Después, encolar las variantes de las imágenes existentes:
+-- flask generar-variantes
@@ -0,0 +1,23 @@
+-- ================================================================================
+-- MIGRACIÓN: Almacén de archivos direccionado por contenido (almacen_service)
+-- Tabla nueva archivos
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/032_archivos.sql
+
+USE alquiler_vehiculos;
+
+CREATE TABLE IF NOT EXISTS archivos (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    sha256 VARCHAR(64) NOT NULL,
+    ruta VARCHAR(500) NOT NULL UNIQUE,
+    tamano BIGINT NOT NULL,
+    extension VARCHAR(10),
+    nombre_original VARCHAR(255),
+    referencias INT NOT NULL DEFAULT 0,
+    cifrado BOOLEAN NOT NULL DEFAULT FALSE,
+    fecha_hora_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
+    fecha_hora_actualizo DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE INDEX ix_archivos_sha256 (sha256)
+);
@@ -0,0 +1,32 @@
+-- ================================================================================
+-- MIGRACIÓN: Subidas reanudables por bloques (subida_service)
+-- Tabla nueva subidas
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/034_subidas.sql
+
+USE alquiler_vehiculos;
+
+CREATE TABLE IF NOT EXISTS subidas (
+    id VARCHAR(32) PRIMARY KEY,
+    vehiculo_id INT NOT NULL,
+    nombre_original VARCHAR(255) NOT NULL,
+    extension VARCHAR(10) NOT NULL,
+    tamano_total BIGINT NOT NULL,
+    recibido BIGINT NOT NULL DEFAULT 0,
+    sha256 VARCHAR(64),
+    ruta_temporal VARCHAR(500),
+    upload_id VARCHAR(255),
+    partes TEXT,
+    estado ENUM('en_curso', 'completada', 'cancelada', 'fallida') NOT NULL DEFAULT 'en_curso',
+    vehiculo_imagen_id INT,
+    usuario_registro_id INT,
+    fecha_hora_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
+    fecha_hora_actualizo DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX ix_subidas_vehiculo_id (vehiculo_id),
+    INDEX ix_subidas_estado (estado),
+    FOREIGN KEY (vehiculo_id) REFERENCES vehiculos(id) ON DELETE CASCADE,
+    FOREIGN KEY (vehiculo_imagen_id) REFERENCES vehiculos_imagenes(id) ON DELETE SET NULL,
+    FOREIGN KEY (usuario_registro_id) REFERENCES usuarios(id) ON DELETE SET NULL
+);
@@ -0,0 +1,22 @@
+-- ================================================================================
+-- MIGRACIÓN: Puntos de control de procesos por lotes reanudables (migracion_service)
+-- Tabla nueva puntos_control
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/036_puntos_control.sql
+
+USE alquiler_vehiculos;
+
+CREATE TABLE IF NOT EXISTS puntos_control (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    clave VARCHAR(150) NOT NULL UNIQUE,
+    ultimo_id INT NOT NULL DEFAULT 0,
+    procesados INT NOT NULL DEFAULT 0,
+    completado BOOLEAN NOT NULL DEFAULT FALSE,
+    fecha_hora_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
+    fecha_hora_actualizo DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- Después, mover los archivos a las carpetas repartidas:
+-- flask migrar-uploads
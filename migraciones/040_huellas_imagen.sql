@@ -0,0 +1,28 @@
+-- ================================================================================
+-- MIGRACIÓN: Hash perceptual de imágenes de documentos (huella_service)
+-- Tabla nueva huellas_imagen
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/040_huellas_imagen.sql
+
+USE alquiler_vehiculos;
+
+CREATE TABLE IF NOT EXISTS huellas_imagen (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    archivo_id INT NOT NULL UNIQUE,
+    hash BIGINT NOT NULL,
+    segmento_0 INT NOT NULL,
+    segmento_1 INT NOT NULL,
+    segmento_2 INT NOT NULL,
+    segmento_3 INT NOT NULL,
+    fecha_hora_registro DATETIME DEFAULT CURRENT_TIMESTAMP,
+    INDEX ix_huellas_imagen_segmento_0 (segmento_0),
+    INDEX ix_huellas_imagen_segmento_1 (segmento_1),
+    INDEX ix_huellas_imagen_segmento_2 (segmento_2),
+    INDEX ix_huellas_imagen_segmento_3 (segmento_3),
+    FOREIGN KEY (archivo_id) REFERENCES archivos(id) ON DELETE CASCADE
+);
+
+-- Después, calcular las huellas de los documentos existentes:
+-- flask calcular-huellas
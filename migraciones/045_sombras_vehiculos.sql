@@ -0,0 +1,19 @@
+-- ================================================================================
+-- MIGRACIÓN: Columnas sombra consultables de precio y disponibilidad (sombra_service)
+-- Columnas e índices nuevos en vehiculos
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/045_sombras_vehiculos.sql
+
+USE alquiler_vehiculos;
+
+ALTER TABLE vehiculos
+ADD COLUMN precio_indice DECIMAL(10,2) DEFAULT NULL AFTER disponible,
+ADD COLUMN disponible_indice VARCHAR(64) DEFAULT NULL AFTER precio_indice,
+ADD INDEX ix_vehiculos_precio_indice (precio_indice),
+ADD INDEX ix_vehiculos_disponible_indice (disponible_indice);
+
+-- Después, calcular las sombras de los vehículos existentes (el dashboard y los
+-- filtros de /api/vehiculos las usan):
+-- flask rellenar-sombras
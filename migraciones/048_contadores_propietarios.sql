@@ -0,0 +1,16 @@
+-- ================================================================================
+-- MIGRACIÓN: Contadores cacheados en propietarios (contador_service)
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/048_contadores_propietarios.sql
+
+USE alquiler_vehiculos;
+
+ALTER TABLE propietarios
+ADD COLUMN vehiculos_count INT NOT NULL DEFAULT 0 AFTER email,
+ADD COLUMN referencias_count INT NOT NULL DEFAULT 0 AFTER vehiculos_count,
+ADD COLUMN alquileres_activos_count INT NOT NULL DEFAULT 0 AFTER referencias_count;
+
+-- Después, calcular los contadores reales de los propietarios existentes:
+-- flask reparar-contadores
@@ -0,0 +1,31 @@
+-- ================================================================================
+-- MIGRACIÓN: Libro de rentabilidad por vehículo y semana (libro_service)
+-- Tabla nueva libro_vehiculos_semanal
+-- ================================================================================
+
+-- Para ejecutar sobre una base existente:
+-- mysql -u root -p alquiler_vehiculos < migraciones/050_libro_vehiculos_semanal.sql
+
+USE alquiler_vehiculos;
+
+CREATE TABLE IF NOT EXISTS libro_vehiculos_semanal (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    vehiculo_id INT NOT NULL,
+    propietario_id INT NOT NULL,
+    semana_inicio DATE NOT NULL,
+    ingreso DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    nomina_empresa DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    descuentos DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    inversion_mecanica DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    costo_trabajos DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    costo_piezas DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    fecha_hora_actualizo DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT uq_libro_semana_vehiculo UNIQUE (semana_inicio, vehiculo_id),
+    INDEX ix_libro_propietario_semana (propietario_id, semana_inicio),
+    INDEX ix_libro_vehiculo_semana (vehiculo_id, semana_inicio),
+    FOREIGN KEY (vehiculo_id) REFERENCES vehiculos(id) ON DELETE CASCADE,
+    FOREIGN KEY (propietario_id) REFERENCES propietarios(id) ON DELETE CASCADE
+);
+
+-- Después, reconstruir el libro con el historial existente:
+-- flask reconstruir-libro